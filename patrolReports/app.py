@@ -4,12 +4,24 @@ Search through historical submarine patrol reports with highlighted results.
 """
 
 import os
-import re
 import json
 import glob
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import (Flask, render_template, request, jsonify, send_from_directory, Response,
+                   stream_with_context, url_for)
+from werkzeug.exceptions import NotFound
 import fitz  # PyMuPDF
 
+import page_images
+import pdf_text
+import report_catalog
+import scan_tiles
+import search_cache
+import search_index
+import search_metrics
+import search_related
+import search_shards
+import search_trace
+
 # Load environment variables
 try:
     from dotenv import load_dotenv
@@ -34,49 +46,34 @@ PDF_OCR_DIR = REPORTS_DIR  # V3 PDFs are named *_v3.pdf
 # Serve V3 PDFs for viewing (they have text layers for selection/Ctrl+F)
 PDF_DIR = REPORTS_DIR
 
-# Cache for extracted PDF text
-pdf_cache = {}
-
 
 def extract_text_from_pdf(pdf_path):
-    """Extract text from a PDF file, returning a list of (page_num, text) tuples."""
-    if pdf_path in pdf_cache:
-        return pdf_cache[pdf_path]
-    
-    pages = []
+    """
+    Extract text from a PDF file, returning a list of (page_num, text) tuples.
+    Extraction is cached on disk by content (see pdf_text.py).
+    """
     try:
-        doc = fitz.open(pdf_path)
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = page.get_text()
-            pages.append((page_num + 1, text))  # 1-indexed page numbers
-        doc.close()
+        return pdf_text.get_pdf_text(pdf_path).pages()
     except Exception as e:
         print(f"Error extracting text from {pdf_path}: {e}")
         return []
-    
-    pdf_cache[pdf_path] = pages
-    return pages
 
 
 def get_pdf_files():
     """Get list of main PDF files (not OCR variants)."""
-    return sorted([f for f in os.listdir(PDF_ORIGINAL_DIR) 
-                   if f.endswith('.pdf') 
-                   and not f.endswith('_v3.pdf') 
-                   and not f.endswith('_improved.pdf') 
-                   and not f.endswith('_gv.pdf')
-                   and not f.endswith('_corrected.pdf')
-                   and 'test_' not in f])
+    return report_catalog.get_catalog().report_names()
 
 
-def search_pdfs(query, context_chars=150):
-    """
-    Search through all PDFs for the query pattern.
-    Returns matches with context.
-    """
+def get_ocr_pdf_path(pdf_name):
+    """The PDF a report's OCR text comes from: V3 if there is one, else the original."""
+    path = report_catalog.get_catalog().variant_path(pdf_name, report_catalog.TEXT_VARIANTS)
+    return path or os.path.join(PDF_ORIGINAL_DIR, pdf_name)
+
+
+def normalize_query(query):
+    """Strip whitespace and surrounding quotes. Returns '' if too short to search."""
     if not query or len(query.strip()) < 2:
-        return []
+        return ''
     
     # Strip surrounding quotes if present
     query = query.strip()
@@ -85,82 +82,24 @@ def search_pdfs(query, context_chars=150):
         query = query[1:-1]
     
     if not query or len(query.strip()) < 2:
+        return ''
+    return query
+
+
+def search_pdfs(query, context_chars=150, mode='exact', max_distance=None, date_range=None,
+                boats=None):
+    """
+    Search through the PDFs of the given boats (default all) for the query
+    pattern. Returns matches with context.
+    """
+    # Quotes mark phrases in boolean queries and may be part of a regex
+    query = normalize_query(query) if mode not in RAW_QUERY_MODES else query.strip()
+    if not query:
         return []
     
-    results = []
-    pdf_files = get_pdf_files()
-    
-    # Create regex pattern (case-insensitive)
-    try:
-        pattern = re.compile(re.escape(query), re.IGNORECASE)
-    except re.error:
-        return []
-    
-    for pdf_file in pdf_files:
-        # Load corrections for this PDF
-        corrections = load_corrections(pdf_file)
-        
-        # Try Google Vision OCR first (best quality), then V3, then original
-        base_name = pdf_file.replace('.pdf', '')
-        gv_json = os.path.join(REPORTS_DIR, f"{base_name}_gv_ocr.json")
-        
-        if os.path.exists(gv_json):
-            # Use Google Vision OCR text
-            with open(gv_json, 'r', encoding='utf-8') as f:
-                gv_data = json.load(f)
-            pages = [(int(pn), txt) for pn, txt in gv_data.items()]
-            pages.sort(key=lambda x: x[0])
-        else:
-            # Fall back to V3 or original PDF
-            v3_path = os.path.join(PDF_OCR_DIR, f"{base_name}_v3.pdf")
-            if os.path.exists(v3_path):
-                pdf_path = v3_path
-            else:
-                pdf_path = os.path.join(PDF_ORIGINAL_DIR, pdf_file)
-            pages = extract_text_from_pdf(pdf_path)
-        
-        for page_num, ocr_text in pages:
-            # Use correction if available, otherwise OCR
-            text = corrections.get(str(page_num), ocr_text)
-            # Find all matches in this page
-            for match in pattern.finditer(text):
-                start = match.start()
-                end = match.end()
-                
-                # Get context around the match
-                context_start = max(0, start - context_chars)
-                context_end = min(len(text), end + context_chars)
-                
-                # Adjust to word boundaries
-                if context_start > 0:
-                    # Find the start of the word or sentence
-                    while context_start > 0 and text[context_start - 1] not in ' \n\t':
-                        context_start -= 1
-                
-                if context_end < len(text):
-                    # Find the end of the word or sentence
-                    while context_end < len(text) and text[context_end] not in ' \n\t':
-                        context_end += 1
-                
-                context = text[context_start:context_end]
-                
-                # Clean up the context (remove excessive whitespace)
-                context = ' '.join(context.split())
-                
-                # Calculate relative position of match in context
-                match_in_context_start = start - context_start
-                match_in_context_end = end - context_start
-                
-                results.append({
-                    'pdf_file': pdf_file,
-                    'page_num': page_num,
-                    'context': context,
-                    'match_start': match_in_context_start,
-                    'match_end': match_in_context_end,
-                    'matched_text': match.group()
-                })
-    
-    return results
+    # Posting-list lookup narrows the search to candidate pages
+    return search_shards.get_shards(boats).search(query, context_chars, mode=mode,
+                                                  max_distance=max_distance, date_range=date_range)
 
 
 @app.route('/')
@@ -313,46 +252,571 @@ def viewer():
     return render_template('viewer.html')
 
 
+SEARCH_MODES = ('exact', 'fuzzy', 'query', 'regex', 'entity')
+
+# Modes whose query text is used as typed: case and quotes matter
+RAW_QUERY_MODES = ('query', 'regex', 'entity')
+
+
+def metrics_label(name):
+    """
+    Metrics label of a search request: name plus its mode, or 'invalid' for
+    an unknown mode, so made-up modes can't add histogram rows.
+    """
+    mode = request.args.get('mode', 'exact')
+    return f"{name}:{mode if mode in SEARCH_MODES else 'invalid'}"
+
+
+# Database records shown alongside page results in plain searches
+RECORD_PREVIEW = 5
+
+
 @app.route('/search')
 def search():
-    """API endpoint for searching PDFs."""
+    """
+    API endpoint for searching PDFs.
+    
+    Optional parameters:
+      mode      - 'exact' (default), 'fuzzy' for OCR-tolerant matching, or
+                  'query' for AND/OR/NOT, "phrases", NEAR/n and patrol:N, or
+                  'regex' for a (case-insensitive) regular expression; regex
+                  searches are time-limited and report partial: true if cut short;
+                  'entity' for indexed positions, dates and ship/aircraft types
+                  (near:12-34N,118-22E within:50 date:1944-08-03..1944-08-05 type:AK)
+      distance  - maximum edits per word in fuzzy mode (0-2, default by word length)
+      sort      - 'relevance' returns the best pages first (BM25), one hit per page
+      limit     - return at most this many results plus a next_cursor
+      cursor    - continue from a previous response's next_cursor
+      offset    - skip this many ranked pages (sort=relevance only)
+      from, to  - only pages whose narrative dates fall in this range
+                  (YYYY, YYYY-MM or YYYY-MM-DD; to=1944-07 includes all of July)
+      boat      - comma-separated boats to search (default all; see search_shards)
+      format    - 'ndjson' streams one JSON object per line as hits are found;
+                  the last line is {"type": "end", "count", "next_cursor"}, the
+                  cursor set when limit cut the stream short
+    
+    Responses include facets: estimated hits per boat, patrol, report and month.
+    Exact and fuzzy searches also return records: the first few matching
+    contact and attack records from the database and their total; see
+    /search/records for all of them.
+    Each hit has boxes: the match's rectangles on the page as [x0, y0, x1, y1]
+    fractions of the page width and height (empty without OCR word boxes).
+    """
+    label = metrics_label('search')
+    if request.args.get('sort') == 'relevance':
+        label += ':relevance'
+    trace = search_metrics.start('search', label, request.args.to_dict())
+    try:
+        response = app.make_response(_search())
+    except Exception:
+        search_metrics.finish(trace)
+        raise
+    if not response.is_streamed:
+        # Streamed responses finish their trace after the last line
+        search_metrics.finish(trace)
+    return response
+
+
+def _search():
+    """Handle a /search request; see search() for the parameters."""
     query = request.args.get('q', '').strip()
-    results = search_pdfs(query)
+    mode = request.args.get('mode', 'exact')
+    max_distance = request.args.get('distance', type=int)
+    sort = request.args.get('sort', 'order')
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor') or None
+    offset = max(0, request.args.get('offset', 0, type=int))
+    output_format = request.args.get('format', 'json')
+    boats = [b.strip() for b in request.args.get('boat', '').split(',') if b.strip()] or None
+    
+    try:
+        date_range = search_index.parse_date_range(request.args.get('from'), request.args.get('to'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if mode not in SEARCH_MODES:
+        return jsonify({'error': f'Unknown search mode: {mode}'}), 400
+    if sort not in ('order', 'relevance'):
+        return jsonify({'error': f'Unknown sort: {sort}'}), 400
+    if sort == 'relevance':
+        # Ranked results are paged by offset rather than cursor
+        cursor = None
+        limit = max(1, min(limit or 20, 1000))
+    if max_distance is not None:
+        max_distance = max(0, min(max_distance, 2))
+    if cursor:
+        try:
+            search_index.decode_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    search_query = normalize_query(query) if mode not in RAW_QUERY_MODES else query
+    with search_trace.span('index'):
+        try:
+            index = search_shards.get_shards(boats)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    options = {'mode': mode, 'max_distance': max_distance, 'date_range': date_range}
+    
+    if mode == 'query' and search_query:
+        from search_query import QuerySyntaxError, parse_query
+        try:
+            parse_query(index, search_query)
+        except QuerySyntaxError as e:
+            return jsonify({'error': f'Invalid query: {e}'}), 400
+    if mode == 'regex' and search_query:
+        from search_regex import RegexError, compile_pattern
+        try:
+            compile_pattern(search_query)
+        except RegexError as e:
+            return jsonify({'error': str(e)}), 400
+    if mode == 'entity' and search_query:
+        from search_entities import EntityQueryError, parse_entity_query
+        try:
+            parse_entity_query(search_query)
+        except EntityQueryError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    def suggestion_for(total):
+        """Offer "did you mean" when nothing matched, or when fuzzy matching was used."""
+        if search_query and mode not in RAW_QUERY_MODES and (mode == 'fuzzy' or total == 0):
+            return index.suggest(search_query)
+        return None
+    
+    def records_for():
+        """
+        Contacts and attacks whose database text matches, so a spelling found
+        only in the tables still turns something up.
+        """
+        if not search_query or mode in RAW_QUERY_MODES:
+            return None
+        from search_records import RecordQueryError
+        try:
+            return index.search_records(search_query, date_range=date_range, limit=RECORD_PREVIEW)
+        except RecordQueryError:
+            return None
+    
+    # Exact and fuzzy matching ignore case, so share cache entries across it
+    cache = search_cache.get_cache()
+    cache_params = {
+        'q': search_query.lower() if mode not in RAW_QUERY_MODES else search_query,
+        'mode': mode,
+        'distance': max_distance,
+        'limit': limit,
+        'cursor': cursor,
+        'format': output_format,
+        'sort': sort,
+        'offset': offset,
+        'dates': date_range,
+        'boats': boats,
+    }
+    
+    if output_format == 'ndjson':
+        with search_trace.span('cache'):
+            cached = cache.get(cache_params, index.generations) if search_query else None
+        trace = search_trace.current()
+        
+        def generate():
+            search_trace.activate(trace)
+            try:
+                yield from stream()
+            finally:
+                search_metrics.finish(trace)
+        
+        def stream():
+            if cached is not None:
+                yield json.dumps(dict(cached['meta'], query=query)) + '\n'
+                for line in cached['lines']:
+                    yield line + '\n'
+                return
+            if sort == 'relevance' and search_query:
+                ranked = index.search_ranked(search_query, limit, offset, **options)
+                total, hits = ranked['total_estimate'], ranked['results']
+            else:
+                total = index.estimate_hits(search_query, **options) if search_query else 0
+                after = search_index.decode_cursor(cursor) if cursor else None
+                hits = index.keyed_hits(search_query, after=after, **options) if search_query else []
+            partial = index.is_partial(search_query, **options) if search_query else False
+            meta = {'type': 'meta', 'query': query, 'mode': mode, 'sort': sort,
+                    'total_estimate': total, 'suggestion': suggestion_for(total),
+                    'facets': index.facets(search_query, **options) if search_query else None,
+                    'records': records_for(), 'partial': partial}
+            yield json.dumps(meta) + '\n'
+            lines = []
+            count = 0
+            next_cursor = None
+            last_key = None
+            if search_query:
+                # Ranked hits come as plain dicts, hits in report order with their keys
+                for item in hits:
+                    key, hit = (None, item) if sort == 'relevance' else item
+                    if limit is not None and count >= limit:
+                        # One hit past the limit: there is more to continue from
+                        if last_key is not None:
+                            next_cursor = search_index.encode_cursor(last_key)
+                        break
+                    count += 1
+                    last_key = key
+                    line = json.dumps(dict(hit, type='hit'), ensure_ascii=False)
+                    lines.append(line)
+                    yield line + '\n'
+            lines.append(json.dumps({'type': 'end', 'count': count, 'next_cursor': next_cursor}))
+            yield lines[-1] + '\n'
+            # Cut-short regex results depend on load, so don't keep them
+            if search_query and not partial:
+                with search_trace.span('cache'):
+                    cache.put(cache_params, index.generations, {'meta': meta, 'lines': lines})
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    if not search_query:
+        payload = {'query': query, 'mode': mode, 'count': 0, 'suggestion': None,
+                   'facets': None, 'results': []}
+        if limit is not None or cursor:
+            payload.update(total_estimate=0, next_cursor=None)
+        return jsonify(payload)
+    
+    with search_trace.span('cache'):
+        payload = cache.get(cache_params, index.generations)
+    if payload is not None:
+        payload['query'] = query
+        with search_trace.span('serialize'):
+            return jsonify(payload)
+    
+    if sort == 'relevance':
+        ranked = index.search_ranked(search_query, limit, offset, **options)
+        payload = {
+            'query': query,
+            'mode': mode,
+            'sort': sort,
+            'count': len(ranked['results']),
+            'total_estimate': ranked['total_estimate'],
+            'offset': offset,
+            'suggestion': suggestion_for(ranked['total_estimate']),
+            'facets': index.facets(search_query, **options),
+            'results': ranked['results']
+        }
+    elif limit is not None or cursor:
+        limit = max(1, min(limit or 100, 1000))
+        page = index.search_page(search_query, limit, cursor, **options)
+        payload = {
+            'query': query,
+            'mode': mode,
+            'count': len(page['results']),
+            'total_estimate': page['total_estimate'],
+            'next_cursor': page['next_cursor'],
+            'suggestion': suggestion_for(page['total_estimate']),
+            'facets': index.facets(search_query, **options),
+            'results': page['results']
+        }
+    else:
+        results = search_pdfs(query, boats=boats, **options)
+        payload = {
+            'query': query,
+            'mode': mode,
+            'count': len(results),
+            'suggestion': suggestion_for(len(results)),
+            'facets': index.facets(search_query, **options),
+            'results': results
+        }
+    payload['partial'] = index.is_partial(search_query, **options)
+    payload['records'] = records_for()
+    if not payload['partial']:
+        with search_trace.span('cache'):
+            cache.put(cache_params, index.generations, payload)
+    with search_trace.span('serialize'):
+        return jsonify(payload)
+
+
+@app.route('/search/records')
+def search_records():
+    """
+    Ship contact, aircraft contact and torpedo attack records from the
+    database whose remarks or descriptions match q. q may also hold numeric
+    filters, field then >, >=, <, <= or = then a number, with or without
+    spaces: target_tonnage > 5000, range_yards<=3000 or patrol=3, alone or
+    with words (convoy target_tonnage>5000). Optional type (attack, contact, ship_contact, aircraft_contact;
+    comma-separated), from and to (record date), limit (default 20, max 200),
+    offset and boat.
+    """
+    trace = search_metrics.start('records', 'records', request.args.to_dict())
+    try:
+        from search_records import RecordQueryError, parse_types
+        query = request.args.get('q', '').strip()
+        limit = max(1, min(request.args.get('limit', 20, type=int), 200))
+        offset = max(0, request.args.get('offset', 0, type=int))
+        boats = [b.strip() for b in request.args.get('boat', '').split(',') if b.strip()] or None
+        try:
+            date_range = search_index.parse_date_range(request.args.get('from'), request.args.get('to'))
+            types = parse_types(request.args.get('type'))
+            index = search_shards.get_shards(boats)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not query:
+            return jsonify({'query': query, 'count': 0, 'total': 0, 'results': []})
+        try:
+            found = index.search_records(query, types, date_range, limit, offset)
+        except RecordQueryError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'query': query,
+            'count': len(found['results']),
+            'total': found['total'],
+            'offset': offset,
+            'results': found['results'],
+        })
+    finally:
+        search_metrics.finish(trace)
+
+
+@app.route('/search/concordance')
+def search_concordance():
+    """
+    Keyword in context: every occurrence of the word or phrase q (a word
+    ending in * matches any ending) with the words around it, sorted by the
+    words that follow (sort=right, default), precede (left) or by report
+    order (order). Optional width (words either side, default 8, max 30),
+    limit (default 50, max 500), cursor (next_cursor from the previous
+    page), from, to and boat. With collocations=1, also the words most often
+    found within window (default 3, max 10) words either side.
+    """
+    trace = search_metrics.start('concordance', 'concordance', request.args.to_dict())
+    try:
+        from search_concordance import (DEFAULT_WIDTH, DEFAULT_WINDOW, MAX_WIDTH, MAX_WINDOW,
+                                        SORTS, ConcordanceError)
+        query = request.args.get('q', '').strip()
+        sort = request.args.get('sort', 'right')
+        width = max(0, min(request.args.get('width', DEFAULT_WIDTH, type=int), MAX_WIDTH))
+        limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+        cursor = request.args.get('cursor') or None
+        window = max(1, min(request.args.get('window', DEFAULT_WINDOW, type=int), MAX_WINDOW))
+        boats = [b.strip() for b in request.args.get('boat', '').split(',') if b.strip()] or None
+        if sort not in SORTS:
+            return jsonify({'error': f"Unknown sort: {sort} (use {', '.join(SORTS)})"}), 400
+        try:
+            date_range = search_index.parse_date_range(request.args.get('from'), request.args.get('to'))
+            index = search_shards.get_shards(boats)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not query:
+            return jsonify({'query': query, 'count': 0, 'total': 0, 'lines': [], 'next_cursor': None})
+        try:
+            found = index.concordance(query, sort, limit, cursor, width, date_range)
+        except ConcordanceError as e:
+            return jsonify({'error': str(e)}), 400
+        payload = {
+            'query': query,
+            'sort': sort,
+            'count': len(found['lines']),
+            'total': found['total'],
+            'lines': found['lines'],
+            'next_cursor': found['next_cursor'],
+        }
+        if request.args.get('collocations') == '1':
+            payload['collocations'] = index.collocations(query, window, sort, date_range)
+            payload['window'] = window
+        return jsonify(payload)
+    finally:
+        search_metrics.finish(trace)
+
+
+@app.route('/search/suggest')
+def search_suggest():
+    """
+    Autocomplete for the search box: report words and glossary terms starting
+    with prefix, most frequent first. Optional limit (default 8, max 20).
+    """
+    trace = search_metrics.start('suggest', 'suggest', request.args.to_dict())
+    try:
+        prefix = request.args.get('prefix', '')
+        limit = request.args.get('limit', 8, type=int)
+        suggestions = search_shards.get_shards().complete(prefix, limit) if prefix.strip() else []
+        return jsonify({'prefix': prefix, 'suggestions': suggestions})
+    finally:
+        search_metrics.finish(trace)
+
+
+@app.route('/search/boxes')
+def search_boxes():
+    """
+    Every page of one report that matches a search, with the rectangles of
+    its matches, for highlighting and hit-to-hit navigation in the viewer.
+    Takes file plus the q, mode, distance, from and to parameters of /search.
+    """
+    trace = search_metrics.start('boxes', metrics_label('boxes'), request.args.to_dict())
+    try:
+        pdf_file = request.args.get('file', '')
+        query = request.args.get('q', '').strip()
+        mode = request.args.get('mode', 'exact')
+        max_distance = request.args.get('distance', type=int)
+        try:
+            date_range = search_index.parse_date_range(request.args.get('from'), request.args.get('to'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if mode not in SEARCH_MODES:
+            return jsonify({'error': f'Unknown search mode: {mode}'}), 400
+        if max_distance is not None:
+            max_distance = max(0, min(max_distance, 2))
+        search_query = normalize_query(query) if mode not in RAW_QUERY_MODES else query
+        if not search_query or not pdf_file:
+            return jsonify({'file': pdf_file, 'query': query, 'pages': []})
+        
+        # Only the shard holding the report is planned, so a regex isn't
+        # scanned over every boat's corpus to highlight one report
+        boat = report_catalog.get_catalog().report_boat(pdf_file)
+        if boat is None:
+            return jsonify({'file': pdf_file, 'query': query, 'pages': []})
+        index = search_shards.get_shards([boat])
+        if mode == 'query':
+            from search_query import QuerySyntaxError, parse_query
+            try:
+                parse_query(index, search_query)
+            except QuerySyntaxError as e:
+                return jsonify({'error': f'Invalid query: {e}'}), 400
+        if mode == 'regex':
+            from search_regex import RegexError, compile_pattern
+            try:
+                compile_pattern(search_query)
+            except RegexError as e:
+                return jsonify({'error': str(e)}), 400
+        if mode == 'entity':
+            from search_entities import EntityQueryError, parse_entity_query
+            try:
+                parse_entity_query(search_query)
+            except EntityQueryError as e:
+                return jsonify({'error': str(e)}), 400
+        
+        options = {'mode': mode, 'max_distance': max_distance, 'date_range': date_range}
+        pages = index.document_boxes(search_query, pdf_file, **options)
+        return jsonify({
+            'file': pdf_file,
+            'query': query,
+            'mode': mode,
+            'pages': pages,
+            'partial': index.is_partial(search_query, **options),
+        })
+    finally:
+        search_metrics.finish(trace)
+
+
+@app.route('/search/related')
+def related_pages():
+    """
+    "More like this": pages in other reports most similar to one page, from
+    the neighbours precomputed by search_related.py. Takes file and page,
+    plus an optional limit (default 10).
+    """
+    trace = search_metrics.start('related', 'related', request.args.to_dict())
+    try:
+        pdf_file = request.args.get('file', '')
+        page_num = request.args.get('page', type=int)
+        limit = max(1, request.args.get('limit', search_related.TOP_K, type=int))
+        if not pdf_file or page_num is None:
+            return jsonify({'error': 'file and page are required'}), 400
+
+        related = search_related.get_related()
+        if not related.ensure_current():
+            return jsonify({'error': 'Related pages have not been built'}), 503
+        results = related.lookup(pdf_file, page_num, limit)
+        if results is None:
+            return jsonify({'error': 'Page not found'}), 404
+
+        index = search_shards.get_shards()
+        catalog = report_catalog.get_catalog()
+        for result in results:
+            result['boat'] = catalog.report_boat(result['pdf_file'])
+            result['patrol'] = search_index.patrol_number(result['pdf_file'])
+            result['preview'] = search_related.page_preview(index, result['pdf_file'], result['page_num'])
+        return jsonify({
+            'file': pdf_file,
+            'page': page_num,
+            'results': results,
+            'stale': related.is_stale(index),
+        })
+    finally:
+        search_metrics.finish(trace)
+
+
+@app.route('/api/search-metrics')
+def search_metrics_api():
+    """Search latency histograms and recent slow queries (hidden - not linked from main site)."""
+    metrics = search_metrics.get_metrics()
     return jsonify({
-        'query': query,
-        'count': len(results),
-        'results': results
+        'slow_query_ms': metrics.slow_query_ms,
+        'requests': metrics.summary(),
+        'slow_queries': metrics.slow_queries(request.args.get('slow', 20, type=int)),
     })
 
 
+@app.route('/api/search-cache-stats')
+def search_cache_stats():
+    """Search result cache counters (hidden - not linked from main site)."""
+    stats = search_cache.get_cache().stats()
+    stats['generation'] = search_shards.get_shards().generation
+    return jsonify(stats)
+
+
 @app.route('/pdfs/<filename>')
 def serve_pdf(filename):
-    """Serve PDF files. Use downscaled web versions for fast loading."""
-    base_name = filename.replace('.pdf', '')
-    
-    # Use downscaled web version (fast loading with text layer)
-    web_dir = os.path.join(BASE_DIR, "pdfs_web")
-    web_filename = f"{base_name}.pdf"
-    web_path = os.path.join(web_dir, web_filename)
-    if os.path.exists(web_path):
-        return send_from_directory(web_dir, web_filename)
-    
-    # Fall back to Google Vision version
-    gv_filename = f"{base_name}_gv.pdf"
-    gv_path = os.path.join(REPORTS_DIR, gv_filename)
-    if os.path.exists(gv_path):
-        return send_from_directory(REPORTS_DIR, gv_filename)
-    
-    # Fall back to V3 version
-    v3_filename = f"{base_name}_v3.pdf"
-    v3_path = os.path.join(PDF_OCR_DIR, v3_filename)
-    if os.path.exists(v3_path):
-        return send_from_directory(PDF_OCR_DIR, v3_filename)
-    
-    # Fall back to original
+    """
+    Serve PDF files. Use downscaled web versions for fast loading, then the
+    Google Vision, V3 and original versions, whichever the catalog has.
+    
+    Range requests get 206 partial responses, so PDF.js can fetch just the
+    pages in view of a linearized PDF. The ETag is the file's content hash,
+    the same from every worker, so If-Range and revalidation hold across
+    them and across restarts. If the file changes between the catalog's
+    check and sending it, the hash can't be trusted and Werkzeug's
+    stat-based ETag is used instead.
+    """
+    info = report_catalog.get_catalog().variant(filename, report_catalog.VIEW_VARIANTS)
+    if info:
+        try:
+            st = os.stat(info['path'])
+            verified = (st.st_size, st.st_mtime_ns) == (info['size'], info['mtime_ns'])
+        except OSError:
+            verified = False
+        return send_from_directory(os.path.dirname(info['path']), os.path.basename(info['path']),
+                                   mimetype='application/pdf',
+                                   etag=info['sha256'] if verified else True, conditional=True)
+    
+    # Not a report: serve whatever file it names
     return send_from_directory(PDF_DIR, filename)
 
 
+@app.route('/pages/<report>/<int:page_num>.webp')
+def serve_page_image(report, page_num):
+    """
+    One report page rendered to WebP at width w (default 850, snapped to a
+    multiple of 50 between 200 and 2400), from the disk cache when it has
+    been rendered before.
+    
+    The URL doesn't change when the report does, so browsers must revalidate;
+    the ETag is the image name, which includes the PDF's content hash, so an
+    unchanged page is a 304.
+    """
+    info = report_catalog.get_catalog().variant(report, page_images.RENDER_VARIANTS)
+    if not info:
+        return jsonify({'error': 'Report not found'}), 404
+    width = page_images.snap_width(request.args.get('w', type=int))
+    cache = page_images.get_cache()
+    for attempt in range(2):
+        try:
+            path = cache.get(info, page_num, width)
+        except IndexError as e:
+            return jsonify({'error': str(e)}), 404
+        try:
+            response = send_from_directory(os.path.dirname(path), os.path.basename(path),
+                                           mimetype='image/webp',
+                                           etag=os.path.basename(path)[:-len('.webp')],
+                                           conditional=True)
+        except (NotFound, FileNotFoundError):
+            # Another worker evicted the image after the lookup: render it again
+            if attempt:
+                raise
+            continue
+        response.cache_control.no_cache = True
+        return response
+
+
 @app.route('/pdf-list')
 def pdf_list():
     """Return list of available PDFs."""
@@ -361,10 +825,16 @@ def pdf_list():
 
 # --- Corrections System ---
 
+def get_correction_boat(pdf_name):
+    """The boat whose partition holds a report's corrections."""
+    return report_catalog.get_catalog().report_boat(pdf_name) or search_shards.DEFAULT_BOAT
+
+
 def get_correction_path(pdf_name):
-    """Get the path to the corrections file for a PDF."""
+    """Get the path to the corrections file for a PDF, in its boat's partition."""
     base_name = pdf_name.replace('.pdf', '')
-    return os.path.join(CORRECTIONS_DIR, f"{base_name}.json")
+    corrections_dir = search_shards.boat_dirs(get_correction_boat(pdf_name))[1]
+    return os.path.join(corrections_dir, f"{base_name}.json")
 
 
 def load_corrections(pdf_name):
@@ -381,6 +851,7 @@ def save_correction(pdf_name, page_num, text):
     corrections = load_corrections(pdf_name)
     corrections[str(page_num)] = text
     path = get_correction_path(pdf_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, 'w', encoding='utf-8') as f:
         json.dump(corrections, f, indent=2, ensure_ascii=False)
 
@@ -392,14 +863,7 @@ def get_page_text(pdf_name, page_num):
         return corrections[str(page_num)]
     
     # Fall back to OCR text
-    base_name = pdf_name.replace('.pdf', '')
-    v3_path = os.path.join(PDF_OCR_DIR, f"{base_name}_v3.pdf")
-    if os.path.exists(v3_path):
-        pdf_path = v3_path
-    else:
-        pdf_path = os.path.join(PDF_ORIGINAL_DIR, pdf_name)
-    
-    pages = extract_text_from_pdf(pdf_path)
+    pages = extract_text_from_pdf(get_ocr_pdf_path(pdf_name))
     for pn, text in pages:
         if pn == page_num:
             return text
@@ -408,14 +872,8 @@ def get_page_text(pdf_name, page_num):
 
 def get_image_folder(pdf_name):
     """Get the folder containing original scan images for a PDF."""
-    # Map PDF names to image folders (in parent cod directory)
-    base_name = pdf_name.replace('.pdf', '').replace('USS_Cod_', 'cod_').lower()
     # Image folders are in /home/jmknapp/cod/, not in patrolReports
-    cod_dir = os.path.dirname(BASE_DIR)  # Go up from patrolReports to cod
-    folder = os.path.join(cod_dir, base_name)
-    if os.path.exists(folder):
-        return folder
-    return None
+    return scan_tiles.image_folder(pdf_name)
 
 
 @app.route('/correct')
@@ -431,20 +889,7 @@ def get_correction(pdf_name, page_num):
     corrections = load_corrections(pdf_name)
     is_corrected = str(page_num) in corrections
     
-    # Get total pages
-    base_name = pdf_name.replace('.pdf', '')
-    v3_path = os.path.join(PDF_OCR_DIR, f"{base_name}_v3.pdf")
-    if os.path.exists(v3_path):
-        pdf_path = v3_path
-    else:
-        pdf_path = os.path.join(PDF_ORIGINAL_DIR, pdf_name)
-    
-    try:
-        doc = fitz.open(pdf_path)
-        total_pages = len(doc)
-        doc.close()
-    except:
-        total_pages = 0
+    total_pages = report_catalog.get_catalog().page_count(pdf_name)
     
     return jsonify({
         'pdf_name': pdf_name,
@@ -462,14 +907,8 @@ def save_correction_api(pdf_name, page_num):
     text = data.get('text', '')
     save_correction(pdf_name, page_num, text)
     
-    # Clear cache for this PDF so search uses new corrections
-    base_name = pdf_name.replace('.pdf', '')
-    v3_path = os.path.join(PDF_OCR_DIR, f"{base_name}_v3.pdf")
-    if v3_path in pdf_cache:
-        del pdf_cache[v3_path]
-    orig_path = os.path.join(PDF_ORIGINAL_DIR, pdf_name)
-    if orig_path in pdf_cache:
-        del pdf_cache[orig_path]
+    # Rebuild the search index now rather than on the next search
+    search_shards.get_shards([get_correction_boat(pdf_name)])
     
     return jsonify({'success': True, 'message': f'Saved correction for page {page_num}'})
 
@@ -477,6 +916,11 @@ def save_correction_api(pdf_name, page_num):
 @app.route('/api/scan-image/<pdf_name>/<int:page_num>')
 def get_scan_image(pdf_name, page_num):
     """Serve the original scan image for a page."""
+    # Tiled pages name their scan in the tile manifest
+    entry = scan_tiles.get_manifest().page(pdf_name, page_num)
+    if entry and os.path.exists(entry['source']):
+        return send_from_directory(os.path.dirname(entry['source']), os.path.basename(entry['source']))
+    
     folder = get_image_folder(pdf_name)
     if not folder:
         return jsonify({'error': 'Image folder not found'}), 404
@@ -491,27 +935,75 @@ def get_scan_image(pdf_name, page_num):
     return jsonify({'error': f'Image for page {page_num} not found'}), 404
 
 
+# Descriptor and tile URLs include the tiled scan's version, so a retiled
+# scan gets new URLs and browsers can keep the old ones for a week
+SCAN_TILE_MAX_AGE = 7 * 24 * 3600
+
+
+@app.route('/api/scan-tiles/<pdf_name>/<int:page_num>')
+def get_scan_tiles(pdf_name, page_num):
+    """
+    Size and version of a page's scan tile pyramid (see scan_tiles.py), 404
+    if it hasn't been tiled. The pyramid's descriptor is
+    <page_num>/<version>.dzi under this URL, with tiles under
+    <page_num>/<version>_files/.
+    """
+    entry = scan_tiles.get_manifest().page(pdf_name, page_num)
+    if entry is None:
+        return jsonify({'error': f'No tiles for page {page_num}'}), 404
+    version = scan_tiles.tile_version(entry)
+    return jsonify({
+        'pdf_name': pdf_name,
+        'page_num': page_num,
+        'width': entry['width'],
+        'height': entry['height'],
+        'levels': entry['levels'],
+        'version': version,
+        'dzi': url_for('get_scan_dzi', pdf_name=pdf_name, page_num=page_num, version=version),
+    })
+
+
+def _current_tiles(pdf_name, page_num, version):
+    """A page's manifest entry if version is its current tile version, else None."""
+    entry = scan_tiles.get_manifest().page(pdf_name, page_num)
+    if entry is None or scan_tiles.tile_version(entry) != version:
+        return None
+    return entry
+
+
+@app.route('/api/scan-tiles/<pdf_name>/<int:page_num>/<version>.dzi')
+def get_scan_dzi(pdf_name, page_num, version):
+    """Deep Zoom descriptor of a page's scan tiles, 404 for an outdated version."""
+    entry = _current_tiles(pdf_name, page_num, version)
+    if entry is None:
+        return jsonify({'error': f'No tiles for page {page_num}'}), 404
+    response = Response(scan_tiles.dzi_xml(entry), mimetype='application/xml')
+    response.cache_control.public = True
+    response.cache_control.max_age = SCAN_TILE_MAX_AGE
+    return response
+
+
+@app.route('/api/scan-tiles/<pdf_name>/<int:page_num>/<version>_files/<int:level>/'
+           '<int:col>_<int:row>.<fmt>')
+def get_scan_tile(pdf_name, page_num, version, level, col, row, fmt):
+    """One tile of a page's scan pyramid, looked up in the tile manifest."""
+    if _current_tiles(pdf_name, page_num, version) is None:
+        return jsonify({'error': 'Tile not found'}), 404
+    path = scan_tiles.get_manifest().tile_path(pdf_name, page_num, level, col, row)
+    if path is None or not path.endswith(f".{fmt}"):
+        return jsonify({'error': 'Tile not found'}), 404
+    return send_from_directory(os.path.dirname(path), os.path.basename(path),
+                               max_age=SCAN_TILE_MAX_AGE)
+
+
 @app.route('/api/correction-stats')
 def correction_stats():
     """Get statistics about corrections for all PDFs."""
     stats = []
-    for pdf_file in get_pdf_files():
+    catalog = report_catalog.get_catalog()
+    for pdf_file in catalog.report_names():
         corrections = load_corrections(pdf_file)
-        
-        # Get total pages
-        base_name = pdf_file.replace('.pdf', '')
-        v3_path = os.path.join(PDF_OCR_DIR, f"{base_name}_v3.pdf")
-        if os.path.exists(v3_path):
-            pdf_path = v3_path
-        else:
-            pdf_path = os.path.join(PDF_ORIGINAL_DIR, pdf_file)
-        
-        try:
-            doc = fitz.open(pdf_path)
-            total_pages = len(doc)
-            doc.close()
-        except:
-            total_pages = 0
+        total_pages = catalog.page_count(pdf_file)
         
         stats.append({
             'pdf_name': pdf_file,
@@ -543,14 +1035,10 @@ def rebuild_pdf(pdf_name):
     corrections = load_corrections(pdf_name)
     
     # Get OCR text as fallback
-    base_name = pdf_name.replace('.pdf', '')
-    v3_path = os.path.join(PDF_OCR_DIR, f"{base_name}_v3.pdf")
-    if os.path.exists(v3_path):
-        ocr_pages = extract_text_from_pdf(v3_path)
-    else:
-        ocr_pages = extract_text_from_pdf(os.path.join(PDF_ORIGINAL_DIR, pdf_name))
+    ocr_pages = extract_text_from_pdf(get_ocr_pdf_path(pdf_name))
     
     # Create new PDF
+    base_name = pdf_name.replace('.pdf', '')
     output_path = os.path.join(REPORTS_DIR, f"{base_name}_corrected.pdf")
     doc = fitz.open()
     
@@ -600,9 +1088,9 @@ def rebuild_pdf(pdf_name):
     doc.save(output_path)
     doc.close()
     
-    # Clear cache so the new PDF is used
-    if output_path in pdf_cache:
-        del pdf_cache[output_path]
+    # Saving over an earlier rebuild doesn't touch the directory, so rescan,
+    # then drop the text cache of the PDF it replaced
+    pdf_text.prune(report_catalog.get_catalog().refresh())
     
     return jsonify({
         'success': True,
@@ -616,43 +1104,24 @@ def rebuild_pdf(pdf_name):
 @app.route('/pdf-text/<filename>/<int:page_num>')
 def get_pdf_text(filename, page_num):
     """Get text content and positions from original PDF for highlighting."""
-    import fitz
-    
     pdf_path = os.path.join(PDF_ORIGINAL_DIR, filename)
     if not os.path.exists(pdf_path):
         return jsonify({'error': 'PDF not found'}), 404
     
     try:
-        doc = fitz.open(pdf_path)
-        if page_num < 1 or page_num > len(doc):
+        extracted = pdf_text.get_pdf_text(pdf_path)
+        if page_num < 1 or page_num > len(extracted):
             return jsonify({'error': 'Invalid page number'}), 400
         
-        page = doc[page_num - 1]  # 0-indexed
-        
-        # Get page dimensions for scaling
-        original_width = page.rect.width
-        original_height = page.rect.height
-        
-        # Extract text with positions
-        blocks = []
-        text_dict = page.get_text("dict")
-        
-        for block in text_dict.get("blocks", []):
-            if block.get("type") == 0:  # Text block
-                for line in block.get("lines", []):
-                    for span in line.get("spans", []):
-                        text = span.get("text", "").strip()
-                        if text:
-                            bbox = span.get("bbox", [0, 0, 0, 0])
-                            blocks.append({
-                                "text": text,
-                                "x": bbox[0],
-                                "y": bbox[1],
-                                "width": bbox[2] - bbox[0],
-                                "height": bbox[3] - bbox[1]
-                            })
-        
-        doc.close()
+        # Page dimensions for scaling, and text spans with positions
+        original_width, original_height = extracted.page_size(page_num - 1)
+        blocks = [{
+            "text": text,
+            "x": x0,
+            "y": y0,
+            "width": x1 - x0,
+            "height": y1 - y0
+        } for text, (x0, y0, x1, y1) in extracted.page_spans(page_num - 1)]
         
         return jsonify({
             "page": page_num,
@@ -671,16 +1140,14 @@ if __name__ == '__main__':
     print(f"  Serving PDFs from: {PDF_DIR}")
     print(f"  Looking for V3 OCR PDFs in: {PDF_OCR_DIR}")
     for pdf_file in get_pdf_files():
-        # Try V3 first
-        base_name = pdf_file.replace('.pdf', '')
-        v3_path = os.path.join(PDF_OCR_DIR, f"{base_name}_v3.pdf")
-        if os.path.exists(v3_path):
-            extract_text_from_pdf(v3_path)
-            print(f"  Cached (V3 OCR): {pdf_file}")
-        else:
-            pdf_path = os.path.join(PDF_ORIGINAL_DIR, pdf_file)
-            extract_text_from_pdf(pdf_path)
-            print(f"  Cached (original): {pdf_file}")
+        # V3 first, then the original
+        pdf_path = get_ocr_pdf_path(pdf_file)
+        extract_text_from_pdf(pdf_path)
+        print(f"  Cached ({'V3 OCR' if pdf_path.endswith('_v3.pdf') else 'original'}): {pdf_file}")
+    print("Loading search index...")
+    index = search_shards.get_shards()
+    print(f"  Indexed {len(index.pages)} pages from {len(index.documents)} documents "
+          f"({len(index.shards)} boats)")
     print("Ready!")
     
     app.run(debug=True, port=5012, host='0.0.0.0')
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Search benchmark.
+
+Builds the search index from the real static/reports/*_gv_ocr.json files, and
+from synthetic copies of them scaled 10x or 100x, in a temporary directory.
+It then replays a fixed query mix: common words, rare names, long phrases and
+queries with no hits. For each search mode it reports p50/p95/p99 latency and
+the peak memory allocated by a single query, plus the peak RSS of each scale's
+process.
+
+Results can be saved as a baseline, benchmark_baseline.json next to this
+script, which is meant to be committed. Later runs are compared against it
+and exit with status 1 if any mode got noticeably slower or hungrier.
+
+With --archive it instead indexes every boat of a multi-boat archive written
+by generate_archive.py as its own shard, and times the query mix over all
+shards, searched in turn and fanned out over a pool of --threads threads, to
+show what running shards together buys.
+
+Usage:
+    python benchmark_search.py                  # 1x and 10x, compare to baseline
+    python benchmark_search.py --scales 1,10,100
+    python benchmark_search.py --save           # record a new baseline
+    python benchmark_search.py --archive /tmp/fleet --threads 4
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import search_index
+import search_shards
+from search_index import REPORTS_DIR
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Timed runs per query
+REPEATS = 5
+
+# A mode regresses if its p95 grows by more than this fraction and by at
+# least MIN_REGRESSION_MS. Timings on a shared machine are noisy; allocation
+# and RSS figures are steady, so they get a tighter limit
+TOLERANCE = 0.5
+MIN_REGRESSION_MS = 1.0
+MEMORY_TOLERANCE = 0.1
+
+# Share of words given an OCR-style misreading in each synthetic copy, so
+# scaled corpora grow a realistic long tail of vocabulary
+NOISE_RATE = 0.02
+OCR_CONFUSIONS = {'o': '0', 'l': '1', 'e': 'c', 'i': 'l', 's': '5', 'a': 'o', 'm': 'rn'}
+
+QUERY_MIX = {
+    'common': ['the', 'torpedo', 'submerged', 'convoy', 'surfaced'],
+    'rare': ['asama maru', 'bream', 'mindoro', 'kamikaze', 'luzon'],
+    'phrase': ['depth charges', 'sighted smoke', 'commenced approach', 'radar contact'],
+    'no-hit': ['xylophone', 'zeppelin', 'battleship', 'qwertyuiop'],
+}
+
+# Advanced-mode equivalents of the mix, plus operators
+BOOLEAN_MIX = {
+    'common': ['torpedo AND submerged', 'convoy OR tanker'],
+    'rare': ['"asama maru"', 'bream NEAR/10 mindoro'],
+    'phrase': ['"depth charges" -escort', 'SJ NEAR/5 contact patrol:5'],
+    'no-hit': ['xylophone AND zeppelin', 'torp* AND qwertyuiop'],
+}
+
+REGEX_MIX = {
+    'common': [r'\b[0-2]\d[0-5]\d\b', r'torpedo(es)?'],
+    'rare': [r'\d\d-\d\d\s*N', r'SS-\d+'],
+    'phrase': [r'depth charges?\s+\w+'],
+    'no-hit': [r'xylo\w+', r'zeppelin\d'],
+}
+
+MODES = ('exact', 'fuzzy', 'relevance', 'query', 'regex')
+
+
+def _noisy(word, rng):
+    chars = [c for c in word.lower() if c in OCR_CONFUSIONS]
+    if not chars:
+        return word
+    c = rng.choice(chars)
+    return word.replace(c, OCR_CONFUSIONS[c], 1)
+
+
+def make_corpus(scale, work_dir):
+    """
+    Copy the real OCR JSON into work_dir, scale times over. Copies after the
+    first misread a few words each. Returns (reports_dir, corrections_dir).
+    """
+    reports_dir = os.path.join(work_dir, 'reports')
+    corrections_dir = os.path.join(work_dir, 'corrections')
+    os.makedirs(reports_dir)
+    os.makedirs(corrections_dir)
+    for json_file in sorted(f for f in os.listdir(REPORTS_DIR) if f.endswith('_gv_ocr.json')):
+        base_name = json_file[:-len('_gv_ocr.json')]
+        with open(os.path.join(REPORTS_DIR, json_file), 'r', encoding='utf-8') as f:
+            pages = json.load(f)
+        for copy in range(scale):
+            copy_name = base_name if copy == 0 else f"{base_name}_s{copy:03d}"
+            rng = random.Random(f"{base_name}/{copy}")
+            if copy:
+                pages_out = {
+                    page: re.sub(r'[A-Za-z]{4,}',
+                                 lambda m: _noisy(m.group(), rng) if rng.random() < NOISE_RATE else m.group(),
+                                 text)
+                    for page, text in pages.items()
+                }
+            else:
+                pages_out = pages
+            with open(os.path.join(reports_dir, f"{copy_name}_gv_ocr.json"), 'w', encoding='utf-8') as f:
+                json.dump(pages_out, f)
+            # The index lists documents by their PDF, which only has to exist
+            open(os.path.join(reports_dir, f"{copy_name}.pdf"), 'wb').close()
+    return reports_dir, corrections_dir
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = max(1, int(round(p / 100 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+def _runner(index, mode):
+    if mode == 'relevance':
+        return lambda q: index.search_ranked(q, limit=20)
+    return lambda q: index.search(q, mode=mode)
+
+
+def _queries(mode):
+    mix = {'query': BOOLEAN_MIX, 'regex': REGEX_MIX}.get(mode, QUERY_MIX)
+    return [q for queries in mix.values() for q in queries]
+
+
+def run_scale(scale, repeats=REPEATS):
+    """Build a corpus at this scale and time every mode. Returns a result dict."""
+    work_dir = tempfile.mkdtemp(prefix=f'cod_bench_{scale}x_')
+    try:
+        reports_dir, corrections_dir = make_corpus(scale, work_dir)
+        index = search_index.SearchIndex(reports_dir, corrections_dir, os.path.join(work_dir, 'index'),
+                                         use_database=False)
+        start = time.perf_counter()
+        index.build()
+        result = {
+            'build_s': round(time.perf_counter() - start, 2),
+            'documents': len(index.documents),
+            'pages': len(index.pages),
+            'text_mb': round(index.corpus.text_bytes / 1e6, 1),
+            'modes': {},
+        }
+
+        for mode in MODES:
+            run = _runner(index, mode)
+            queries = _queries(mode)
+            for q in queries:
+                run(q)  # warm up
+            times = []
+            for _ in range(repeats):
+                for q in queries:
+                    index._last_plan = None  # don't let one run reuse the previous plan
+                    start = time.perf_counter()
+                    run(q)
+                    times.append((time.perf_counter() - start) * 1000)
+            times.sort()
+
+            peaks = []
+            tracemalloc.start()
+            for q in queries:
+                index._last_plan = None
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                run(q)
+                peaks.append(tracemalloc.get_traced_memory()[1] - base)
+            tracemalloc.stop()
+
+            result['modes'][mode] = {
+                'p50_ms': round(percentile(times, 50), 2),
+                'p95_ms': round(percentile(times, 95), 2),
+                'p99_ms': round(percentile(times, 99), 2),
+                'alloc_peak_kb': round(max(peaks) / 1024, 1),
+            }
+        # ru_maxrss is in kilobytes on Linux
+        result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_archive(archive_dir, repeats=REPEATS, threads=4):
+    """
+    Index each boat under archive_dir/boats as a shard and time every mode
+    over all of them, searched in turn and with a pool of this many threads.
+    Returns a result dict.
+    """
+    boats_dir = os.path.join(archive_dir, 'boats')
+    boats = sorted(name for name in os.listdir(boats_dir)
+                   if os.path.isdir(os.path.join(boats_dir, name, 'reports')))
+    work_dir = tempfile.mkdtemp(prefix='cod_bench_shards_')
+    try:
+        shards = []
+        start = time.perf_counter()
+        for boat in boats:
+            shard = search_index.SearchIndex(os.path.join(boats_dir, boat, 'reports'),
+                                             os.path.join(boats_dir, boat, 'corrections'),
+                                             os.path.join(work_dir, boat), use_database=False)
+            shard.build()
+            shards.append((boat, shard))
+        result = {
+            'boats': len(shards),
+            'build_s': round(time.perf_counter() - start, 2),
+            'documents': sum(len(shard.documents) for _, shard in shards),
+            'pages': sum(len(shard.pages) for _, shard in shards),
+            'text_mb': round(sum(shard.corpus.text_bytes for _, shard in shards) / 1e6, 1),
+            'threads': {},
+        }
+
+        for count in sorted({1, threads}):
+            pool = ThreadPoolExecutor(max_workers=count) if count > 1 else None
+            try:
+                shard_set = search_shards.ShardSet(shards, pool)
+                modes = {}
+                for mode in MODES:
+                    run = _runner(shard_set, mode)
+                    queries = _queries(mode)
+                    for q in queries:
+                        run(q)  # warm up
+                    times = []
+                    for _ in range(repeats):
+                        for q in queries:
+                            for _, shard in shards:
+                                shard._last_plan = None
+                            start = time.perf_counter()
+                            run(q)
+                            times.append((time.perf_counter() - start) * 1000)
+                    times.sort()
+                    modes[mode] = {
+                        'p50_ms': round(percentile(times, 50), 2),
+                        'p95_ms': round(percentile(times, 95), 2),
+                    }
+            finally:
+                if pool is not None:
+                    pool.shutdown()
+            result['threads'][count] = modes
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_archive_report(result):
+    print(f"\n=== {result['boats']} boats: {result['documents']} documents, {result['pages']} pages, "
+          f"{result['text_mb']} MB text, built in {result['build_s']}s ===")
+    counts = list(result['threads'])
+    print(f"  {'mode':<10} " + ' '.join(f"{f'p50 ms/{n}t':>11} {f'p95 ms/{n}t':>11}" for n in counts))
+    for mode in MODES:
+        print(f"  {mode:<10} " + ' '.join(f"{result['threads'][n][mode]['p50_ms']:>11} "
+                                          f"{result['threads'][n][mode]['p95_ms']:>11}" for n in counts))
+
+
+def _run_isolated(scale, repeats):
+    """Run one scale in a fresh interpreter so peak RSS belongs to that scale alone."""
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__),
+                           '--run-scale', str(scale), '--repeats', str(repeats)],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        print(proc.stderr)
+        raise RuntimeError(f"Benchmark at {scale}x failed")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def print_report(scale, result):
+    print(f"\n=== {scale}x: {result['documents']} documents, {result['pages']} pages, "
+          f"{result['text_mb']} MB text, built in {result['build_s']}s, "
+          f"peak RSS {result['peak_rss_mb']} MB ===")
+    print(f"  {'mode':<10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'alloc KB':>10}")
+    for mode, stats in result['modes'].items():
+        print(f"  {mode:<10} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9} "
+              f"{stats['alloc_peak_kb']:>10}")
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Return a list of regression descriptions, empty if none."""
+    regressions = []
+    for scale, result in results.items():
+        base = baseline.get(scale)
+        if base is None:
+            continue
+        for mode, stats in result['modes'].items():
+            old = base['modes'].get(mode)
+            if old is None:
+                continue
+            if (stats['p95_ms'] > old['p95_ms'] * (1 + tolerance)
+                    and stats['p95_ms'] - old['p95_ms'] >= MIN_REGRESSION_MS):
+                regressions.append(f"{scale}x {mode}: p95 {old['p95_ms']} ms -> {stats['p95_ms']} ms")
+            if stats['alloc_peak_kb'] > old['alloc_peak_kb'] * (1 + MEMORY_TOLERANCE):
+                regressions.append(f"{scale}x {mode}: allocation peak "
+                                   f"{old['alloc_peak_kb']} KB -> {stats['alloc_peak_kb']} KB")
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + MEMORY_TOLERANCE):
+            regressions.append(f"{scale}x: peak RSS {base['peak_rss_mb']} MB -> {result['peak_rss_mb']} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark search latency and memory.")
+    parser.add_argument('--scales', default='1,10', help="comma-separated corpus scales (default 1,10)")
+    parser.add_argument('--repeats', type=int, default=REPEATS, help="timed runs per query")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline file")
+    parser.add_argument('--save', action='store_true', help="save these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="allowed fractional p95 slowdown before failing (default 0.5)")
+    parser.add_argument('--archive', help="time the shard fan-out over a generate_archive.py archive")
+    parser.add_argument('--threads', type=int, default=4, help="fan-out threads to compare with --archive (default 4)")
+    parser.add_argument('--run-scale', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.archive:
+        print(f"Benchmarking shards of {args.archive}...")
+        print_archive_report(run_archive(args.archive, args.repeats, args.threads))
+        return 0
+
+    if args.run_scale:
+        print(json.dumps(run_scale(args.run_scale, args.repeats)))
+        return 0
+
+    results = {}
+    for scale in [int(s) for s in args.scales.split(',') if s.strip()]:
+        print(f"Benchmarking {scale}x corpus...")
+        results[str(scale)] = _run_isolated(scale, args.repeats)
+        print_report(scale, results[str(scale)])
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save to record one")
+        return 0
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\n*** PERFORMANCE REGRESSION ***")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
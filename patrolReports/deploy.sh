@@ -42,6 +42,7 @@ sudo rsync -av --delete $FORCE_FLAG \
     --exclude='temp_*' \
     --exclude='*.xlsx' \
     --exclude='corrections/' \
+    --exclude='search_index/' \
     "$DEV_DIR/" "$PROD_DIR/"
 
 # Copy .env separately (contains secrets)
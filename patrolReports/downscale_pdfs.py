@@ -2,9 +2,16 @@
 """
 Downscale PDF files for faster web viewing.
 Creates lower-resolution versions in pdfs_web/ subdirectory.
+
+Output is linearized ("fast web view"), so the viewer can show the first
+page after fetching just its byte ranges (see serve_pdf in app.py). MuPDF
+dropped linearization in 1.22; with newer PyMuPDF the file is linearized
+with qpdf if it is installed.
 """
 
 import os
+import shutil
+import subprocess
 import fitz  # PyMuPDF
 
 # Configuration
@@ -13,6 +20,41 @@ OUTPUT_DIR = os.path.join(SOURCE_DIR, 'pdfs_web')
 TARGET_WIDTH = 850  # Target width in pixels (good for web viewing)
 JPEG_QUALITY = 85   # JPEG quality for images (0-100)
 
+def save_linearized(doc, output_path):
+    """
+    Save a PDF compressed and linearized, replacing output_path atomically.
+    Returns True if the file could be linearized.
+    """
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    options = dict(
+        garbage=4,  # Maximum garbage collection
+        deflate=True,  # Compress streams
+        clean=True,  # Clean up redundancies
+    )
+    try:
+        doc.save(tmp_path, linear=True, **options)
+        os.replace(tmp_path, output_path)
+        return True
+    except Exception:
+        pass  # MuPDF 1.22 and later can't linearize
+    doc.save(tmp_path, **options)
+    qpdf = shutil.which('qpdf')
+    if qpdf:
+        linear_path = f"{tmp_path}.linear"
+        result = subprocess.run([qpdf, '--linearize', tmp_path, linear_path],
+                                capture_output=True, text=True)
+        # qpdf exits 3 for warnings, with the output still written
+        if result.returncode in (0, 3):
+            os.replace(linear_path, tmp_path)
+        else:
+            print(f"  qpdf failed: {result.stderr.strip()}")
+            if os.path.exists(linear_path):
+                os.remove(linear_path)
+            qpdf = None
+    os.replace(tmp_path, output_path)
+    return qpdf is not None
+
+
 def downscale_pdf(input_path, output_path, target_width=TARGET_WIDTH):
     """Downscale a PDF by rendering pages at lower resolution."""
     
@@ -51,13 +93,8 @@ def downscale_pdf(input_path, output_path, target_width=TARGET_WIDTH):
         if (page_num + 1) % 10 == 0:
             print(f"  Processed {page_num + 1}/{len(src_doc)} pages...")
     
-    # Save with compression
-    dst_doc.save(
-        output_path,
-        garbage=4,  # Maximum garbage collection
-        deflate=True,  # Compress streams
-        clean=True,  # Clean up redundancies
-    )
+    # Save with compression, linearized for fast web view
+    linearized = save_linearized(dst_doc, output_path)
     
     src_doc.close()
     dst_doc.close()
@@ -67,7 +104,8 @@ def downscale_pdf(input_path, output_path, target_width=TARGET_WIDTH):
     dst_size = os.path.getsize(output_path) / (1024 * 1024)
     reduction = (1 - dst_size / src_size) * 100
     
-    print(f"  Done: {src_size:.1f}MB → {dst_size:.1f}MB ({reduction:.0f}% smaller)")
+    print(f"  Done: {src_size:.1f}MB → {dst_size:.1f}MB ({reduction:.0f}% smaller)"
+          f"{'' if linearized else ', not linearized (install qpdf)'}")
     return dst_size
 
 def main():
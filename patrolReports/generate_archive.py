@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Synthetic archive generator for scale testing.
+
+Writes a fake archive of N boats by M war patrols that looks enough like
+the real one to exercise search, the patrol map and the refresh loaders:
+
+    <output>/boats/<boat>/reports/USS_<Boat>_<n>th_Patrol_Report_gv_ocr.json
+                                  ..._gv_words.json  word boxes, as from OCR
+                                  ....pdf            empty placeholder
+    <output>/boats/<boat>/corrections/
+    <output>/<Boat>_positions.xlsx, <Boat>_ship_contacts.xlsx,
+             <Boat>_aircraft_contacts.xlsx, <Boat>_inferred_positions.xlsx
+                                  same columns as the Cod_*.xlsx files
+    <output>/narrativePageIndex<Boat>.xlsx
+    <output>/<Boat>_map_positions.json   rows as get_all_positions returns them
+
+Report pages read like the real narratives: dated entries of four-digit
+times, positions, radar and sight contacts, attacks and dives, in wartime
+jargon. Contacts and positions in the spreadsheets match the narrative.
+
+The boats/ directory is a search_shards partition layout, so
+    SEARCH_BOATS_DIR=<output>/boats python search_shards.py
+builds one index shard per synthetic boat (alongside Cod's). The
+spreadsheets load with refresh_positions.py <file> and friends; those
+replace their tables, so point DB_NAME at a scratch database first.
+create_map() takes load_map_positions(path).
+
+Usage:
+    python generate_archive.py /tmp/archive                 # 1 boat x 7 patrols
+    python generate_archive.py /tmp/archive --boats 10 --patrols 10
+    python generate_archive.py /tmp/archive --boats 100 --pages 80 --seed 7
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import datetime
+
+BOAT_NAMES = [
+    'cobia', 'bowfin', 'flasher', 'tang', 'barb', 'wahoo', 'silversides', 'batfish',
+    'ling', 'pampanito', 'drum', 'croaker', 'torsk', 'razorback', 'requin', 'lionfish',
+    'becuna', 'cavalla', 'clamagore', 'cobbler', 'parche', 'harder', 'jack', 'guardfish',
+]
+
+ORDINAL_SUFFIXES = {1: 'st', 2: 'nd', 3: 'rd'}
+
+# Patrol areas: (name, latitude, longitude) of the centre
+PATROL_AREAS = [
+    ('South China Sea', 14.0, 115.0), ('Celebes Sea', 4.0, 122.0),
+    ('Gulf of Siam', 9.0, 102.0), ('Sulu Sea', 8.0, 120.0),
+    ('west coast of Luzon', 16.5, 119.0), ('Makassar Strait', -2.0, 118.0),
+    ('Java Sea', -5.0, 111.0), ('Palau', 7.5, 134.5),
+]
+
+PLACES = ['Balabac Strait', 'Macclesfield Bank', 'Cape Bolinao', 'Basilan Strait',
+          'Sibutu Passage', 'Lombok Strait', 'Mindoro', 'Scarborough Shoal',
+          'Camranh Bay', 'Cape Varella', 'Tarakan', 'Davao Gulf']
+
+SHIP_TYPES = ['AK', 'AO', 'AP', 'DD', 'DE', 'PC', 'SC Boat', 'Sampan', 'Trawler', 'Tanker', 'Lugger']
+AIRCRAFT_TYPES = ['Betty', 'Nell', 'Zeke', 'Rufe', 'Jake', 'Pete', 'Mavis', 'NS', 'Ruth']
+POSITION_TYPES = ['NOON', 'NOON', 'NOON', 'INCIDENTAL']
+METHODS = ['P', 'SD', 'SJ', 'S', 'R']
+MISSIONS = ['Patrol', 'Search', 'Convoy cover', 'Anti-submarine', None]
+
+DAY_ENTRIES = [
+    "Submerged for day's patrol {miles} miles off {place}.",
+    "Surfaced. Commenced patrolling on surface along traffic lanes.",
+    "Sighted masts bearing {bearing} (T). Commenced approach.",
+    "SJ radar contact bearing {bearing} (T), range {range:,} yards. Tracking.",
+    "SD radar contact on plane at {miles} miles, closing. Submerged.",
+    "Sighted smoke bearing {bearing} (T). Went ahead full to gain position ahead.",
+    "Made trim dive. Ran test of torpedoes in tubes, all satisfactory.",
+    "Secured from battle stations. Resumed patrol.",
+    "Passed through {place} on the surface, zig-zagging at 15 knots.",
+    "Heard echo ranging on sound bearing {bearing} (T), faint.",
+    "Periscope depth. Nothing in sight. Sea calm, visibility excellent.",
+    "Received ULTRA dispatch on convoy routing. Headed for intercept.",
+    "Lookout reported floating mine close aboard. Sank it with rifle fire.",
+    "Exchanged calls with friendly submarine by SJ radar.",
+]
+
+CONTACT_ENTRIES = [
+    "In Lat. {lat}; Long. {lon}, sighted {type} bearing {bearing} (T), "
+    "range {range:,} yards, course {course}, speed {speed} knots. (Contact #{n}).",
+    "Lat. {lat}; Long. {lon}, made radar contact bearing {bearing} (T), range {range:,} "
+    "yards. Tracked target on course {course} (T). Identified as {type}. (Contact #{n}).",
+]
+
+ATTACK_ENTRIES = [
+    "Fired four torpedoes, Mark 14, track angle {bearing} starboard, depth set 6 feet. "
+    "Heard two hits. Went deep. Escort dropped {charges} depth charges, none close.",
+    "Battle stations torpedo. Fired three stern tubes at {type}. One hit observed "
+    "amidships, target settled by the stern.",
+]
+
+AIRCRAFT_ENTRIES = [
+    "In Lat. {lat}; Long. {lon}, sighted {type} bearing {bearing} (T), distance {miles} miles. "
+    "Submerged. (Aircraft contact #{n}).",
+    "SD radar contact, plane at {miles} miles. Pulled the plug. Later identified as {type}.",
+]
+
+FRONT_MATTER = """SS{hull}/A16-3
+Serial ({serial:02d})
+U.S.S. {BOAT} (SS{hull})
+c/o Fleet Post Office,
+San Francisco,
+California
+{end_date}
+CONFIDENTIAL
+From:
+To:
+Via:
+Subject:
+The Commanding Officer.
+The Commander in Chief, United States Fleet.
+(Official Channels).
+U.S.S. {BOAT} (SS{hull}) Report of War
+Patrol Number {number}.
+Enclosure (A) covering the {ordinal} war
+patrol of this vessel conducted in the {area}
+covering the period {start_date} to {end_date} is forwarded herewith.
+"""
+
+# Page layout for the synthetic word boxes, in points
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+LINE_CHARS = 46
+CHAR_WIDTH = 10
+LINE_HEIGHT = 16
+MARGIN = 60
+LINES_PER_PAGE = 44
+
+
+def ordinal(n):
+    if 10 <= n % 100 <= 20:
+        return f"{n}th"
+    return f"{n}{ORDINAL_SUFFIXES.get(n % 10, 'th')}"
+
+
+def report_name(boat, patrol):
+    return f"USS_{boat.capitalize()}_{ordinal(patrol)}_Patrol_Report"
+
+
+def boat_names(count):
+    """The first count boat names, numbered once the list runs out."""
+    return [BOAT_NAMES[i] if i < len(BOAT_NAMES) else f"{BOAT_NAMES[i % len(BOAT_NAMES)]}{i // len(BOAT_NAMES)}"
+            for i in range(count)]
+
+
+def _deg_min(value):
+    degrees = int(abs(value))
+    return degrees, round((abs(value) - degrees) * 60, 1)
+
+
+def _narrative_pos(lat, lon):
+    lat_d, lat_m = _deg_min(lat)
+    lon_d, lon_m = _deg_min(lon)
+    return (f"{lat_d:02d}-{lat_m:04.1f} {'N' if lat >= 0 else 'S'}.",
+            f"{lon_d:03d}-{lon_m:04.1f} {'E' if lon >= 0 else 'W'}.")
+
+
+def _date_str(day):
+    return f"{day.day} {day.strftime('%B')} {day.year}"
+
+
+def _wrap(text):
+    """Break text into typewriter lines of at most LINE_CHARS."""
+    lines = []
+    line = ''
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > LINE_CHARS:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def _position_row(patrol, number, day, time, timezone, lat, lon, extra):
+    lat_d, lat_m = _deg_min(lat)
+    lon_d, lon_m = _deg_min(lon)
+    row = {
+        'patrol': patrol, 'number': number, 'observation time': time, 'timezone': timezone,
+        'observation date': datetime.datetime(day.year, day.month, day.day),
+        'latitude deg': lat_d, 'latitude min': lat_m, 'latitude hemisphere': 'N' if lat >= 0 else 'S',
+        'longitude deg': lon_d, 'longitude min': lon_m, 'longitude hemisphere': 'E' if lon >= 0 else 'W',
+    }
+    row.update(extra)
+    return row
+
+
+def _hhmm(minute):
+    """Minutes past midnight as a four-digit log time (e.g. 1345)."""
+    return minute // 60 * 100 + minute % 60
+
+
+def generate_patrol(rng, boat, hull, patrol, start, pages_per_patrol, data):
+    """
+    Generate one patrol: its report pages, word boxes and narrative index
+    rows, plus positions and contacts appended to the lists in data.
+    Returns (pages, words, end date).
+    """
+    area, lat, lon = rng.choice(PATROL_AREAS)
+    timezone = -8 if lon < 125 else -9
+    # Narrative lines after the front matter page; each day gets routine
+    # entries until it has its share of what is left of them. A day's
+    # contacts alone average some ten lines, so short reports get short
+    # patrols
+    line_budget = (pages_per_patrol - 1) * LINES_PER_PAGE
+    days = min(rng.randint(40, 60), max(1, line_budget // 12))
+    end = start + datetime.timedelta(days=days - 1)
+
+    lines_by_page = [[]]
+    front = FRONT_MATTER.format(hull=hull, serial=patrol, BOAT=boat.upper(), number=patrol,
+                                ordinal=ordinal(patrol), area=area,
+                                start_date=_date_str(start), end_date=_date_str(end))
+    lines_by_page[0].extend(front.splitlines())
+    lines_by_page.append([])
+    narrative_rows = []
+    ship_n = aircraft_n = position_n = inferred_n = 0
+
+    for day_index in range(days):
+        day = start + datetime.timedelta(days=day_index)
+        lat = max(-10.0, min(25.0, lat + rng.uniform(-0.6, 0.6)))
+        lon = max(100.0, min(140.0, lon + rng.uniform(-0.6, 0.6)))
+        entries = []
+
+        position_n += 1
+        data['positions'].append(_position_row(patrol, position_n, day, 1200, timezone, lat, lon,
+                                               {'type': rng.choice(POSITION_TYPES)}))
+        for _ in range(rng.choice((0, 0, 1, 1, 2, 3))):
+            ship_n += 1
+            c_lat, c_lon = lat + rng.uniform(-0.2, 0.2), lon + rng.uniform(-0.2, 0.2)
+            n_lat, n_lon = _narrative_pos(c_lat, c_lon)
+            ship = {'type': rng.choice(SHIP_TYPES), 'range': rng.randrange(1000, 20000, 100),
+                    'course': rng.randint(0, 359), 'speed': rng.choice((0, 6, 8, 10, 12, 15))}
+            minute = rng.randrange(0, 1435, 5)
+            entries.append((minute, rng.choice(CONTACT_ENTRIES).format(
+                lat=n_lat, lon=n_lon, bearing=rng.randint(0, 359), n=ship_n, **ship)))
+            remarks = None
+            if rng.random() < 0.3:
+                remarks = rng.choice(ATTACK_ENTRIES).format(bearing=rng.randint(30, 120),
+                                                            charges=rng.randint(2, 30), type=ship['type'])
+                entries.append((minute + 5, remarks))
+            row = _position_row(patrol, ship_n, day, _hhmm(minute), timezone, c_lat, c_lon,
+                                dict(ship, method=rng.choice(METHODS), remarks=remarks))
+            row['contact'] = row.pop('number')
+            data['ships'].append(row)
+
+        for _ in range(rng.choice((0, 0, 0, 1, 2))):
+            aircraft_n += 1
+            c_lat, c_lon = lat + rng.uniform(-0.1, 0.1), lon + rng.uniform(-0.1, 0.1)
+            n_lat, n_lon = _narrative_pos(c_lat, c_lon)
+            aircraft = rng.choice(AIRCRAFT_TYPES)
+            miles = rng.randint(2, 25)
+            minute = rng.randrange(0, 1440, 5)
+            entries.append((minute, rng.choice(AIRCRAFT_ENTRIES).format(
+                lat=n_lat, lon=n_lon, type=aircraft, bearing=rng.randint(0, 359), miles=miles, n=aircraft_n)))
+            row = _position_row(patrol, aircraft_n, day, _hhmm(minute), timezone, c_lat, c_lon, {
+                'type': aircraft, 'miles range': miles, 'course': rng.choice((None, rng.randint(0, 359))),
+                'speed': None, 'method': rng.choice(METHODS), 'elevation angle': None,
+                'Probable mission': rng.choice(MISSIONS), 'Remarks': None})
+            row['contact'] = row.pop('number')
+            data['aircraft'].append(row)
+
+        if rng.random() < 0.15:
+            inferred_n += 1
+            place = rng.choice(PLACES)
+            data['inferred'].append({
+                'patrol': patrol, 'number': inferred_n, 'observation time': _hhmm(rng.randrange(0, 1440, 5)),
+                'timezone': timezone, 'observation date': datetime.datetime(day.year, day.month, day.day),
+                'latitude': round(lat, 3), 'longitude': round(lon, 3), 'tag': f"Patrolled off {place}"})
+
+        used = (len(lines_by_page) - 2) * LINES_PER_PAGE + len(lines_by_page[-1])
+        share = (line_budget - used) / (days - day_index)
+        # less the "(Cont.)" line of each page the day runs onto
+        share -= (len(lines_by_page[-1]) + share) // LINES_PER_PAGE
+        day_size = 1 + sum(len(_wrap(entry)) for _, entry in entries)
+        while True:
+            entry = rng.choice(DAY_ENTRIES).format(
+                miles=rng.randint(2, 20), place=rng.choice(PLACES), bearing=rng.randint(0, 359),
+                range=rng.randrange(2000, 20000, 50))
+            if entries and day_size + len(_wrap(entry)) > share:
+                break
+            entries.append((rng.randrange(0, 1440, 5), entry))
+            day_size += len(_wrap(entry))
+
+        # Lay the day out as typewritten lines, moving to a new page when full
+        entries.sort(key=lambda entry: entry[0])
+        day_lines = [_date_str(day)]
+        for minute, entry in entries:
+            wrapped = _wrap(entry)
+            day_lines.append(f"{_hhmm(minute):04d} {wrapped[0]}")
+            day_lines.extend(wrapped[1:])
+        if len(lines_by_page[-1]) + 3 > LINES_PER_PAGE:
+            lines_by_page.append([])
+        narrative_rows.append({'patrol': patrol, 'page': len(lines_by_page),
+                               'observation date': datetime.datetime(day.year, day.month, day.day),
+                               'observation time': _hhmm(entries[0][0]) if entries else None})
+        for line in day_lines:
+            if len(lines_by_page[-1]) >= LINES_PER_PAGE:
+                lines_by_page.append([f"{_date_str(day)} (Cont.)"])
+            lines_by_page[-1].append(line)
+
+    data['narrative'].extend(narrative_rows)
+
+    pages = {}
+    words = {}
+    for page_index, lines in enumerate(lines_by_page, 1):
+        pages[str(page_index)] = '\n'.join(['CONFIDENTIAL'] + lines)
+        page_words = []
+        for line_no, line in enumerate(['CONFIDENTIAL'] + lines):
+            column = 0
+            y = MARGIN + line_no * LINE_HEIGHT
+            for word in line.split(' '):
+                if word:
+                    x = MARGIN + column * CHAR_WIDTH
+                    page_words.append([word, x, y, x + len(word) * CHAR_WIDTH, y + LINE_HEIGHT - 4])
+                column += len(word) + 1
+        words[str(page_index)] = {'width': PAGE_WIDTH, 'height': PAGE_HEIGHT, 'words': page_words}
+    return pages, words, end
+
+
+def _map_rows(boat_data):
+    """Rows shaped like generate_patrol_map.get_all_positions() results."""
+    rows = []
+    for source, key, detail in (('ship', 'ships', 'type'), ('aircraft', 'aircraft', 'type'),
+                                ('position', 'positions', 'type')):
+        for r in boat_data[key]:
+            lat = r['latitude deg'] + r['latitude min'] / 60
+            lon = r['longitude deg'] + r['longitude min'] / 60
+            rows.append({
+                'patrol': r['patrol'], 'observation_date': r['observation date'].date().isoformat(),
+                'observation_time': f"{r['observation time']:04d}",
+                'latitude': round(lat if r['latitude hemisphere'] == 'N' else -lat, 4),
+                'longitude': round(lon if r['longitude hemisphere'] == 'E' else -lon, 4),
+                'source': source, 'detail': r[detail],
+                'latitude_deg': r['latitude deg'], 'latitude_min': r['latitude min'],
+                'latitude_hemisphere': r['latitude hemisphere'],
+                'longitude_deg': r['longitude deg'], 'longitude_min': r['longitude min'],
+                'longitude_hemisphere': r['longitude hemisphere'],
+                'remarks': r.get('remarks') or r.get('Remarks'), 'contact_no': r.get('contact'),
+            })
+    for r in boat_data['inferred']:
+        rows.append({
+            'patrol': r['patrol'], 'observation_date': r['observation date'].date().isoformat(),
+            'observation_time': f"{r['observation time']:04d}", 'latitude': r['latitude'],
+            'longitude': r['longitude'], 'source': 'inferred', 'detail': r['tag'],
+            'latitude_deg': None, 'latitude_min': None, 'latitude_hemisphere': None,
+            'longitude_deg': None, 'longitude_min': None, 'longitude_hemisphere': None,
+            'remarks': r['tag'],
+        })
+    return rows
+
+
+def load_map_positions(path):
+    """Read a *_map_positions.json file back with dates as date objects, for create_map()."""
+    with open(path, 'r', encoding='utf-8') as f:
+        rows = json.load(f)
+    for row in rows:
+        row['observation_date'] = datetime.date.fromisoformat(row['observation_date'])
+    return rows
+
+
+def generate_boat(output_dir, boat, boat_index, patrols, pages_per_patrol, rng):
+    """
+    Write one boat's reports, spreadsheets and map positions. Returns its page
+    count and the number of positions and contacts.
+    """
+    import pandas as pd
+
+    reports_dir = os.path.join(output_dir, 'boats', boat, 'reports')
+    os.makedirs(reports_dir, exist_ok=True)
+    os.makedirs(os.path.join(output_dir, 'boats', boat, 'corrections'), exist_ok=True)
+    hull = 200 + boat_index * 7 % 300
+    data = {'positions': [], 'ships': [], 'aircraft': [], 'inferred': [], 'narrative': []}
+    start = datetime.date(1943, 6, 1) + datetime.timedelta(days=rng.randint(0, 120))
+    page_count = 0
+    for patrol in range(1, patrols + 1):
+        pages, words, end = generate_patrol(rng, boat, hull, patrol, start, pages_per_patrol, data)
+        page_count += len(pages)
+        base_name = report_name(boat, patrol)
+        with open(os.path.join(reports_dir, f"{base_name}_gv_ocr.json"), 'w', encoding='utf-8') as f:
+            json.dump(pages, f, indent=2, ensure_ascii=False)
+        with open(os.path.join(reports_dir, f"{base_name}_gv_words.json"), 'w', encoding='utf-8') as f:
+            json.dump(words, f, separators=(',', ':'))
+        # Report lists are built from the PDFs, which only have to exist
+        open(os.path.join(reports_dir, f"{base_name}.pdf"), 'wb').close()
+        start = end + datetime.timedelta(days=rng.randint(25, 45))
+
+    name = boat.capitalize()
+    sheets = {
+        f"{name}_positions.xlsx": (data['positions'], None),
+        f"{name}_ship_contacts.xlsx": (data['ships'], [
+            'patrol', 'contact', 'observation time', 'timezone', 'observation date',
+            'latitude deg', 'latitude min', 'latitude hemisphere', 'longitude deg',
+            'longitude min', 'longitude hemisphere', 'type', 'range', 'course', 'speed',
+            'method', 'remarks']),
+        f"{name}_aircraft_contacts.xlsx": (data['aircraft'], [
+            'patrol', 'contact', 'observation time', 'timezone', 'observation date',
+            'latitude deg', 'latitude min', 'latitude hemisphere', 'longitude deg',
+            'longitude min', 'longitude hemisphere', 'type', 'miles range', 'course', 'speed',
+            'method', 'elevation angle', 'Probable mission', 'Remarks']),
+        f"{name}_inferred_positions.xlsx": (data['inferred'], [
+            'patrol', 'number', 'observation time', 'timezone', 'observation date',
+            'latitude', 'longitude', 'tag']),
+        f"narrativePageIndex{name}.xlsx": (data['narrative'], [
+            'patrol', 'page', 'observation date', 'observation time']),
+    }
+    for filename, (rows, columns) in sheets.items():
+        pd.DataFrame(rows, columns=columns).to_excel(os.path.join(output_dir, filename), index=False)
+    with open(os.path.join(output_dir, f"{name}_map_positions.json"), 'w', encoding='utf-8') as f:
+        json.dump(_map_rows(data), f, separators=(',', ':'))
+    return page_count, {key: len(data[key]) for key in ('positions', 'ships', 'aircraft', 'inferred')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic patrol report archive.")
+    parser.add_argument('output_dir', help="directory to write the archive to")
+    parser.add_argument('--boats', type=int, default=1, help="number of boats (default 1)")
+    parser.add_argument('--patrols', type=int, default=7, help="war patrols per boat (default 7)")
+    parser.add_argument('--pages', type=int, default=50, help="approximate pages per report (default 50)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed; the same seed writes the same archive")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    total_pages = 0
+    for boat_index, boat in enumerate(boat_names(args.boats)):
+        rng = random.Random(f"{args.seed}/{boat}")
+        pages, counts = generate_boat(args.output_dir, boat, boat_index, args.patrols, args.pages, rng)
+        total_pages += pages
+        print(f"  {boat}: {args.patrols} patrols, {pages} pages, {counts['positions']} positions, "
+              f"{counts['ships']} ship and {counts['aircraft']} aircraft contacts")
+    print(f"Wrote {args.boats} boats, {total_pages} pages to {args.output_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
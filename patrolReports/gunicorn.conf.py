@@ -22,3 +22,15 @@ proc_name = "codpatrols"
 
 # Working directory
 chdir = "/var/www/html/codpatrols"
+
+
+def on_starting(server):
+    """Rebuild stale search shards once in the master, before any worker starts."""
+    import search_shards
+    search_shards.prebuild()
+
+
+def post_worker_init(worker):
+    """Load the search index shards once per worker, before it takes requests."""
+    import search_shards
+    search_shards.get_shards()
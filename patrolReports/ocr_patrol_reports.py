@@ -43,11 +43,12 @@ def ocr_image_bytes(image_bytes):
                         vertices = word.bounding_box.vertices
                         if len(vertices) >= 4:
                             x = min(v.x for v in vertices)
+                            x2 = max(v.x for v in vertices)
                             y = min(v.y for v in vertices)
                             y2 = max(v.y for v in vertices)
                             words.append({
                                 'text': word_text,
-                                'x': x, 'y': y, 'y2': y2,
+                                'x': x, 'x2': x2, 'y': y, 'y2': y2,
                                 'height': y2 - y
                             })
     
@@ -66,6 +67,7 @@ def process_pdf(source_pdf):
     
     new_doc = fitz.open()
     ocr_texts = {}
+    ocr_words = {}  # word boxes for search hit highlighting
     
     for page_num in range(num_pages):
         print(f"  Page {page_num + 1}/{num_pages}...", end=" ", flush=True)
@@ -86,6 +88,11 @@ def process_pdf(source_pdf):
         try:
             full_text, words = ocr_image_bytes(img_bytes)
             ocr_texts[str(page_num + 1)] = full_text
+            ocr_words[str(page_num + 1)] = {
+                'width': render_width,
+                'height': render_height,
+                'words': [[w['text'], w['x'], w['y'], w['x2'], w['y2']] for w in words]
+            }
             print(f"({len(words)} words)")
             
             # Create new page at render size (matches OCR coordinates)
@@ -132,6 +139,12 @@ def process_pdf(source_pdf):
     with open(json_path, 'w', encoding='utf-8') as f:
         json.dump(ocr_texts, f, indent=2, ensure_ascii=False)
     print(f"Saved: {json_path}")
+    
+    # Save word boxes (page pixels, reading order) for the search index
+    words_path = os.path.join(OUTPUT_DIR, f"{base_name}_gv_words.json")
+    with open(words_path, 'w', encoding='utf-8') as f:
+        json.dump(ocr_words, f, ensure_ascii=False, separators=(',', ':'))
+    print(f"Saved: {words_path}")
 
 def main():
     # Process specific patrol or all
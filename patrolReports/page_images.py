@@ -0,0 +1,171 @@
+"""
+Single report pages rendered to WebP, cached on disk for every worker.
+
+/pages/<report>/<n>.webp?w=850 renders one page with PyMuPDF at the
+requested width, so a deep link from a search result opens with one small
+image instead of the whole PDF. Rendered images are files under
+search_index/page_images/, named by the PDF's content hash, page and width,
+so a replaced PDF never serves stale images. A small SQLite table shared by
+all workers (like search_cache) tracks their sizes and last use, and the
+least recently used images are deleted once the total passes the limit.
+"""
+
+import io
+import os
+import time
+import sqlite3
+
+from search_index import INDEX_DIR
+
+CACHE_DIR = os.path.join(INDEX_DIR, 'page_images')
+MAX_CACHE_BYTES = int(os.environ.get('PAGE_IMAGE_CACHE_BYTES', 2 * 1024 ** 3))
+
+# Widths are snapped to a multiple of WIDTH_STEP within these bounds, so
+# clients asking for arbitrary sizes can't fill the cache with near-copies
+MIN_WIDTH = 200
+MAX_WIDTH = 2400
+WIDTH_STEP = 50
+DEFAULT_WIDTH = 850
+
+WEBP_QUALITY = 80
+
+# Variants rendered from, best scan first (see report_catalog)
+RENDER_VARIANTS = ('original', 'gv', 'v3', 'web')
+
+
+def snap_width(width):
+    """A requested width clamped to the allowed range and rounded to WIDTH_STEP."""
+    width = DEFAULT_WIDTH if width is None else width
+    width = max(MIN_WIDTH, min(width, MAX_WIDTH))
+    return int(round(width / WIDTH_STEP)) * WIDTH_STEP
+
+
+def render_page(pdf_path, page_num, width, quality=WEBP_QUALITY):
+    """
+    WebP bytes of one page (1-based) rendered at width pixels. Raises
+    IndexError for pages the PDF doesn't have.
+    """
+    import fitz  # PyMuPDF
+    from PIL import Image
+    doc = fitz.open(pdf_path)
+    try:
+        if page_num < 1 or page_num > len(doc):
+            raise IndexError(f"{os.path.basename(pdf_path)} has no page {page_num}")
+        page = doc[page_num - 1]
+        scale = width / page.rect.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+        image = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+    finally:
+        doc.close()
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', quality=quality, method=4)
+    return buffer.getvalue()
+
+
+class PageImageCache:
+    """Rendered page images on disk, evicted least recently used first by total size."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        # Connections must not be shared across a fork, so open one per process
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(self.cache_dir, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.cache_dir, 'images.sqlite'), timeout=5,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS images (
+                    name TEXT PRIMARY KEY,
+                    bytes INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_last_used ON images (last_used)')
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def image_name(digest, page_num, width):
+        return f"{digest}-{page_num}-{width}.webp"
+
+    def get(self, pdf_info, page_num, width):
+        """
+        Path of the cached image of a page of a catalog PDF, rendering it
+        first if needed. Raises IndexError for pages the PDF doesn't have.
+        """
+        name = self.image_name(pdf_info['sha256'], page_num, width)
+        path = os.path.join(self.cache_dir, name)
+        conn = self._connect()
+        if os.path.exists(path):
+            try:
+                conn.execute('UPDATE images SET last_used = ? WHERE name = ?', (time.time(), name))
+            except sqlite3.Error as e:
+                print(f"Page image cache update failed: {e}")
+            return path
+
+        data = render_page(pdf_info['path'], page_num, width)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('INSERT OR REPLACE INTO images (name, bytes, last_used) VALUES (?, ?, ?)',
+                             (name, len(data), time.time()))
+                evicted = self._evict(conn, name)
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            print(f"Page image cache write failed: {e}")
+            return path
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.cache_dir, old_name))
+            except OSError:
+                pass
+        return path
+
+    def _evict(self, conn, keep):
+        """
+        Drop the least recently used rows, other than keep, until the total
+        fits; returns their names.
+        """
+        total = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM images').fetchone()[0]
+        evicted = []
+        if total <= self.max_bytes:
+            return evicted
+        rows = conn.execute('SELECT name, bytes FROM images WHERE name != ? ORDER BY last_used',
+                            (keep,)).fetchall()
+        for name, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append(name)
+            total -= size
+        conn.executemany('DELETE FROM images WHERE name = ?', [(name,) for name in evicted])
+        return evicted
+
+    def stats(self):
+        """Number and total size of cached images."""
+        images, size = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM images').fetchone()
+        return {'images': images, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+# One cache handle per worker process
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = PageImageCache()
+    return _cache
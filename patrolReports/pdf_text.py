@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of PyMuPDF text extraction, shared by every worker.
+
+Each PDF's page texts and text span boxes are extracted once and written to
+search_index/pdf_text/<sha256 of the PDF>.bin. Files are keyed by content,
+so a replaced or rebuilt PDF gets a new file and old entries are simply
+never looked up again; workers map the files read-only and decode only the
+page asked for.
+
+File layout (little-endian):
+    header      magic, format version, page count and section offsets
+    sizes       float64 (width, height) of every page in PDF points
+    offsets     (page count + 1) uint64 byte offsets into the text buffer
+    text        page texts from page.get_text(), UTF-8, back to back
+    spans       (page count + 1) uint64 span offsets, then (span count + 1)
+                uint64 byte offsets into the span text buffer, the span
+                texts, and float32 (x0, y0, x1, y1) boxes of every span
+
+Entries for PDFs that are no longer in the report catalog (any boat, any
+variant) are deleted by prune(), which the web app runs after rebuilding a
+corrected PDF. Run directly to fill the cache for every report variant and
+prune:
+    python pdf_text.py
+"""
+
+import os
+import mmap
+import struct
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, 'search_index', 'pdf_text')
+
+MAGIC = b'CODPDFT\x00'
+FORMAT_VERSION = 1
+
+# magic, format version, page count, sizes offset, offsets offset, text
+# offset, span table offset, span text table offset, span text offset,
+# span boxes offset
+HEADER = struct.Struct('<8sIIQQQQQQQ')
+
+# Extracted files kept mapped per process
+MAX_OPEN = 32
+
+_hashes = {}  # path -> ((inode, mtime_ns, size), sha256 hex digest)
+_open = OrderedDict()  # digest -> PdfText
+_lock = threading.Lock()
+
+
+def _align(n, alignment=8):
+    return (n + alignment - 1) // alignment * alignment
+
+
+def content_hash(path):
+    """SHA-256 of a file, remembered until the file's inode, mtime or size changes."""
+    st = os.stat(path)
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _hashes.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    _hashes[path] = (stamp, digest.hexdigest())
+    return _hashes[path][1]
+
+
+def extract(pdf_path):
+    """
+    Run PyMuPDF over every page: ([(width, height)], [text], [[(text, bbox)]])
+    with the non-blank text spans of each page.
+    """
+    import fitz  # PyMuPDF
+    sizes = []
+    texts = []
+    spans = []
+    doc = fitz.open(pdf_path)
+    try:
+        for page in doc:
+            sizes.append((page.rect.width, page.rect.height))
+            texts.append(page.get_text())
+            page_spans = []
+            for block in page.get_text("dict").get("blocks", []):
+                if block.get("type") != 0:  # not a text block
+                    continue
+                for line in block.get("lines", []):
+                    for span in line.get("spans", []):
+                        text = span.get("text", "").strip()
+                        if text:
+                            page_spans.append((text, span.get("bbox", (0, 0, 0, 0))))
+            spans.append(page_spans)
+    finally:
+        doc.close()
+    return sizes, texts, spans
+
+
+def _offsets(chunks):
+    offsets = array('Q', [0])
+    for chunk in chunks:
+        offsets.append(offsets[-1] + len(chunk))
+    return offsets
+
+
+def write_cache(path, sizes, texts, spans):
+    """Write extracted pages to a cache file atomically."""
+    size_array = array('d', [v for size in sizes for v in size])
+    encoded = [text.encode('utf-8') for text in texts]
+    text_offsets = _offsets(encoded)
+    span_offsets = array('Q', [0])
+    span_texts = []
+    boxes = array('f')
+    for page_spans in spans:
+        span_offsets.append(span_offsets[-1] + len(page_spans))
+        for text, bbox in page_spans:
+            span_texts.append(text.encode('utf-8'))
+            boxes.extend(bbox)
+    span_text_offsets = _offsets(span_texts)
+
+    sizes_offset = _align(HEADER.size)
+    offsets_offset = sizes_offset + len(size_array) * 8
+    text_offset = offsets_offset + len(text_offsets) * 8
+    span_table_offset = _align(text_offset + text_offsets[-1])
+    span_text_table_offset = span_table_offset + len(span_offsets) * 8
+    span_text_offset = span_text_table_offset + len(span_text_offsets) * 8
+    boxes_offset = _align(span_text_offset + span_text_offsets[-1])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(texts), sizes_offset, offsets_offset,
+                            text_offset, span_table_offset, span_text_table_offset,
+                            span_text_offset, boxes_offset))
+        _pad(f, sizes_offset)
+        size_array.tofile(f)
+        text_offsets.tofile(f)
+        for chunk in encoded:
+            f.write(chunk)
+        _pad(f, span_table_offset)
+        span_offsets.tofile(f)
+        span_text_offsets.tofile(f)
+        for chunk in span_texts:
+            f.write(chunk)
+        _pad(f, boxes_offset)
+        boxes.tofile(f)
+    os.replace(tmp_path, path)
+
+
+def _pad(f, offset):
+    f.write(b'\x00' * (offset - f.tell()))
+
+
+class PdfText:
+    """Read-only, memory-mapped view of one PDF's cached extraction."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, page_count, sizes_offset, offsets_offset, text_offset,
+             span_table_offset, span_text_table_offset, span_text_offset,
+             boxes_offset) = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{path} is not a version {FORMAT_VERSION} PDF text file")
+        except (struct.error, ValueError):
+            self._mm.close()
+            raise
+        self.page_count = page_count
+        self._sizes = array('d')
+        self._sizes.frombytes(self._mm[sizes_offset:offsets_offset])
+        self._text_offset = text_offset
+        self._offsets = array('Q')
+        self._offsets.frombytes(self._mm[offsets_offset:text_offset])
+        self._span_offsets = array('Q')
+        self._span_offsets.frombytes(self._mm[span_table_offset:span_text_table_offset])
+        self._span_text_table_offset = span_text_table_offset
+        self._span_text_offset = span_text_offset
+        self._boxes_offset = boxes_offset
+
+    def __len__(self):
+        return self.page_count
+
+    def page_size(self, page_index):
+        """(width, height) of a page (0-based) in PDF points."""
+        return self._sizes[2 * page_index], self._sizes[2 * page_index + 1]
+
+    def page_text(self, page_index):
+        """page.get_text() of a page (0-based)."""
+        start = self._text_offset + self._offsets[page_index]
+        end = self._text_offset + self._offsets[page_index + 1]
+        return self._mm[start:end].decode('utf-8')
+
+    def pages(self):
+        """[(page_num, text)] for every page, 1-based like extract_text_from_pdf."""
+        return [(i + 1, self.page_text(i)) for i in range(self.page_count)]
+
+    def page_spans(self, page_index):
+        """[(text, (x0, y0, x1, y1))] of the text spans on a page (0-based)."""
+        first = self._span_offsets[page_index]
+        last = self._span_offsets[page_index + 1]
+        if first == last:
+            return []
+        text_offsets = array('Q')
+        text_offsets.frombytes(self._mm[self._span_text_table_offset + 8 * first:
+                                        self._span_text_table_offset + 8 * (last + 1)])
+        boxes = array('f')
+        boxes.frombytes(self._mm[self._boxes_offset + 16 * first:self._boxes_offset + 16 * last])
+        base = self._span_text_offset
+        return [(self._mm[base + text_offsets[i]:base + text_offsets[i + 1]].decode('utf-8'),
+                 tuple(boxes[4 * i:4 * i + 4]))
+                for i in range(last - first)]
+
+    def close(self):
+        self._mm.close()
+
+
+def cache_path(digest, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{digest}.bin")
+
+
+def get_pdf_text(pdf_path, cache_dir=CACHE_DIR):
+    """
+    The cached extraction of a PDF, extracting and writing it first if no
+    worker has yet. Raises OSError if the PDF can't be read and whatever
+    PyMuPDF raises if it can't be parsed.
+    """
+    digest = content_hash(pdf_path)
+    with _lock:
+        if digest in _open:
+            _open.move_to_end(digest)
+            return _open[digest]
+    path = cache_path(digest, cache_dir)
+    try:
+        pdf_text = PdfText(path)
+    except (OSError, ValueError):
+        write_cache(path, *extract(pdf_path))
+        pdf_text = PdfText(path)
+    with _lock:
+        _open[digest] = pdf_text
+        # Evicted maps stay valid until collected, as callers may still hold them
+        while len(_open) > MAX_OPEN:
+            _open.popitem(last=False)
+    return pdf_text
+
+
+def prune(catalog=None, cache_dir=CACHE_DIR):
+    """
+    Delete the cache files of PDFs not in the report catalog. Returns the
+    number removed.
+    """
+    from report_catalog import get_catalog
+    catalog = catalog or get_catalog()
+    keep = {f"{info['sha256']}.bin" for report in catalog.reports.values()
+            for info in report['variants'].values()}
+    removed = 0
+    for name in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+        if name.endswith('.bin') and name not in keep:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def main():
+    from report_catalog import Catalog
+    catalog = Catalog().refresh()
+    cached = 0
+    for name, report in sorted(catalog.reports.items()):
+        for variant, info in report['variants'].items():
+            if variant == 'web':  # downscaled for viewing, never read for text
+                continue
+            pdf_text = get_pdf_text(info['path'])
+            cached += 1
+            print(f"  {name} ({variant}): {len(pdf_text)} pages")
+    removed = prune(catalog)
+    print(f"Cached {cached} PDFs in {CACHE_DIR}, removed {removed} stale entries")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,19 @@
 #!/usr/bin/env python3
 """
 Refresh the inferred_positions table from Cod_inferred_positions.xlsx
+Usage:
+    python refresh_inferred_positions.py [file.xlsx]
 """
 
+import sys
 import pandas as pd
 import mysql.connector
 from datetime import datetime
 
-def refresh_inferred_positions():
+def refresh_inferred_positions(xlsx_file='Cod_inferred_positions.xlsx'):
     # Read Excel file
-    df = pd.read_excel('Cod_inferred_positions.xlsx')
-    print(f"Read {len(df)} rows from Cod.xlsx")
+    df = pd.read_excel(xlsx_file)
+    print(f"Read {len(df)} rows from {xlsx_file}")
     
     # Connect to database
     from db_config import get_db_connection
@@ -95,6 +98,6 @@ def refresh_inferred_positions():
     conn.close()
 
 if __name__ == '__main__':
-    refresh_inferred_positions()
+    refresh_inferred_positions(*sys.argv[1:2])
 
 
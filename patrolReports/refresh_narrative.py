@@ -2,8 +2,11 @@
 """
 Refresh narrative_page_index table from Excel file.
 Maps patrol report pages to dates/times for linking search results to correct pages.
+Usage:
+    python refresh_narrative.py [file.xlsx]
 """
 
+import sys
 import pandas as pd
 from db_config import get_db_connection
 
@@ -23,11 +26,10 @@ def safe_str(val):
     s = str(val).strip()
     return s if s else None
 
-def refresh_narrative():
+def refresh_narrative(xlsx_file='narrativePageIndexCod.xlsx'):
     """Load narrative page index from Excel into database."""
     
     # Read Excel file
-    xlsx_file = 'narrativePageIndexCod.xlsx'
     df = pd.read_excel(xlsx_file)
     print(f"Read {len(df)} rows from {xlsx_file}")
     print(f"Columns: {list(df.columns)}")
@@ -102,9 +104,14 @@ def refresh_narrative():
     
     cursor.close()
     conn.close()
+    
+    # Search date filters and facets are built from this table
+    from search_index import SearchIndex
+    print("\nRebuilding search index with the new page dates...")
+    SearchIndex().build()
     print("\nDone!")
     return True
 
 if __name__ == '__main__':
-    refresh_narrative()
+    refresh_narrative(*sys.argv[1:2])
 
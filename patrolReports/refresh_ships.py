@@ -3,12 +3,13 @@
 Refresh the ship_contacts table from the Excel file.
 
 Usage:
-    python refresh_ships.py
+    python refresh_ships.py [file.xlsx]
 """
 
 import mysql.connector
 import pandas as pd
 import os
+import sys
 
 EXCEL_FILE = os.path.join(os.path.dirname(__file__), 'Cod_ship_contacts.xlsx')
 
@@ -27,14 +28,14 @@ def safe_str(val):
         return None
     return str(val).strip()
 
-def refresh_ships():
+def refresh_ships(excel_file=EXCEL_FILE):
     # Read the Excel file
-    if not os.path.exists(EXCEL_FILE):
-        print(f"Error: Excel file not found: {EXCEL_FILE}")
+    if not os.path.exists(excel_file):
+        print(f"Error: Excel file not found: {excel_file}")
         return False
     
-    df = pd.read_excel(EXCEL_FILE)
-    print(f"Read {df.shape[0]} rows from {os.path.basename(EXCEL_FILE)}")
+    df = pd.read_excel(excel_file)
+    print(f"Read {df.shape[0]} rows from {os.path.basename(excel_file)}")
 
     # Connect to MySQL
     from db_config import get_db_connection
@@ -152,9 +153,14 @@ def refresh_ships():
 
     cursor.close()
     conn.close()
+
+    # Search serves ship contact remarks from its own copy of this table
+    from search_index import SearchIndex
+    print("\nRebuilding search index with the new ship contacts...")
+    SearchIndex().build()
     print("\nDone!")
     return True
 
 if __name__ == '__main__':
-    refresh_ships()
+    refresh_ships(*sys.argv[1:2])
 
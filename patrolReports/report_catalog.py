@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Catalog of the patrol report PDFs and their variants.
+
+A report can exist as several files, used for different things:
+    web         pdfs_web/<name>.pdf, downscaled for the viewer (downscale_pdfs.py)
+    gv          <name>_gv.pdf, with the Google Vision text layer
+    v3          <name>_v3.pdf, with the V3 OCR text layer
+    original    <name>.pdf, the full-resolution scan
+    corrected   <name>_corrected.pdf, rebuilt with corrected text
+Reports of other boats live under boats/<boat>/reports (see search_shards).
+
+The catalog records each variant's path, size, page count and SHA-256 and
+keeps them in search_index/catalog.json, so serving a PDF or counting its
+pages is a dict lookup instead of a round of os.path.exists probes and
+fitz.open calls. It is rescanned when a reports directory changes (a file
+added, removed or renamed into place), and a file is only reopened and
+hashed again when its size or mtime changed. A file rewritten in place
+doesn't change its directory, so each variant looked up is also checked
+against os.stat and its entry refreshed if the file changed. Workers pick
+up each other's rescans from catalog.json.
+
+Run directly to rescan and list the catalog:
+    python report_catalog.py
+"""
+
+import os
+import json
+
+from search_index import BASE_DIR, INDEX_DIR, list_report_pdfs
+from search_shards import BOATS_DIR, DEFAULT_BOAT, boat_dirs, list_boats
+
+WEB_DIR = os.path.join(BASE_DIR, 'pdfs_web')
+CATALOG_PATH = os.path.join(INDEX_DIR, 'catalog.json')
+CATALOG_VERSION = 1
+
+# File name suffix of each variant kept next to the original
+VARIANT_SUFFIXES = {'gv': '_gv.pdf', 'v3': '_v3.pdf', 'corrected': '_corrected.pdf'}
+
+# Variants in the order the viewer prefers them
+VIEW_VARIANTS = ('web', 'gv', 'v3', 'original')
+
+# Variants in the order OCR text and page counts are taken from
+TEXT_VARIANTS = ('v3', 'original')
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st
+
+
+def _file_info(path, previous=None):
+    """
+    {'path', 'size', 'mtime_ns', 'pages', 'sha256'} of a PDF, or None if it
+    doesn't exist. previous is reused if the file hasn't changed since.
+    """
+    st = _stat(path)
+    if st is None:
+        return None
+    if previous and previous['size'] == st.st_size and previous['mtime_ns'] == st.st_mtime_ns:
+        return dict(previous, path=path)
+    import fitz  # PyMuPDF
+    from pdf_text import content_hash
+    try:
+        doc = fitz.open(path)
+        pages = len(doc)
+        doc.close()
+    except Exception as e:
+        print(f"Error opening {path}: {e}")
+        pages = 0
+    return {
+        'path': path,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'pages': pages,
+        'sha256': content_hash(path),
+    }
+
+
+class Catalog:
+    """Report PDFs of every boat and the variants each one has on disk."""
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self.reports = {}  # report name -> {'boat', 'variants': {variant: file info}}
+        self.boats = {}    # boat -> report names, sorted
+        self._dir_stamps = None  # [[directory, mtime_ns]] the catalog was scanned from
+        self._file_id = None  # (inode, mtime_ns) of the catalog file last loaded or saved
+
+    def _directories(self):
+        """[(boat, reports directory)], then the web directory under boat None."""
+        dirs = [(boat, boat_dirs(boat)[0]) for boat in list_boats()]
+        dirs.append((None, WEB_DIR))
+        return dirs
+
+    def _current_stamps(self):
+        stamps = [[BOATS_DIR, None]] + [[directory, None] for _, directory in self._directories()]
+        for stamp in stamps:
+            st = _stat(stamp[0])
+            stamp[1] = st.st_mtime_ns if st else None
+        return stamps
+
+    def _catalog_file_id(self):
+        st = _stat(self.path)
+        return (st.st_ino, st.st_mtime_ns) if st else None
+
+    def ensure_current(self):
+        """Rescan if any reports directory changed, or load another worker's rescan."""
+        stamps = self._current_stamps()
+        file_id = self._catalog_file_id()
+        if stamps == self._dir_stamps and file_id == self._file_id:
+            return self
+        if file_id != self._file_id and self.load() and self._dir_stamps == stamps:
+            return self
+        self.refresh(stamps)
+        return self
+
+    def load(self):
+        """Load the saved catalog. Returns False if there is none or it's unreadable."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            file_id = self._catalog_file_id()
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != CATALOG_VERSION:
+            return False
+        self.reports = data['reports']
+        self.boats = data['boats']
+        self._dir_stamps = data['dir_stamps']
+        self._file_id = file_id
+        return True
+
+    def refresh(self, stamps=None):
+        """
+        Rescan every reports directory and save the catalog. Call after
+        rewriting a PDF in place, which doesn't change its directory.
+        """
+        stamps = stamps or self._current_stamps()
+        reports = {}
+        boats = {}
+        for boat, directory in self._directories():
+            if boat is None:
+                continue
+            try:
+                names = list_report_pdfs(directory)
+            except OSError:
+                names = []
+            boats[boat] = names
+            for name in names:
+                previous = self.reports.get(name, {}).get('variants', {})
+                base_name = name[:-len('.pdf')]
+                paths = {'original': os.path.join(directory, name)}
+                for variant, suffix in VARIANT_SUFFIXES.items():
+                    paths[variant] = os.path.join(directory, base_name + suffix)
+                if boat == DEFAULT_BOAT:
+                    paths['web'] = os.path.join(WEB_DIR, name)
+                variants = {}
+                for variant, path in paths.items():
+                    info = _file_info(path, previous.get(variant))
+                    if info is not None:
+                        variants[variant] = info
+                reports[name] = {'boat': boat, 'variants': variants}
+        self.reports = reports
+        self.boats = boats
+        self._dir_stamps = stamps
+        self._save()
+        return self
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': CATALOG_VERSION,
+                'dir_stamps': self._dir_stamps,
+                'boats': self.boats,
+                'reports': self.reports,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._file_id = self._catalog_file_id()
+
+    def report_names(self, boat=DEFAULT_BOAT):
+        """A boat's report PDF names, sorted."""
+        return self.boats.get(boat, [])
+
+    def report_boat(self, name):
+        """The boat a report belongs to, or None."""
+        return self.reports.get(name, {}).get('boat')
+
+    def variant(self, name, preference):
+        """
+        File info of the first of the preferred variants a report has, or
+        None. The info matches the file's current size and mtime.
+        """
+        variants = self.reports.get(name, {}).get('variants', {})
+        for variant in preference:
+            if variant in variants and self._check(variants, variant):
+                return variants[variant]
+        return None
+
+    def _check(self, variants, variant):
+        """
+        Refresh a variant's entry if its file changed since it was catalogued.
+        Returns False, dropping the entry, if the file is gone.
+        """
+        info = variants[variant]
+        st = _stat(info['path'])
+        if st is not None and (st.st_size, st.st_mtime_ns) == (info['size'], info['mtime_ns']):
+            return True
+        current = _file_info(info['path'])
+        if current is None:
+            del variants[variant]
+        else:
+            variants[variant] = current
+        self._save()
+        return current is not None
+
+    def variant_path(self, name, preference):
+        info = self.variant(name, preference)
+        return info['path'] if info else None
+
+    def page_count(self, name):
+        """Pages in a report's text variant, or 0 if it isn't in the catalog."""
+        info = self.variant(name, TEXT_VARIANTS)
+        return info['pages'] if info else 0
+
+
+_catalog = None
+
+
+def get_catalog():
+    """This process's catalog, rescanned or reloaded if the reports changed."""
+    global _catalog
+    if _catalog is None:
+        _catalog = Catalog()
+    return _catalog.ensure_current()
+
+
+def main():
+    catalog = Catalog().refresh()
+    for boat, names in catalog.boats.items():
+        print(f"{boat}: {len(names)} reports")
+        for name in names:
+            variants = catalog.reports[name]['variants']
+            summary = ', '.join(f"{variant} {info['pages']}p {info['size'] / (1024 * 1024):.1f}MB"
+                                for variant, info in variants.items())
+            print(f"  {name}: {summary}")
+    print(f"Saved {catalog.path}")
+
+
+if __name__ == '__main__':
+    main()
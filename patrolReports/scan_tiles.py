@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Deep Zoom tile pyramids of the original scan images.
+
+The correction page shows the original scan of each page next to its text.
+Scans are large, so this tiler cuts each one into a Deep Zoom (DZI) pyramid
+of small JPEG tiles: level 0 is one pixel, each level doubles the size, and
+the last level is the full-resolution scan. The viewer fetches only the
+tiles in view at the current zoom.
+
+Tiles are written to search_index/tiles/<report>/<page>_files/<level>/
+<col>_<row>.jpg. tiles/manifest.json records, per report and page, the scan
+image the pyramid came from and its size, so the tile and scan endpoints in
+app.py look files up instead of globbing the scan folders. Pages whose
+scan is unchanged since the last run are skipped.
+
+Run directly to tile every report with a scan folder:
+    python scan_tiles.py
+"""
+
+import os
+import re
+import json
+import math
+import shutil
+
+from search_index import BASE_DIR, INDEX_DIR, REPORTS_DIR, list_report_pdfs
+
+TILES_DIR = os.path.join(INDEX_DIR, 'tiles')
+MANIFEST_PATH = os.path.join(TILES_DIR, 'manifest.json')
+
+# Deep Zoom defaults: 254-pixel tiles plus a pixel of overlap on each inner
+# edge make 256-pixel images
+TILE_SIZE = 254
+OVERLAP = 1
+TILE_FORMAT = 'jpg'
+JPEG_QUALITY = 85
+
+# Scan images are named like page_001.jpg, page_01.png or page_1.tif
+SCAN_PATTERN = re.compile(r'^page_0*(\d+)\.(jpe?g|png|tiff?)$', re.IGNORECASE)
+
+
+def image_folder(pdf_name):
+    """The folder of original scan images for a report, or None."""
+    # Scan folders sit next to patrolReports: USS_Cod_1st_Patrol_Report.pdf
+    # -> ../cod_1st_patrol_report
+    base_name = pdf_name.replace('.pdf', '').replace('USS_Cod_', 'cod_').lower()
+    folder = os.path.join(os.path.dirname(BASE_DIR), base_name)
+    if os.path.exists(folder):
+        return folder
+    return None
+
+
+def scan_images(folder):
+    """{page number: image file name} of the scans in a folder."""
+    images = {}
+    for name in sorted(os.listdir(folder)):
+        m = SCAN_PATTERN.match(name)
+        if m:
+            images.setdefault(int(m.group(1)), name)
+    return images
+
+
+def level_count(width, height):
+    """Levels in a Deep Zoom pyramid, from 1x1 up to full size."""
+    return int(math.ceil(math.log2(max(width, height)))) + 1
+
+
+def level_size(width, height, level, levels):
+    """(width, height) of a pyramid level."""
+    scale = 2 ** (levels - 1 - level)
+    return max(1, math.ceil(width / scale)), max(1, math.ceil(height / scale))
+
+
+def tile_grid(width, height):
+    """(columns, rows) of tiles covering an image of this size."""
+    return math.ceil(width / TILE_SIZE), math.ceil(height / TILE_SIZE)
+
+
+def tile_box(col, row, width, height):
+    """Pixel box (left, top, right, bottom) of a tile, with its overlap."""
+    left = col * TILE_SIZE - (OVERLAP if col else 0)
+    top = row * TILE_SIZE - (OVERLAP if row else 0)
+    right = min((col + 1) * TILE_SIZE + OVERLAP, width)
+    bottom = min((row + 1) * TILE_SIZE + OVERLAP, height)
+    return left, top, right, bottom
+
+
+def tile_image(image_path, out_dir):
+    """
+    Write the pyramid of one scan to out_dir/<level>/<col>_<row>.jpg.
+    Returns the scan's (width, height).
+    """
+    from PIL import Image
+    image = Image.open(image_path)
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    width, height = image.size
+    levels = level_count(width, height)
+    tmp_dir = f"{out_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    level_image = image
+    for level in range(levels - 1, -1, -1):
+        size = level_size(width, height, level, levels)
+        if level_image.size != size:
+            level_image = level_image.resize(size, Image.LANCZOS)
+        level_dir = os.path.join(tmp_dir, str(level))
+        os.makedirs(level_dir)
+        cols, rows = tile_grid(*size)
+        for col in range(cols):
+            for row in range(rows):
+                tile = level_image.crop(tile_box(col, row, *size))
+                tile.save(os.path.join(level_dir, f"{col}_{row}.{TILE_FORMAT}"), 'JPEG',
+                          quality=JPEG_QUALITY)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return width, height
+
+
+def tile_version(entry):
+    """Version of a page's tiles for their URLs: changes whenever its scan is retiled."""
+    return f"{entry['source_mtime_ns']:x}-{entry['source_size']:x}"
+
+
+def dzi_xml(entry):
+    """The .dzi descriptor of a tiled page."""
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+            f'TileSize="{entry["tile_size"]}" Overlap="{entry["overlap"]}" Format="{entry["format"]}">'
+            f'<Size Width="{entry["width"]}" Height="{entry["height"]}"/></Image>\n')
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """{report: {page: entry}} from the manifest, or {} if there is none."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def tile_report(pdf_name, manifest, tiles_dir=TILES_DIR):
+    """Tile a report's new or changed scans into the manifest. Returns pages tiled."""
+    folder = image_folder(pdf_name)
+    if folder is None:
+        return 0
+    report_dir = os.path.join(tiles_dir, pdf_name.replace('.pdf', ''))
+    pages = manifest.setdefault(pdf_name, {})
+    tiled = 0
+    for page_num, name in scan_images(folder).items():
+        image_path = os.path.join(folder, name)
+        st = os.stat(image_path)
+        entry = pages.get(str(page_num))
+        if (entry and entry['source'] == image_path and entry['source_size'] == st.st_size
+                and entry['source_mtime_ns'] == st.st_mtime_ns):
+            continue
+        width, height = tile_image(image_path, os.path.join(report_dir, f"{page_num}_files"))
+        pages[str(page_num)] = {
+            'source': image_path,
+            'source_size': st.st_size,
+            'source_mtime_ns': st.st_mtime_ns,
+            'width': width,
+            'height': height,
+            'levels': level_count(width, height),
+            'tile_size': TILE_SIZE,
+            'overlap': OVERLAP,
+            'format': TILE_FORMAT,
+        }
+        tiled += 1
+    return tiled
+
+
+class TileManifest:
+    """The tile manifest as read by the web app, reloaded when the tiler rewrites it."""
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.reports = {}
+        self._file_id = None
+
+    def ensure_current(self):
+        try:
+            st = os.stat(self.path)
+            file_id = (st.st_ino, st.st_mtime_ns)
+        except OSError:
+            file_id = None
+        if file_id != self._file_id:
+            self.reports = load_manifest(self.path) if file_id else {}
+            self._file_id = file_id
+        return self
+
+    def page(self, pdf_name, page_num):
+        """A page's manifest entry, or None if it hasn't been tiled."""
+        return self.reports.get(pdf_name, {}).get(str(page_num))
+
+    def tile_path(self, pdf_name, page_num, level, col, row):
+        """Path of a tile, or None if the page has no such tile."""
+        entry = self.page(pdf_name, page_num)
+        if entry is None or not 0 <= level < entry['levels']:
+            return None
+        cols, rows = tile_grid(*level_size(entry['width'], entry['height'], level, entry['levels']))
+        if not (0 <= col < cols and 0 <= row < rows):
+            return None
+        return os.path.join(os.path.dirname(self.path), pdf_name.replace('.pdf', ''),
+                            f"{page_num}_files", str(level), f"{col}_{row}.{entry['format']}")
+
+
+_manifest = None
+
+
+def get_manifest():
+    """This process's tile manifest, reloaded if the tiler has run since."""
+    global _manifest
+    if _manifest is None:
+        _manifest = TileManifest()
+    return _manifest.ensure_current()
+
+
+def main():
+    manifest = load_manifest()
+    for pdf_name in list_report_pdfs(REPORTS_DIR):
+        tiled = tile_report(pdf_name, manifest)
+        save_manifest(manifest)
+        print(f"  {pdf_name}: {tiled} pages tiled, {len(manifest.get(pdf_name, {}))} in manifest")
+    print(f"Done! Manifest: {MANIFEST_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Word bounding boxes for search hits.
+
+The Google Vision OCR records where every word sits on the page. At index
+build time those words are lined up with the page text, so a match at
+text[start:end] can be turned into rectangles on the page without the
+viewer having to hunt through the PDF.js text layer.
+
+Boxes come from the *_gv_words.json file written by ocr_patrol_reports.py,
+or failing that from the invisible OCR text layer of the *_gv.pdf. They are
+stored as fractions of the page size (so they fit the downscaled web PDFs
+too), quantized to uint16.
+"""
+
+import os
+import json
+from array import array
+
+# Box coordinates are stored as fractions of the page times this
+BOX_SCALE = 65535
+
+# How far past the previous word to look for the next one; OCR words that
+# were corrected away are skipped rather than dragging the alignment along
+ALIGN_WINDOW = 200
+
+
+def box_source(pdf_file, reports_dir):
+    """Path of the best available word box source for a document, or None."""
+    base_name = pdf_file.replace('.pdf', '')
+    for name in (f"{base_name}_gv_words.json", f"{base_name}_gv.pdf"):
+        path = os.path.join(reports_dir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def load_word_boxes(pdf_file, reports_dir):
+    """
+    Word boxes of a document in reading order, as
+    {page_num: [(text, x0, y0, x1, y1), ...]} with coordinates as fractions
+    of the page. Empty if the document has no box source.
+    """
+    source = box_source(pdf_file, reports_dir)
+    if source is None:
+        return {}
+    pages = {}
+    try:
+        if source.endswith('.json'):
+            with open(source, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for page_num, page in data.items():
+                width = page['width'] or 1
+                height = page['height'] or 1
+                pages[int(page_num)] = [(text, x0 / width, y0 / height, x1 / width, y1 / height)
+                                        for text, x0, y0, x1, y1 in page['words']]
+        else:
+            import fitz  # PyMuPDF
+            doc = fitz.open(source)
+            for page_index in range(len(doc)):
+                page = doc[page_index]
+                width = page.rect.width or 1
+                height = page.rect.height or 1
+                pages[page_index + 1] = [(w[4], w[0] / width, w[1] / height, w[2] / width, w[3] / height)
+                                         for w in page.get_text('words', sort=False)]
+            doc.close()
+    except Exception as e:
+        print(f"Error reading word boxes from {source}: {e}")
+        return {}
+    return pages
+
+
+def _quantize(value):
+    return max(0, min(BOX_SCALE, int(round(value * BOX_SCALE))))
+
+
+def align_words(text, words):
+    """
+    Line OCR words up with the page text. Returns (spans, boxes): uint32
+    (start, end) pairs in text order and the matching uint16 (x0, y0, x1, y1)
+    quads.
+    """
+    spans = array('I')
+    boxes = array('H')
+    cursor = 0
+    for word, x0, y0, x1, y1 in words:
+        word = word.strip()
+        if not word:
+            continue
+        start = text.find(word, cursor, cursor + ALIGN_WINDOW + len(word))
+        if start == -1:
+            continue
+        cursor = start + len(word)
+        spans.extend((start, cursor))
+        boxes.extend((_quantize(x0), _quantize(y0), _quantize(x1), _quantize(y1)))
+    return spans, boxes
+
+
+def merge_boxes(quads):
+    """
+    Join the boxes of consecutive words on the same line into one rectangle.
+    quads are uint16 (x0, y0, x1, y1); returns [[x0, y0, x1, y1], ...] as
+    page fractions.
+    """
+    rects = []
+    for x0, y0, x1, y1 in quads:
+        if rects:
+            last = rects[-1]
+            overlap = min(y1, last[3]) - max(y0, last[1])
+            if overlap * 2 > min(y1 - y0, last[3] - last[1]) and x0 >= last[0]:
+                last[0] = min(last[0], x0)
+                last[1] = min(last[1], y0)
+                last[2] = max(last[2], x1)
+                last[3] = max(last[3], y1)
+                continue
+        rects.append([x0, y0, x1, y1])
+    return [[round(v / BOX_SCALE, 4) for v in rect] for rect in rects]
@@ -0,0 +1,215 @@
+"""
+Search result cache shared by all gunicorn workers.
+
+Entries live in a small SQLite database next to the search index, keyed by
+the normalized request plus the generation of each shard it searched.
+Rebuilding a shard after a correction bumps its generation, so stale entries
+are never served; storing an entry drops those from older generations of
+its shards, and the rest age out under the LRU limit.
+
+Hits are served without taking the write lock: last-used times and hit/miss
+counts are kept in memory and written in one transaction every
+FLUSH_EVERY lookups or FLUSH_SECONDS, or with the next put.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+from search_index import INDEX_DIR
+
+CACHE_PATH = os.path.join(INDEX_DIR, 'search_cache.sqlite')
+
+MAX_ENTRIES = 2000
+MAX_ENTRY_BYTES = 2 * 1024 * 1024  # don't cache giant result sets
+
+# Pending hit bookkeeping is written after this many lookups or seconds
+FLUSH_EVERY = 50
+FLUSH_SECONDS = 10
+
+# Bumped when the tables change; an older cache file is simply emptied
+SCHEMA_VERSION = 2
+
+
+class SearchCache:
+    """Bounded LRU cache of JSON-serializable search results in SQLite."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, max_entry_bytes=MAX_ENTRY_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_entry_bytes = max_entry_bytes
+        self._conn = None
+        self._pid = None
+        self._touched = {}  # key -> last use not yet written
+        self._counts = {'hits': 0, 'misses': 0}
+        self._last_flush = time.time()
+
+    def _connect(self):
+        # Connections must not be shared across a fork, so open one per process
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                conn.execute('DROP TABLE IF EXISTS entries')
+                conn.execute('DROP TABLE IF EXISTS entry_shards')
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_last_used ON entries (last_used)')
+            # The shard generations each entry was computed at
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS entry_shards (
+                    key TEXT NOT NULL,
+                    boat TEXT NOT NULL,
+                    generation INTEGER NOT NULL,
+                    PRIMARY KEY (key, boat)
+                )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_boat_generation '
+                         'ON entry_shards (boat, generation)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )''')
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def make_key(params, generations):
+        raw = json.dumps([generations, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, params, generations):
+        """
+        Return the cached value for params at these shard generations
+        ({boat: generation}), or None.
+        """
+        try:
+            conn = self._connect()
+            key = self.make_key(params, generations)
+            row = conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._counts['misses'] += 1
+            else:
+                self._counts['hits'] += 1
+                self._touched[key] = time.time()
+            if (self._counts['hits'] + self._counts['misses'] >= FLUSH_EVERY
+                    or time.time() - self._last_flush >= FLUSH_SECONDS):
+                self._flush_locked(conn)
+            return json.loads(row[0]) if row else None
+        except sqlite3.Error as e:
+            print(f"Search cache read failed: {e}")
+            return None
+
+    def _flush(self, conn):
+        """Write pending last-used times and counters; the caller holds the write lock."""
+        conn.executemany('UPDATE entries SET last_used = MAX(last_used, ?) WHERE key = ?',
+                         [(used, key) for key, used in self._touched.items()])
+        for name, count in self._counts.items():
+            if count:
+                conn.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                             'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                             (name, count))
+        self._touched = {}
+        self._counts = {'hits': 0, 'misses': 0}
+        self._last_flush = time.time()
+
+    def _flush_locked(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._flush(conn)
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+
+    def put(self, params, generations, value):
+        """
+        Store a value, evicting entries computed at an older generation of
+        any of these shards, then the least recently used.
+        """
+        encoded = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        if len(encoded) > self.max_entry_bytes:
+            return False
+        key = self.make_key(params, generations)
+        try:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._flush(conn)
+                for boat, generation in generations.items():
+                    conn.execute('''
+                        DELETE FROM entries WHERE key IN (
+                            SELECT key FROM entry_shards WHERE boat = ? AND generation < ?
+                        )''', (boat, generation))
+                    conn.execute('DELETE FROM entry_shards WHERE boat = ? AND generation < ?',
+                                 (boat, generation))
+                conn.execute('INSERT OR REPLACE INTO entries (key, value, last_used) '
+                             'VALUES (?, ?, ?)', (key, encoded, time.time()))
+                conn.executemany('INSERT OR REPLACE INTO entry_shards (key, boat, generation) '
+                                 'VALUES (?, ?, ?)',
+                                 [(key, boat, generation) for boat, generation in generations.items()])
+                conn.execute('''
+                    DELETE FROM entries WHERE key IN (
+                        SELECT key FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )''', (self.max_entries,))
+                conn.execute('DELETE FROM entry_shards WHERE key NOT IN (SELECT key FROM entries)')
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+            return True
+        except sqlite3.Error as e:
+            print(f"Search cache write failed: {e}")
+            return False
+
+    def stats(self):
+        """
+        Hit/miss counters and current size. Counters this process has not
+        managed to write yet are included; if the database can't be read at
+        all, they are all there is and entries and bytes are None.
+        """
+        counters = {}
+        entries = size = None
+        try:
+            conn = self._connect()
+            try:
+                self._flush_locked(conn)
+            except sqlite3.Error as e:
+                # Keep them pending; they are added in below and written later
+                print(f"Search cache write failed: {e}")
+            counters = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+            entries, size = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM entries').fetchone()
+        except sqlite3.Error as e:
+            print(f"Search cache read failed: {e}")
+        hits = counters.get('hits', 0) + self._counts['hits']
+        misses = counters.get('misses', 0) + self._counts['misses']
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0,
+            'entries': entries,
+            'bytes': size,
+            'max_entries': self.max_entries,
+        }
+
+
+# One cache handle per worker process
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = SearchCache()
+    return _cache
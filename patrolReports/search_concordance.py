@@ -0,0 +1,130 @@
+"""
+Concordance (keyword in context) over the positional index.
+
+Every occurrence of a word or phrase is found from the posting lists and
+keyed by the words around it, read from the corpus's forward index of term
+ids rather than from the page text. Occurrences are sorted by the words
+that follow (or precede) them, so all the ways the reports go on from
+"depth charge" line up together. Only the lines on the requested page are
+cut out of the text, and cursors pick up by key, so paging through even
+the most frequent words never re-reads pages already shown.
+
+Collocations count the words within a few positions either side of every
+occurrence, with mutual information against their corpus frequency.
+"""
+
+import json
+import math
+import base64
+
+from search_index import TOKEN_PATTERN, tokenize
+
+SORTS = ('right', 'left', 'order')
+
+# Words of context that make up a sort key
+KEY_WORDS = 3
+
+# Words of context shown either side of a match
+DEFAULT_WIDTH = 8
+MAX_WIDTH = 30
+
+# Positions either side counted for collocations
+DEFAULT_WINDOW = 3
+MAX_WINDOW = 10
+
+# Collocates reported per side
+COLLOCATES = 20
+
+# Collocates seen fewer times than this aren't ranked; mutual information
+# flatters rare words
+MIN_COLLOCATE_COUNT = 3
+
+
+class ConcordanceError(ValueError):
+    """Raised for concordance requests that can't be run."""
+
+
+def term_groups(index, query):
+    """
+    Index terms for each word of query, one list per position. A word
+    ending in * matches every term starting with it.
+    """
+    groups = []
+    for word in query.split():
+        if word.endswith('*'):
+            tokens = tokenize(word[:-1])
+            if len(tokens) != 1:
+                raise ConcordanceError(f"Invalid wildcard: {word!r}")
+            groups.append(index._terms_with_prefix(tokens[0]))
+        else:
+            groups.extend([token] for token in tokenize(word))
+    if not groups:
+        raise ConcordanceError("Nothing to look up")
+    return groups
+
+
+def occurrence_key(vocab, terms, start, length, sort, pdf_file, page_num):
+    """
+    Sort key of an occurrence: up to KEY_WORDS words after it (or before
+    it, nearest first), then its place in the reports. Vocabulary ids are
+    in word order, so the key sorts like the words themselves.
+    """
+    if sort == 'right':
+        words = [vocab[terms[i]] if i < len(terms) else ''
+                 for i in range(start + length, start + length + KEY_WORDS)]
+    elif sort == 'left':
+        words = [vocab[terms[i]] if i >= 0 else '' for i in range(start - 1, start - 1 - KEY_WORDS, -1)]
+    else:
+        words = []
+    return tuple(words) + (pdf_file, page_num, start)
+
+
+def encode_key(key):
+    """An occurrence key as an opaque cursor string."""
+    raw = json.dumps(list(key), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_key(cursor, sort):
+    """Decode a cursor from encode_key for this sort. Raises ConcordanceError."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ConcordanceError("Invalid cursor")
+    words = 0 if sort == 'order' else KEY_WORDS
+    types = [str] * (words + 1) + [int, int]
+    if (not isinstance(key, list) or len(key) != len(types)
+            or not all(isinstance(value, t) for value, t in zip(key, types))):
+        raise ConcordanceError("Invalid cursor")
+    return tuple(key)
+
+
+def context_line(text, start, length, width):
+    """
+    (left, match, right) for the words text[start:start + length], with
+    width words either side, cut from the raw page text.
+    """
+    words = [(m.start(), m.end()) for m in TOKEN_PATTERN.finditer(text)]
+    first = words[start][0]
+    last = words[start + length - 1][1]
+    left_start = words[max(0, start - width)][0]
+    right_end = words[min(len(words) - 1, start + length - 1 + width)][1]
+    return (' '.join(text[left_start:first].split()),
+            ' '.join(text[first:last].split()),
+            ' '.join(text[last:right_end].split()))
+
+
+def rank_collocates(counts, occurrences, frequency, token_count, window, limit=COLLOCATES):
+    """
+    [{'term', 'count', 'mi'}] for the most frequent collocates on one side,
+    mi being log2 of how much more often the word turns up near the phrase
+    than chance would put it there. frequency(term) is the term's count in
+    the whole corpus.
+    """
+    ranked = []
+    for term, n in sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]:
+        expected = occurrences * window * frequency(term) / token_count if token_count else 0
+        mi = round(math.log2(n / expected), 2) if expected and n >= MIN_COLLOCATE_COUNT else None
+        ranked.append({'term': term, 'count': n, 'mi': mi})
+    return ranked
@@ -0,0 +1,268 @@
+"""
+Compact binary corpus of page texts, memory-mapped read-only by every worker
+so the text lives once in the OS page cache instead of once per process.
+
+File layout (little-endian):
+    header      magic, format version, page count and section offsets
+    meta        UTF-8 JSON: generation, build id, source signatures,
+                documents, pages
+    offsets     (page count + 1) uint64 byte offsets into the text buffer
+    text        all page texts, UTF-8, back to back
+    norm        normalized page texts (see search_text.py), laid out like
+                offsets + text
+    anchors     (page count + 1) uint64 offsets into the anchor pairs, then
+                uint32 (normalized offset, raw offset) pairs for every page
+    words       (page count + 1) uint64 word offsets, then uint32 (start, end)
+                raw text spans of the OCR words and their uint16
+                (x0, y0, x1, y1) page boxes, see search_boxes.py
+    terms       (page count + 1) uint64 offsets, then every page's terms as
+                uint32 ids into the sorted index vocabulary (a forward
+                index, see search_concordance.py)
+"""
+
+import os
+import json
+import mmap
+import bisect
+import struct
+from array import array
+
+from search_boxes import merge_boxes
+from search_text import NormalizedText, normalize_text
+
+MAGIC = b'CODCORP\x00'
+FORMAT_VERSION = 5
+
+# magic, format version, page count, meta offset, meta length, offsets offset,
+# text offset, normalized offsets offset, normalized text offset, anchor
+# table offset, anchor pairs offset, word table offset, word spans offset,
+# word boxes offset, term table offset, term ids offset
+HEADER = struct.Struct('<8sIIQQQQQQQQQQQQQ')
+
+
+def _align(n, alignment=8):
+    return (n + alignment - 1) // alignment * alignment
+
+
+def write_corpus(path, generation, build_id, sources, documents, pages, texts, word_boxes=None,
+                 term_ids=None):
+    """
+    Write page texts to a corpus file atomically.
+    build_id is a random token also written to the index built alongside,
+    so a corpus and index from different builds are never loaded together.
+    pages is a list of [doc_id, page_num] parallel to texts, as are
+    word_boxes: (spans, boxes) arrays from search_boxes.align_words, or None
+    for a page without boxes, and term_ids: uint32 arrays of each page's
+    term ids in order.
+    """
+    meta = json.dumps({
+        'generation': generation,
+        'build_id': build_id,
+        'sources': sources,
+        'documents': documents,
+        'pages': pages,
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    normalized = []
+    anchors = array('I')
+    anchor_offsets = array('Q', [0])
+    for text in texts:
+        norm_text, norm_starts, raw_starts = normalize_text(text)
+        normalized.append(norm_text)
+        for pair in zip(norm_starts, raw_starts):
+            anchors.extend(pair)
+        anchor_offsets.append(len(anchors))
+    if anchor_offsets.itemsize != 8 or anchors.itemsize != 4:
+        raise RuntimeError("uint64/uint32 array types unavailable on this platform")
+
+    word_offsets = array('Q', [0])
+    word_spans = array('I')
+    word_quads = array('H')
+    for page_boxes in word_boxes or [None] * len(texts):
+        if page_boxes is not None:
+            word_spans.extend(page_boxes[0])
+            word_quads.extend(page_boxes[1])
+        word_offsets.append(len(word_spans) // 2)
+
+    term_offsets = array('Q', [0])
+    for page_terms in term_ids or [()] * len(texts):
+        term_offsets.append(term_offsets[-1] + len(page_terms))
+
+    encoded, offsets = _encode(texts)
+    norm_encoded, norm_offsets = _encode(normalized)
+
+    meta_offset = HEADER.size
+    table_offset = _align(meta_offset + len(meta))
+    text_offset = table_offset + len(offsets) * 8
+    norm_table_offset = _align(text_offset + offsets[-1])
+    norm_text_offset = norm_table_offset + len(norm_offsets) * 8
+    anchor_table_offset = _align(norm_text_offset + norm_offsets[-1])
+    anchors_offset = anchor_table_offset + len(anchor_offsets) * 8
+    word_table_offset = _align(anchors_offset + len(anchors) * 4)
+    word_spans_offset = word_table_offset + len(word_offsets) * 8
+    word_boxes_offset = word_spans_offset + len(word_spans) * 4
+    term_table_offset = _align(word_boxes_offset + len(word_quads) * 2)
+    term_ids_offset = term_table_offset + len(term_offsets) * 8
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(texts),
+                            meta_offset, len(meta), table_offset, text_offset,
+                            norm_table_offset, norm_text_offset,
+                            anchor_table_offset, anchors_offset,
+                            word_table_offset, word_spans_offset, word_boxes_offset,
+                            term_table_offset, term_ids_offset))
+        f.write(meta)
+        _pad(f, table_offset)
+        offsets.tofile(f)
+        for chunk in encoded:
+            f.write(chunk)
+        _pad(f, norm_table_offset)
+        norm_offsets.tofile(f)
+        for chunk in norm_encoded:
+            f.write(chunk)
+        _pad(f, anchor_table_offset)
+        anchor_offsets.tofile(f)
+        anchors.tofile(f)
+        _pad(f, word_table_offset)
+        word_offsets.tofile(f)
+        word_spans.tofile(f)
+        word_quads.tofile(f)
+        _pad(f, term_table_offset)
+        term_offsets.tofile(f)
+        for page_terms in term_ids or ():
+            page_terms.tofile(f)
+    os.replace(tmp_path, path)
+
+
+def _encode(texts):
+    """UTF-8 encode texts, returning (chunks, uint64 offsets)."""
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = array('Q', [0])
+    for chunk in encoded:
+        offsets.append(offsets[-1] + len(chunk))
+    if offsets.itemsize != 8:
+        raise RuntimeError("uint64 array type unavailable on this platform")
+    return encoded, offsets
+
+
+def _pad(f, offset):
+    f.write(b'\x00' * (offset - f.tell()))
+
+
+def read_generation(path):
+    """Return the generation number of an existing corpus file, or 0."""
+    try:
+        corpus = Corpus(path)
+    except (OSError, ValueError):
+        return 0
+    generation = corpus.generation
+    corpus.close()
+    return generation
+
+
+class Corpus:
+    """Read-only, memory-mapped view of a corpus file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            st = os.fstat(f.fileno())
+        # Identifies this file on disk, so a replaced corpus can be noticed
+        self.file_id = (st.st_ino, st.st_mtime_ns)
+        try:
+            (magic, version, page_count, meta_offset, meta_length,
+             table_offset, text_offset, norm_table_offset, norm_text_offset,
+             anchor_table_offset, anchors_offset, word_table_offset,
+             word_spans_offset, word_boxes_offset, term_table_offset,
+             term_ids_offset) = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{path} is not a version {FORMAT_VERSION} corpus file")
+            meta = json.loads(self._mm[meta_offset:meta_offset + meta_length].decode('utf-8'))
+        except (struct.error, ValueError):
+            self._mm.close()
+            raise
+
+        self.generation = meta['generation']
+        self.build_id = meta['build_id']
+        self.sources = meta['sources']
+        self.documents = meta['documents']
+        self.pages = [tuple(p) for p in meta['pages']]
+        self.page_count = page_count
+        self._text_offset = text_offset
+        self._offsets = array('Q')
+        self._offsets.frombytes(self._mm[table_offset:text_offset])
+        self._norm_text_offset = norm_text_offset
+        self._norm_offsets = array('Q')
+        self._norm_offsets.frombytes(self._mm[norm_table_offset:norm_text_offset])
+        self._anchors_offset = anchors_offset
+        self._anchor_offsets = array('Q')
+        self._anchor_offsets.frombytes(self._mm[anchor_table_offset:anchors_offset])
+        self._word_spans_offset = word_spans_offset
+        self._word_boxes_offset = word_boxes_offset
+        self._word_offsets = array('Q')
+        self._word_offsets.frombytes(self._mm[word_table_offset:word_spans_offset])
+        self._term_ids_offset = term_ids_offset
+        self._term_offsets = array('Q')
+        self._term_offsets.frombytes(self._mm[term_table_offset:term_ids_offset])
+
+    def __len__(self):
+        return self.page_count
+
+    @property
+    def text_bytes(self):
+        return self._offsets[-1]
+
+    def page_bytes(self, page_id):
+        """Size of one page's raw text in bytes."""
+        return self._offsets[page_id + 1] - self._offsets[page_id]
+
+    def page_text(self, page_id):
+        """Decode the text of one page straight from the mapping."""
+        start = self._text_offset + self._offsets[page_id]
+        end = self._text_offset + self._offsets[page_id + 1]
+        return self._mm[start:end].decode('utf-8')
+
+    def normalized_text(self, page_id):
+        """The normalized text of one page with its offset map, see search_text."""
+        start = self._norm_text_offset + self._norm_offsets[page_id]
+        end = self._norm_text_offset + self._norm_offsets[page_id + 1]
+        text = self._mm[start:end].decode('utf-8')
+        pairs = array('I')
+        pairs.frombytes(self._mm[self._anchors_offset + 4 * self._anchor_offsets[page_id]:
+                                 self._anchors_offset + 4 * self._anchor_offsets[page_id + 1]])
+        return NormalizedText(text, pairs[0::2], pairs[1::2])
+
+    def word_boxes(self, page_id, start, end):
+        """
+        Page rectangles, as fractions of the page, covering the OCR words that
+        overlap raw text[start:end], one per line. Empty if the page has no
+        word boxes.
+        """
+        first = self._word_offsets[page_id]
+        last = self._word_offsets[page_id + 1]
+        if first == last or end <= start:
+            return []
+        spans = array('I')
+        spans.frombytes(self._mm[self._word_spans_offset + 8 * first:
+                                 self._word_spans_offset + 8 * last])
+        # Word spans are in text order and don't overlap, so ends are sorted too
+        i = bisect.bisect_right(spans[1::2], start)
+        j = bisect.bisect_left(spans[0::2], end)
+        if i >= j:
+            return []
+        quads = array('H')
+        quads.frombytes(self._mm[self._word_boxes_offset + 8 * (first + i):
+                                 self._word_boxes_offset + 8 * (first + j)])
+        return merge_boxes(zip(quads[0::4], quads[1::4], quads[2::4], quads[3::4]))
+
+    def page_terms(self, page_id):
+        """A page's term ids in text order, as a uint32 array."""
+        terms = array('I')
+        terms.frombytes(self._mm[self._term_ids_offset + 4 * self._term_offsets[page_id]:
+                                 self._term_ids_offset + 4 * self._term_offsets[page_id + 1]])
+        return terms
+
+    def close(self):
+        self._mm.close()
@@ -0,0 +1,302 @@
+"""
+Entity mentions in the report text: positions, dates and log times, and ship
+and aircraft types.
+
+Mentions are parsed out of every page once, when the search index is built,
+and kept with it, so questions like "pages with a position within 50 miles
+of 12-34 N, 118-22 E" or "pages mentioning 3 to 5 August 1944" are index
+lookups instead of text scans. Positions are normalized to signed decimal
+degrees, dates to YYYY-MM-DD and log times, which take the date of the last
+date heading above them, to YYYY-MM-DDTHH:MM. Ship and aircraft types are the
+glossary's hull classifications and aircraft names.
+
+Entity searches (mode=entity) combine filters, all of which a page must meet:
+
+    near:12-34N,118-22E     a position within some distance of this point
+    within:50               that distance in nautical miles (default 50)
+    date:1944-08-03..1944-08-05   a date or log time in this range
+                            (also date:1944-08 or date:1944)
+    type:AK type:Betty      any of these ship or aircraft types
+"""
+
+import re
+import math
+import bisect
+import datetime
+
+from search_index import GLOSSARY_PATH, parse_date_range
+
+# Default radius for near: searches, in nautical miles
+DEFAULT_RADIUS_NM = 50
+
+EARTH_RADIUS_NM = 3440.065
+
+# Glossary acronyms that are ship types. SS is left out: in the reports it
+# is nearly always the boat's own hull number.
+SHIP_TYPES = ('AF', 'AK', 'AO', 'AP', 'BB', 'CA', 'CL', 'CM', 'CV', 'DD', 'DE',
+              'MIS', 'PC', 'SMC')
+
+MONTHS = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6,
+    'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12,
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'jun': 6, 'jul': 7, 'aug': 8,
+    'sep': 9, 'sept': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+_MONTH_NAMES = '|'.join(sorted(MONTHS, key=len, reverse=True))
+
+# 12-34 N, 118-22 E / Lat. 05-29.5 S.; Long. 118-42 E. / 12°34'N 118°22'E
+POSITION_PATTERN = re.compile(
+    r"(?<![\d.])(\d{1,2})\s*[-°º]\s*(\d{1,2}(?:\.\d+)?)\s*'?\s*([NS])\b\.?[\s,;.]*"
+    r"(?:Long(?:itude)?\.?\s*)?(\d{1,3})\s*[-°º]\s*(\d{1,2}(?:\.\d+)?)\s*'?\s*([EW])\b")
+
+# 26 July 1944 / 26 July (year from the dates before it) / July 26, 1944
+DATE_PATTERN = re.compile(
+    rf"\b(?:(\d{{1,2}})\s+({_MONTH_NAMES})\.?(?:,?\s+(19[34]\d))?"
+    rf"|({_MONTH_NAMES})\.?\s+(\d{{1,2}}),?\s+(19[34]\d))\b",
+    re.IGNORECASE)
+
+# Narrative entries start with a four-digit time: "0823 Sighted smoke..."
+TIME_PATTERN = re.compile(r'^[ \t]*([01]\d|2[0-3])([0-5]\d)\b', re.MULTILINE)
+
+FILTER_PATTERN = re.compile(r'^(near|within|date|type):(.+)$', re.IGNORECASE)
+
+# Query points: 12-34N,118-22E / 12-34.5 N, 118-22 E / 12.57,-118.37 / 12.57N,118.37E
+_DEGREES = r"(\d{1,3})(?:\s*[-°º]\s*(\d{1,2}(?:\.\d+)?)'?|(\.\d+))?"
+POINT_PATTERN = re.compile(
+    rf"^\s*(-?){_DEGREES}\s*([NS])?\s*,\s*(-?){_DEGREES}\s*([EW])?\s*$", re.IGNORECASE)
+
+RADIUS_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*(?:nm|mi)?$', re.IGNORECASE)
+
+
+class EntityQueryError(ValueError):
+    """Raised for entity searches that can't be parsed."""
+
+
+_type_patterns = None
+
+
+def type_patterns(glossary_path=GLOSSARY_PATH):
+    """
+    [(kind, compiled pattern, {spelling: name})] for ship and aircraft types
+    from the glossary, compiled once per process. Ship classifications match
+    in capitals only; aircraft names as written or in capitals.
+    """
+    global _type_patterns
+    if _type_patterns is None:
+        import json
+        try:
+            with open(glossary_path, 'r', encoding='utf-8') as f:
+                glossary = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Glossary unavailable, indexing without ship and aircraft types: {e}")
+            glossary = {}
+        spellings = {
+            'ship': {name: name for name in glossary.get('acronyms', {}) if name in SHIP_TYPES},
+            'aircraft': {},
+        }
+        for name in glossary.get('aircraft', {}):
+            spellings['aircraft'][name] = name
+            spellings['aircraft'][name.upper()] = name
+        _type_patterns = []
+        for kind, names in spellings.items():
+            if names:
+                alternatives = '|'.join(re.escape(s) for s in sorted(names, key=len, reverse=True))
+                _type_patterns.append((kind, re.compile(rf'(?<![\w-])(?:{alternatives})(?![\w-])'), names))
+    return _type_patterns
+
+
+def _degrees(degrees, minutes, hemisphere):
+    value = int(degrees) + float(minutes) / 60
+    return -value if hemisphere.upper() in 'SW' else value
+
+
+def _year_for(month, context):
+    """Year of a date written without one, from the last full date seen."""
+    if context is None:
+        return None
+    # A bare "2 January" after "30 December 1943" is in the new year
+    if month < context.month - 6:
+        return context.year + 1
+    if month > context.month + 6:
+        return context.year - 1
+    return context.year
+
+
+def extract_entities(text, state):
+    """
+    Entity mentions on one page as [kind, value, start, end] in text order.
+    state carries the last date seen from page to page of a report, so
+    times and dates without a year can be placed.
+    """
+    found = []
+    for match in POSITION_PATTERN.finditer(text):
+        lat_deg, lat_min, lat_hemi, lon_deg, lon_min, lon_hemi = match.groups()
+        if int(lat_deg) > 90 or int(lon_deg) > 180 or float(lat_min) >= 60 or float(lon_min) >= 60:
+            continue
+        found.append(['position', [round(_degrees(lat_deg, lat_min, lat_hemi), 4),
+                                   round(_degrees(lon_deg, lon_min, lon_hemi), 4)],
+                      match.start(), match.end()])
+    for kind, pattern, names in type_patterns():
+        for match in pattern.finditer(text):
+            found.append([kind, names[match.group(0)], match.start(), match.end()])
+
+    # Dates and times are read in order, since a time belongs to the date above it
+    events = [(m.start(), 'date', m) for m in DATE_PATTERN.finditer(text)]
+    events += [(m.start(), 'time', m) for m in TIME_PATTERN.finditer(text)]
+    for _, kind, match in sorted(events, key=lambda event: event[0]):
+        if kind == 'time':
+            if state.get('date') is not None:
+                found.append(['time', f"{state['date'].isoformat()}T{match.group(1)}:{match.group(2)}",
+                              match.start(1), match.end(2)])
+            continue
+        day, month, year, month2, day2, year2 = match.groups()
+        month = MONTHS[(month or month2).lower()]
+        day = int(day or day2)
+        year = year or year2
+        year = int(year) if year else _year_for(month, state.get('date'))
+        if year is None:
+            continue
+        try:
+            date = datetime.date(year, month, day)
+        except ValueError:
+            continue
+        state['date'] = date
+        found.append(['date', date.isoformat(), match.start(), match.end()])
+    found.sort(key=lambda entity: entity[2])
+    return found
+
+
+def parse_point(value):
+    """(lat, lon) in signed degrees from a near: value. Raises EntityQueryError."""
+    m = POINT_PATTERN.match(value)
+    if not m:
+        raise EntityQueryError(f"Invalid position: {value!r} (use e.g. 12-34N,118-22E or 12.57,118.37)")
+    lat_sign, lat_deg, lat_min, lat_frac, lat_hemi, lon_sign, lon_deg, lon_min, lon_frac, lon_hemi = m.groups()
+    lat = int(lat_deg) + (float(lat_min) / 60 if lat_min else float(lat_frac or 0))
+    lon = int(lon_deg) + (float(lon_min) / 60 if lon_min else float(lon_frac or 0))
+    if lat_sign or (lat_hemi or '').upper() == 'S':
+        lat = -lat
+    if lon_sign or (lon_hemi or '').upper() == 'W':
+        lon = -lon
+    if abs(lat) > 90 or abs(lon) > 180:
+        raise EntityQueryError(f"Position out of range: {value!r}")
+    return lat, lon
+
+
+def parse_entity_query(query):
+    """
+    Parse an entity search into {'near': (lat, lon) or None, 'radius_nm',
+    'date_range': (lo, hi) or None, 'types': [names]}. Raises
+    EntityQueryError for unknown or malformed filters.
+    """
+    parsed = {'near': None, 'radius_nm': DEFAULT_RADIUS_NM, 'date_range': None, 'types': []}
+    # Positions may be written with spaces ("12-34 N, 118-22 E"), so split on
+    # the filter names rather than on whitespace
+    parts = re.split(r'\s+(?=(?:near|within|date|type):)', query.strip(), flags=re.IGNORECASE)
+    for part in parts:
+        if not part:
+            continue
+        m = FILTER_PATTERN.match(part.strip())
+        if not m:
+            raise EntityQueryError(f"Unknown filter: {part!r} (use near:, within:, date: or type:)")
+        name, value = m.group(1).lower(), m.group(2).strip()
+        if name == 'near':
+            parsed['near'] = parse_point(value)
+        elif name == 'within':
+            r = RADIUS_PATTERN.match(value)
+            if not r:
+                raise EntityQueryError(f"Invalid distance: {value!r} (nautical miles)")
+            parsed['radius_nm'] = float(r.group(1))
+        elif name == 'date':
+            lo, _, hi = value.partition('..')
+            try:
+                parsed['date_range'] = parse_date_range(lo, hi if hi else lo)
+            except ValueError as e:
+                raise EntityQueryError(str(e))
+        else:
+            parsed['types'].append(value)
+    if parsed['near'] is None and parsed['date_range'] is None and not parsed['types']:
+        raise EntityQueryError("Entity searches need a near:, date: or type: filter")
+    return parsed
+
+
+def distance_nm(lat1, lon1, lat2, lon2):
+    """Great-circle distance in nautical miles."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_NM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class EntityIndex:
+    """
+    Lookup tables over the mentions of every page: positions sorted by
+    latitude, dates and times sorted by value, and types by name.
+    """
+
+    def __init__(self, page_entities):
+        positions = []
+        dates = []
+        self.types = {}  # lowercased name -> [(page_id, start, end)]
+        for page_id, entities in enumerate(page_entities):
+            for kind, value, start, end in entities:
+                if kind == 'position':
+                    positions.append((value[0], value[1], page_id, start, end))
+                elif kind in ('date', 'time'):
+                    dates.append((value, page_id, start, end))
+                else:
+                    self.types.setdefault(value.lower(), []).append((page_id, start, end))
+        positions.sort()
+        dates.sort()
+        self.positions = positions
+        self.position_lats = [p[0] for p in positions]
+        self.dates = dates
+        self.date_values = [d[0] for d in dates]
+
+    def near(self, lat, lon, radius_nm):
+        """(page_id, start, end) of positions within radius_nm of (lat, lon)."""
+        # A degree of latitude is 60 miles, so only a band of rows can qualify
+        band = radius_nm / 60
+        first = bisect.bisect_left(self.position_lats, lat - band)
+        last = bisect.bisect_right(self.position_lats, lat + band)
+        return [(page_id, start, end) for p_lat, p_lon, page_id, start, end in self.positions[first:last]
+                if distance_nm(lat, lon, p_lat, p_lon) <= radius_nm]
+
+    def in_dates(self, date_range):
+        """(page_id, start, end) of dates and times within a (lo, hi) date range."""
+        lo, hi = date_range
+        first = bisect.bisect_left(self.date_values, lo) if lo else 0
+        # Times sort after their date, and hi is a YYYY-MM-DD bound
+        last = bisect.bisect_right(self.date_values, hi + '\uffff') if hi else len(self.dates)
+        return [(page_id, start, end) for _, page_id, start, end in self.dates[first:last]]
+
+    def of_types(self, names):
+        mentions = []
+        for name in names:
+            mentions.extend(self.types.get(name.lower(), ()))
+        return mentions
+
+    def match(self, parsed):
+        """
+        {page_id: [(start, end), ...]} of pages meeting every filter of a
+        parsed entity query, with the mentions that met them in text order.
+        """
+        groups = []
+        if parsed['near'] is not None:
+            groups.append(self.near(*parsed['near'], parsed['radius_nm']))
+        if parsed['date_range'] is not None:
+            groups.append(self.in_dates(parsed['date_range']))
+        if parsed['types']:
+            groups.append(self.of_types(parsed['types']))
+        pages = None
+        for mentions in groups:
+            found = {page_id for page_id, _, _ in mentions}
+            pages = found if pages is None else pages & found
+        spans = {page_id: set() for page_id in pages or ()}
+        for mentions in groups:
+            for page_id, start, end in mentions:
+                if page_id in spans:
+                    spans[page_id].add((start, end))
+        return {page_id: sorted(found) for page_id, found in spans.items()}
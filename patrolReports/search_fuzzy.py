@@ -0,0 +1,135 @@
+"""
+Trigram index over the search vocabulary, for OCR-tolerant matching.
+Finds terms within a small edit distance of a query term ("C0d" -> "cod")
+without comparing against every term in the corpus.
+"""
+
+# Pad terms so short words and word edges still produce trigrams
+PAD = '$'
+
+# Remembered similar() lookups per index
+SIMILAR_CACHE_SIZE = 1024
+
+
+def trigrams(term, padded=True):
+    """Return the set of trigrams in a term."""
+    if padded:
+        term = f"{PAD}{term}{PAD}"
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+def default_max_distance(term):
+    """Edit distance allowed for a query term: none for tiny words, more for long ones."""
+    if len(term) <= 2:
+        return 0
+    if len(term) <= 6:
+        return 1
+    return 2
+
+
+def bounded_distance(a, b, max_distance):
+    """
+    Levenshtein distance between a and b, giving up early once it must exceed
+    max_distance. Returns max_distance + 1 in that case.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1,
+                       current[j - 1] + 1,
+                       previous[j - 1] + (ca != cb))
+            current.append(cost)
+            if cost < row_min:
+                row_min = cost
+        if row_min > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+class TrigramIndex:
+    """Maps trigrams to the vocabulary terms that contain them."""
+
+    def __init__(self, terms, frequencies):
+        self.terms = list(terms)
+        self.frequencies = list(frequencies)
+        self.ids = {term: term_id for term_id, term in enumerate(self.terms)}
+        self.grams = {}
+        self._similar_cache = {}
+        for term_id, term in enumerate(self.terms):
+            for gram in trigrams(term):
+                self.grams.setdefault(gram, []).append(term_id)
+
+    def containing(self, fragment):
+        """All terms containing fragment as a substring."""
+        if len(fragment) < 3:
+            return [term for term in self.terms if fragment in term]
+        candidates = None
+        for gram in sorted(trigrams(fragment, padded=False),
+                           key=lambda g: len(self.grams.get(g, ()))):
+            ids = self.grams.get(gram)
+            if not ids:
+                return []
+            candidates = set(ids) if candidates is None else candidates.intersection(ids)
+            if not candidates:
+                return []
+        return [self.terms[term_id] for term_id in sorted(candidates)
+                if fragment in self.terms[term_id]]
+
+    def similar(self, term, max_distance=None):
+        """Return [(term, distance)] for vocabulary terms within max_distance edits."""
+        if max_distance is None:
+            max_distance = default_max_distance(term)
+        if max_distance == 0:
+            return [(term, 0)] if term in self.ids else []
+        cache_key = (term, max_distance)
+        if cache_key in self._similar_cache:
+            return self._similar_cache[cache_key]
+
+        # One edit changes at most three trigrams, so a close term must share
+        # the rest; when that bound is useless, fall back to a length filter
+        query_grams = trigrams(term)
+        min_shared = len(query_grams) - 3 * max_distance
+        if min_shared > 0:
+            shared = {}
+            for gram in query_grams:
+                for term_id in self.grams.get(gram, ()):
+                    shared[term_id] = shared.get(term_id, 0) + 1
+            candidates = [term_id for term_id, n in shared.items() if n >= min_shared]
+        else:
+            candidates = [term_id for term_id, t in enumerate(self.terms)
+                          if abs(len(t) - len(term)) <= max_distance]
+
+        matches = []
+        for term_id in candidates:
+            candidate = self.terms[term_id]
+            if abs(len(candidate) - len(term)) > max_distance:
+                continue
+            distance = bounded_distance(term, candidate, max_distance)
+            if distance <= max_distance:
+                matches.append((candidate, distance))
+        matches.sort(key=lambda m: (m[1], m[0]))
+
+        # Fuzzy lookups repeat within a request (matching, ranking, suggestions)
+        if len(self._similar_cache) >= SIMILAR_CACHE_SIZE:
+            self._similar_cache.clear()
+        self._similar_cache[cache_key] = matches
+        return matches
+
+    def suggest(self, term, max_distance=None):
+        """Most frequent closest vocabulary term to a term that isn't in the vocabulary."""
+        if term in self.ids:
+            return term
+        if max_distance is None:
+            max_distance = max(1, default_max_distance(term))
+        best = None
+        best_key = None
+        for candidate, distance in self.similar(term, max_distance):
+            key = (distance, -self.frequencies[self.ids[candidate]])
+            if best_key is None or key < best_key:
+                best, best_key = candidate, key
+        return best
@@ -0,0 +1,1198 @@
+#!/usr/bin/env python3
+"""
+Positional inverted index over the patrol report OCR text.
+Built from the Google Vision *_gv_ocr.json files plus the corrections/ overlay,
+persisted under search_index/ and loaded once per worker. Page texts live in
+a memory-mapped corpus file (see search_corpus.py) shared by all workers.
+
+Pages also carry the narrative dates from the narrative_page_index table, so
+searches can be restricted to a date range and broken down by month.
+Hits carry the page rectangles of the matched words (see search_boxes.py)
+so the viewer can highlight them directly. Positions, dates, times and ship
+and aircraft types mentioned on each page are indexed too (see
+search_entities.py), and the Cod shard carries the contact and attack
+records from the database (see search_records.py).
+
+Run directly to (re)build the index:
+    python search_index.py
+"""
+
+import os
+import re
+import json
+import base64
+import bisect
+import heapq
+import math
+import fcntl
+import itertools
+from array import array
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import search_trace
+from search_boxes import align_words, box_source, load_word_boxes
+from search_corpus import Corpus, read_generation, write_corpus
+from search_fuzzy import TrigramIndex
+from search_suggest import Completer, build_entries, precompute_top
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORTS_DIR = os.path.join(BASE_DIR, "static", "reports")
+CORRECTIONS_DIR = os.path.join(BASE_DIR, 'corrections')
+INDEX_DIR = os.path.join(BASE_DIR, 'search_index')
+GLOSSARY_PATH = os.path.join(BASE_DIR, 'static', 'glossary.json')
+
+INDEX_FILENAME = 'index.json'
+CORPUS_FILENAME = 'corpus.bin'
+BUILD_LOCK_FILENAME = 'build.lock'
+INDEX_VERSION = 8
+
+# BM25 ranking parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Terms are runs of word characters, lowercased
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Date filter bounds: YYYY, YYYY-MM or YYYY-MM-DD
+DATE_BOUND_PATTERN = re.compile(r'^\d{4}(-\d{2}(-\d{2})?)?$')
+
+
+@contextmanager
+def build_lock(index_dir):
+    """
+    Hold an exclusive lock on an index directory, so only one process at a
+    time builds and writes its corpus and index.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, BUILD_LOCK_FILENAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def list_report_pdfs(reports_dir=REPORTS_DIR):
+    """Get list of main PDF files (not OCR variants)."""
+    return sorted([f for f in os.listdir(reports_dir)
+                   if f.endswith('.pdf')
+                   and not f.endswith('_v3.pdf')
+                   and not f.endswith('_improved.pdf')
+                   and not f.endswith('_gv.pdf')
+                   and not f.endswith('_corrected.pdf')
+                   and 'test_' not in f])
+
+
+def tokenize(text):
+    """Return the lowercased terms of a text, in order."""
+    return [t.lower() for t in TOKEN_PATTERN.findall(text)]
+
+
+def patrol_number(pdf_file):
+    """Patrol number from a report filename like USS_Cod_5th_Patrol_Report.pdf, or None."""
+    m = re.search(r'(\d+)(?:st|nd|rd|th)_Patrol', pdf_file)
+    return int(m.group(1)) if m else None
+
+
+def parse_date_range(date_from=None, date_to=None):
+    """
+    Turn optional date filter bounds into a (lo, hi) pair of comparable
+    YYYY-MM-DD strings, or None for no filter. A partial bound covers the
+    whole month or year ("1944-07" to "1944-07" is all of July 1944).
+    Raises ValueError for malformed bounds.
+    """
+    bounds = []
+    for value, pad in ((date_from, '-00'), (date_to, '-99')):
+        value = (value or '').strip()
+        if not value:
+            bounds.append(None)
+            continue
+        if not DATE_BOUND_PATTERN.match(value):
+            raise ValueError(f"Invalid date: {value!r} (use YYYY, YYYY-MM or YYYY-MM-DD)")
+        while len(value) < 10:
+            value += pad
+        bounds.append(value)
+    if bounds == [None, None]:
+        return None
+    return tuple(bounds)
+
+
+def load_narrative_dates():
+    """
+    Narrative dates from the narrative_page_index table as
+    {patrol: {page: [dates]}}, with dates as YYYY-MM-DD strings. Returns an
+    empty dict if the database can't be reached, so the index still builds
+    without dates.
+    """
+    try:
+        from db_config import get_db_connection
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT patrol, page, observation_date
+            FROM narrative_page_index
+            WHERE observation_date IS NOT NULL
+        """)
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        print(f"Narrative page index unavailable, building without dates: {e}")
+        return {}
+
+    narrative = {}
+    for patrol, page, obs_date in rows:
+        narrative.setdefault(patrol, {}).setdefault(page, []).append(str(obs_date)[:10])
+    return narrative
+
+
+def page_date_ranges(documents, pages, narrative):
+    """
+    [first, last] narrative date for each page, or None before a patrol's
+    narrative starts. The index records the page where each day's entries
+    begin, so a page runs from the day carried over from the previous page
+    to the last day that starts on it.
+    """
+    ranges = []
+    carried = None
+    previous_doc = None
+    for doc_id, page_num in pages:
+        if doc_id != previous_doc:
+            carried = None
+            previous_doc = doc_id
+        dates = narrative.get(patrol_number(documents[doc_id]), {}).get(page_num)
+        if dates:
+            first = carried or min(dates)
+            carried = max(dates)
+            ranges.append([first, carried])
+        else:
+            ranges.append([carried, carried] if carried else None)
+    return ranges
+
+
+def load_glossary_terms(glossary_path=GLOSSARY_PATH):
+    """[(term, category)] from the glossary, or [] if it can't be read."""
+    try:
+        with open(glossary_path, 'r', encoding='utf-8') as f:
+            glossary = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Glossary unavailable, building without glossary suggestions: {e}")
+        return []
+    return [(term, category) for category, terms in glossary.items() for term in terms]
+
+
+def _phrase_count(postings, terms):
+    """Occurrences of terms as consecutive words, from posting lists."""
+    if not terms:
+        return 0
+    if len(terms) == 1:
+        return sum(len(positions) for _, positions in postings.get(terms[0], ()))
+    following = [dict(postings.get(term, ())) for term in terms[1:]]
+    count = 0
+    for page_id, positions in postings.get(terms[0], ()):
+        if all(page_id in later for later in following):
+            later_sets = [set(later[page_id]) for later in following]
+            count += sum(1 for p in positions
+                         if all(p + i in later for i, later in enumerate(later_sets, 1)))
+    return count
+
+
+def _file_signature(path):
+    """Return [name, mtime_ns, size] for a file, or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [os.path.basename(path), st.st_mtime_ns, st.st_size]
+
+
+def _text_source(pdf_file, reports_dir):
+    """Path of the best available OCR source: Google Vision JSON, then V3, then original."""
+    base_name = pdf_file.replace('.pdf', '')
+    gv_json = os.path.join(reports_dir, f"{base_name}_gv_ocr.json")
+    if os.path.exists(gv_json):
+        return gv_json
+    v3_path = os.path.join(reports_dir, f"{base_name}_v3.pdf")
+    if os.path.exists(v3_path):
+        return v3_path
+    return os.path.join(reports_dir, pdf_file)
+
+
+def _corrections_path(pdf_file, corrections_dir):
+    base_name = pdf_file.replace('.pdf', '')
+    return os.path.join(corrections_dir, f"{base_name}.json")
+
+
+def source_signature(pdf_file, reports_dir=REPORTS_DIR, corrections_dir=CORRECTIONS_DIR):
+    """Signature of the files a document's index entries are built from."""
+    boxes = box_source(pdf_file, reports_dir)
+    return [_file_signature(_text_source(pdf_file, reports_dir)),
+            _file_signature(_corrections_path(pdf_file, corrections_dir)),
+            _file_signature(boxes) if boxes else None]
+
+
+def load_document_pages(pdf_file, reports_dir=REPORTS_DIR, corrections_dir=CORRECTIONS_DIR):
+    """
+    Load the searchable text of a document as a sorted list of (page_num, text),
+    using corrected text where available.
+    """
+    source = _text_source(pdf_file, reports_dir)
+    pages = []
+    if source.endswith('_gv_ocr.json'):
+        with open(source, 'r', encoding='utf-8') as f:
+            gv_data = json.load(f)
+        pages = [(int(pn), txt) for pn, txt in gv_data.items()]
+        pages.sort(key=lambda x: x[0])
+    else:
+        try:
+            from pdf_text import get_pdf_text
+            pages = get_pdf_text(source).pages()
+        except Exception as e:
+            print(f"Error extracting text from {source}: {e}")
+            return []
+
+    corrections_path = _corrections_path(pdf_file, corrections_dir)
+    if os.path.exists(corrections_path):
+        with open(corrections_path, 'r', encoding='utf-8') as f:
+            corrections = json.load(f)
+        pages = [(pn, corrections.get(str(pn), txt)) for pn, txt in pages]
+    return pages
+
+
+def _index_document(args):
+    """
+    Tokenize one document. Runs in a worker process during parallel builds.
+    Returns (pages, postings, lengths, boxes, entities) where postings maps
+    term -> [[local_page, [positions]]], lengths are page lengths in terms,
+    boxes are the aligned word boxes of each page (or None) and entities
+    are each page's entity mentions.
+    """
+    from search_entities import extract_entities
+    pdf_file, reports_dir, corrections_dir = args
+    pages = load_document_pages(pdf_file, reports_dir, corrections_dir)
+    word_boxes = load_word_boxes(pdf_file, reports_dir)
+    postings = {}
+    lengths = []
+    boxes = []
+    entities = []
+    entity_state = {}  # dates carry over from page to page
+    for local_page, (page_num, text) in enumerate(pages):
+        words = word_boxes.get(page_num)
+        boxes.append(align_words(text, words) if words else None)
+        entities.append(extract_entities(text, entity_state))
+        page_positions = {}
+        terms = tokenize(text)
+        for pos, term in enumerate(terms):
+            page_positions.setdefault(term, []).append(pos)
+        for term, positions in page_positions.items():
+            postings.setdefault(term, []).append([local_page, positions])
+        lengths.append(len(terms))
+    return pages, postings, lengths, boxes, entities
+
+
+class SearchIndex:
+    """
+    In-memory view of the persisted index for one reports directory.
+
+    Pages are numbered globally in file order then page order, so posting lists
+    are sorted by page id and results come back in the same order the old
+    per-file scan produced.
+    """
+
+    def __init__(self, reports_dir=REPORTS_DIR, corrections_dir=CORRECTIONS_DIR,
+                 index_dir=INDEX_DIR, use_database=True):
+        self.reports_dir = reports_dir
+        self.corrections_dir = corrections_dir
+        self.index_dir = index_dir
+        # Narrative dates and contact/attack records come from the database,
+        # which covers Cod only
+        self.use_database = use_database
+        self.corpus = None   # memory-mapped page texts, see search_corpus
+        self.sources = None
+        self.generation = 0
+        self.documents = []
+        self.pages = []      # page_id -> (doc_id, page_num)
+        self.postings = {}   # term -> [[page_id, [positions]], ...]
+        self.page_lengths = []  # page_id -> number of terms, for BM25
+        self.avg_page_length = 1.0
+        self.page_dates = []  # page_id -> [first, last] narrative date, or None
+        self.doc_patrols = []  # doc_id -> patrol number, or None
+        self._last_plan = None  # (key, plan, partial, request) of the most recent _match_plan
+        self._last_concordance = None  # (key, keyed occurrences) of the most recent concordance
+        self.vocab = []      # sorted terms
+        self.reversed_vocab = []  # sorted reversed terms, for suffix lookups
+        self.trigrams = TrigramIndex([], [])  # vocabulary trigrams, see search_fuzzy
+        self.completer = Completer([], {})  # prefix suggestions, see search_suggest
+        self.entities = None  # entity mention lookups, see search_entities
+        self.records = None   # database records, see search_records
+
+    @property
+    def index_path(self):
+        return os.path.join(self.index_dir, INDEX_FILENAME)
+
+    @property
+    def corpus_path(self):
+        return os.path.join(self.index_dir, CORPUS_FILENAME)
+
+    def current_sources(self):
+        """Signatures of all source files, keyed by PDF name."""
+        return {pdf_file: source_signature(pdf_file, self.reports_dir, self.corrections_dir)
+                for pdf_file in list_report_pdfs(self.reports_dir)}
+
+    def ensure_current(self):
+        """Make sure the in-memory index matches the files on disk, loading or rebuilding as needed."""
+        sources = self.current_sources()
+        if self.sources == sources and self._corpus_unchanged():
+            return self
+        if self.load() and self.sources == sources:
+            return self
+        # Another worker may be rebuilding already: wait for it and load its
+        # files rather than building the same thing alongside it
+        with build_lock(self.index_dir):
+            if self.load() and self.sources == sources:
+                return self
+            self._build(sources)
+        return self
+
+    def _corpus_unchanged(self):
+        """
+        True if the corpus file is still the one this index mapped. Catches
+        rebuilds that didn't change the sources, such as new narrative dates.
+        """
+        try:
+            st = os.stat(self.corpus_path)
+        except OSError:
+            return False
+        return self.corpus is not None and self.corpus.file_id == (st.st_ino, st.st_mtime_ns)
+
+    def build(self, sources=None, parallel=True):
+        """Build the corpus and index from the OCR sources and persist them."""
+        with build_lock(self.index_dir):
+            return self._build(sources, parallel)
+
+    def _build(self, sources=None, parallel=True):
+        """build() for a caller already holding the build lock."""
+        from search_records import load_database_records
+        if sources is None:
+            sources = self.current_sources()
+        pdf_files = list(sources)
+        jobs = [(pdf_file, self.reports_dir, self.corrections_dir) for pdf_file in pdf_files]
+        if parallel and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+                doc_results = list(pool.map(_index_document, jobs))
+        else:
+            doc_results = [_index_document(job) for job in jobs]
+
+        pages = []
+        texts = []
+        word_boxes = []
+        postings = {}
+        page_lengths = []
+        entities = []
+        for doc_id, (doc_pages, doc_postings, doc_lengths, doc_boxes, doc_entities) in enumerate(doc_results):
+            first_page_id = len(pages)
+            page_lengths.extend(doc_lengths)
+            word_boxes.extend(doc_boxes)
+            entities.extend(doc_entities)
+            for page_num, text in doc_pages:
+                pages.append([doc_id, page_num])
+                texts.append(text)
+            for term, entries in doc_postings.items():
+                merged = postings.setdefault(term, [])
+                for local_page, positions in entries:
+                    merged.append([first_page_id + local_page, positions])
+
+        # Forward index: each page's terms as ids into the sorted vocabulary
+        vocab = sorted(postings)
+        term_ids = [array('I', [0]) * length for length in page_lengths]
+        for term_id, term in enumerate(vocab):
+            for page_id, positions in postings[term]:
+                page_terms = term_ids[page_id]
+                for pos in positions:
+                    page_terms[pos] = term_id
+
+        # Each rebuild bumps the generation so workers can tell the corpus
+        # and index files belong together; the build lock keeps two builders
+        # from taking the same one
+        generation = max(read_generation(self.corpus_path), self.generation) + 1
+        build_id = os.urandom(16).hex()
+        write_corpus(self.corpus_path, generation, build_id, sources, pdf_files, pages, texts, word_boxes,
+                     term_ids)
+
+        frequencies = [sum(len(positions) for _, positions in postings[term]) for term in vocab]
+        glossary_counts = [(term, category, _phrase_count(postings, tokenize(term)))
+                           for term, category in load_glossary_terms()]
+        suggestions = build_entries(vocab, frequencies, glossary_counts)
+        data = {
+            'version': INDEX_VERSION,
+            'generation': generation,
+            'build_id': build_id,
+            'postings': postings,
+            'page_lengths': page_lengths,
+            'page_dates': page_date_ranges(pdf_files, pages,
+                                           load_narrative_dates() if self.use_database else {}),
+            'suggestions': {'entries': suggestions, 'top': precompute_top(suggestions)},
+            'entities': entities,
+            'records': load_database_records() if self.use_database else [],
+        }
+        self._save(data)
+        self._set(Corpus(self.corpus_path), data)
+        return self
+
+    def load(self):
+        """
+        Map the persisted corpus and load the index. Returns False if either is
+        missing, from an older version, or from a different build.
+        """
+        try:
+            corpus = Corpus(self.corpus_path)
+        except (OSError, ValueError):
+            return False
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        # The two files are replaced one after the other, so a reader can
+        # catch a new corpus with the old index or the reverse
+        if (data.get('version') != INDEX_VERSION or data.get('generation') != corpus.generation
+                or data.get('build_id') != corpus.build_id):
+            corpus.close()
+            return False
+        self._set(corpus, data)
+        return True
+
+    def _save(self, data):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.index_path)
+
+    def _set(self, corpus, data):
+        if self.corpus is not None:
+            self.corpus.close()
+        self.corpus = corpus
+        self.sources = corpus.sources
+        self.generation = corpus.generation
+        self.documents = corpus.documents
+        self.pages = corpus.pages
+        self.postings = data['postings']
+        self.page_lengths = data['page_lengths']
+        self.page_dates = data['page_dates']
+        self.doc_patrols = [patrol_number(pdf_file) for pdf_file in self.documents]
+        self._last_plan = None
+        self._last_concordance = None
+        self.avg_page_length = (sum(self.page_lengths) / len(self.page_lengths)
+                                if self.page_lengths else 1.0) or 1.0
+        self.vocab = sorted(self.postings)
+        self.reversed_vocab = sorted(term[::-1] for term in self.postings)
+        self.trigrams = TrigramIndex(
+            self.vocab,
+            [sum(len(positions) for _, positions in self.postings[term]) for term in self.vocab])
+        self.completer = Completer(data['suggestions']['entries'], data['suggestions']['top'])
+        from search_entities import EntityIndex
+        from search_records import RecordIndex
+        self.entities = EntityIndex(data['entities'])
+        self.records = RecordIndex(data['records'])
+
+    # --- Term lookups ---
+
+    def _terms_with_prefix(self, prefix):
+        start = bisect.bisect_left(self.vocab, prefix)
+        end = bisect.bisect_left(self.vocab, prefix + '\uffff')
+        return self.vocab[start:end]
+
+    def _terms_with_suffix(self, suffix):
+        rev = suffix[::-1]
+        start = bisect.bisect_left(self.reversed_vocab, rev)
+        end = bisect.bisect_left(self.reversed_vocab, rev + '\uffff')
+        return [term[::-1] for term in self.reversed_vocab[start:end]]
+
+    def _terms_containing(self, fragment):
+        return self.trigrams.containing(fragment)
+
+    def _phrase_starts(self, term_groups):
+        """
+        Given one list of terms per query position, return {page_id: [start positions]}
+        where some term from each list appears at consecutive positions.
+        """
+        groups = []  # per query position: page_id -> set of positions
+        for terms in term_groups:
+            group = {}
+            for term in terms:
+                for page_id, positions in self.postings.get(term, ()):
+                    group.setdefault(page_id, set()).update(positions)
+            if not group:
+                return {}
+            groups.append(group)
+
+        matches = {}
+        for page_id in set(groups[0]).intersection(*groups[1:]):
+            starts = sorted(groups[0][page_id])
+            for offset, group in enumerate(groups[1:], 1):
+                positions = group[page_id]
+                starts = [p for p in starts if p + offset in positions]
+                if not starts:
+                    break
+            if starts:
+                matches[page_id] = starts
+        return matches
+
+    def candidate_matches(self, query):
+        """
+        Estimated match counts for the literal query, keyed by page id, from
+        posting lists alone.
+
+        A substring match spans consecutive terms in the text: the first query
+        term may be the tail of a longer term, the last may be the head of one,
+        and anything between must match exactly. Every real match is counted,
+        so pages missing from the result cannot contain the query. Returns None
+        if the query has no word characters to look up.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+
+        if len(tokens) == 1:
+            counts = {}
+            for term in self._terms_containing(tokens[0]):
+                for page_id, positions in self.postings.get(term, ()):
+                    counts[page_id] = counts.get(page_id, 0) + len(positions)
+            return counts
+
+        return {page_id: len(starts)
+                for page_id, starts in self._phrase_starts(self._exact_term_groups(tokens)).items()}
+
+    def _exact_term_groups(self, tokens):
+        """Index terms each query token can match as part of a literal substring match."""
+        if len(tokens) == 1:
+            return [self._terms_containing(tokens[0])]
+        last = len(tokens) - 1
+        term_groups = []
+        for i, token in enumerate(tokens):
+            if i == 0:
+                term_groups.append(self._terms_with_suffix(token))
+            elif i == last:
+                term_groups.append(self._terms_with_prefix(token))
+            else:
+                term_groups.append([token] if token in self.postings else [])
+        return term_groups
+
+    def candidate_pages(self, query):
+        """Sorted page ids that may contain the literal query, or None if it can't be looked up."""
+        counts = self.candidate_matches(query)
+        if counts is None:
+            return None
+        return sorted(counts)
+
+    def fuzzy_matches(self, query, max_distance=None):
+        """
+        Token-position matches for query where each term may be misspelled by up
+        to max_distance edits (default depends on term length). Returns
+        {page_id: [start positions]} for a run of len(tokens) terms.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return {}
+        term_groups = [[term for term, _ in self.trigrams.similar(token, max_distance)]
+                       for token in tokens]
+        return self._phrase_starts(term_groups)
+
+    def complete(self, prefix, limit=10):
+        """Autocomplete suggestions for a search box prefix, see search_suggest."""
+        return self.completer.complete(prefix, limit)
+
+    def suggest(self, query):
+        """
+        "Did you mean" for a query: each term not in the vocabulary is replaced by
+        the most frequent nearby term. Returns None if nothing would change.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        suggested = []
+        for token in tokens:
+            suggested.append(self.trigrams.suggest(token) or token)
+        if suggested == tokens:
+            return None
+        return ' '.join(suggested)
+
+    # --- Hits ---
+
+    def _match_plan(self, query, mode='exact', max_distance=None, date_range=None):
+        """
+        Return (counts, spans): estimated hits per candidate page id (None means
+        every page must be scanned) and a function yielding (start, end) match
+        offsets within a page's text. date_range is a (lo, hi) pair from
+        parse_date_range; pages outside it are dropped.
+        """
+        # A request usually needs the same plan more than once (estimate,
+        # facets, hits), so keep the last one. A partial regex plan depends
+        # on how the scan went this time, so only its own request reuses it
+        key = (query, mode, max_distance, date_range)
+        last = self._last_plan
+        if (last is not None and last[0] == key
+                and (not last[2] or (last[3] is not None and last[3] is search_trace.request()))):
+            return last[1]
+        partial = False
+        if mode == 'regex':
+            counts, spans, partial = self._regex_plan(query, date_range)
+        else:
+            with search_trace.span('plan'):
+                counts, spans = self._base_plan(query, mode, max_distance)
+                if date_range is not None:
+                    counts, spans = self._restrict_dates(counts, spans, date_range)
+        if counts is not None:
+            search_trace.count('candidate_pages', len(counts))
+        self._last_plan = (key, (counts, spans), partial, search_trace.request() if partial else None)
+        return counts, spans
+
+    def is_partial(self, query, mode='exact', max_distance=None, date_range=None):
+        """True if matching query stopped early (regex time limit or hit cap)."""
+        self._match_plan(query, mode, max_distance, date_range)
+        return self._last_plan[2]
+
+    def _regex_plan(self, pattern, date_range=None):
+        """
+        Plan for a regular expression: matches are found up front by the
+        sandboxed process pool in search_regex, then served from memory.
+        Raises RegexError for rejected patterns.
+        """
+        from search_regex import compile_pattern, find_matches
+        compiled = compile_pattern(pattern)
+        page_ids = range(len(self.pages))
+        if date_range is not None:
+            page_ids = [page_id for page_id in page_ids if self._in_date_range(page_id, date_range)]
+        with search_trace.span('scan'):
+            matches, partial = find_matches(self.corpus, compiled, page_ids)
+        search_trace.count('pages_scanned', len(page_ids))
+        search_trace.count('bytes_scanned', sum(self.corpus.page_bytes(page_id) for page_id in page_ids))
+        search_trace.count('documents_scanned', len({self.pages[page_id][0] for page_id in page_ids}))
+
+        def spans(page_id, text):
+            return iter(matches[page_id])
+
+        return {page_id: len(found) for page_id, found in matches.items()}, spans, partial
+
+    def _in_date_range(self, page_id, date_range):
+        dates = self.page_dates[page_id]
+        if dates is None:
+            return False
+        lo, hi = date_range
+        return (lo is None or dates[1] >= lo) and (hi is None or dates[0] <= hi)
+
+    def _restrict_dates(self, counts, spans, date_range):
+        """Drop pages whose narrative dates fall outside date_range from a plan."""
+        def dated_spans(page_id, text):
+            if self._in_date_range(page_id, date_range):
+                yield from spans(page_id, text)
+
+        if counts is not None:
+            counts = {page_id: n for page_id, n in counts.items()
+                      if self._in_date_range(page_id, date_range)}
+        return counts, dated_spans
+
+    def _base_plan(self, query, mode='exact', max_distance=None):
+        if mode == 'fuzzy':
+            starts_by_page = self.fuzzy_matches(query, max_distance)
+            length = len(tokenize(query))
+
+            def spans(page_id, text):
+                words = [(m.start(), m.end()) for m in TOKEN_PATTERN.finditer(text)]
+                for p in starts_by_page[page_id]:
+                    yield words[p][0], words[p + length - 1][1]
+
+            return {page_id: len(starts) for page_id, starts in starts_by_page.items()}, spans
+
+        if mode == 'query':
+            # Boolean/phrase/proximity query: one hit per matching page,
+            # centred on its first highlighted span
+            from search_query import execute
+            page_spans = dict(execute(self, query))
+
+            def spans(page_id, text):
+                if not page_spans[page_id]:
+                    yield 0, 0
+                    return
+                first, last = page_spans[page_id][0]
+                words = [(m.start(), m.end()) for m in TOKEN_PATTERN.finditer(text)]
+                yield words[first][0], words[last][1]
+
+            return {page_id: 1 for page_id in page_spans}, spans
+
+        if mode == 'entity':
+            # Mentions were found at build time, so hits come from the index
+            from search_entities import parse_entity_query
+            page_spans = self.entities.match(parse_entity_query(query))
+
+            def spans(page_id, text):
+                return iter(page_spans[page_id])
+
+            return {page_id: len(found) for page_id, found in page_spans.items()}, spans
+
+        if mode != 'exact':
+            raise ValueError(f"Unknown search mode: {mode!r}")
+
+        pattern = re.compile(re.escape(query), re.IGNORECASE)
+
+        def spans(page_id, text):
+            for match in pattern.finditer(text):
+                yield match.start(), match.end()
+
+        return self.candidate_matches(query), spans
+
+    def estimate_hits(self, query, mode='exact', max_distance=None, date_range=None):
+        """Upper-bound estimate of the number of hits, or None if it can't be estimated."""
+        counts, _ = self._match_plan(query, mode, max_distance, date_range)
+        if counts is None:
+            return None
+        return sum(counts.values())
+
+    def facets(self, query, mode='exact', max_distance=None, date_range=None):
+        """
+        Estimated hits per patrol, per report and per narrative month, summed
+        from the per-page candidate counts without reading any page text.
+        Returns {'patrol': [{'value', 'count'}], 'report': [...], 'month': [...]},
+        or None if the query can't be looked up in the index.
+        """
+        counts, _ = self._match_plan(query, mode, max_distance, date_range)
+        if counts is None:
+            return None
+        with search_trace.span('facets'):
+            return self._facet_counts(counts)
+
+    def _facet_counts(self, counts):
+        by_doc = {}
+        by_month = {}
+        for page_id, n in counts.items():
+            if not n:
+                continue
+            doc_id = self.pages[page_id][0]
+            by_doc[doc_id] = by_doc.get(doc_id, 0) + n
+            dates = self.page_dates[page_id]
+            if dates is not None:
+                month = dates[0][:7]
+                by_month[month] = by_month.get(month, 0) + n
+        by_patrol = {}
+        for doc_id, n in by_doc.items():
+            patrol = self.doc_patrols[doc_id]
+            if patrol is not None:
+                by_patrol[patrol] = by_patrol.get(patrol, 0) + n
+        return {
+            'patrol': [{'value': patrol, 'count': n} for patrol, n in sorted(by_patrol.items())],
+            'report': [{'value': self.documents[doc_id], 'count': n}
+                       for doc_id, n in sorted(by_doc.items())],
+            'month': [{'value': month, 'count': n} for month, n in sorted(by_month.items())],
+        }
+
+    def _make_hit(self, page_id, normalized, start, end, context_chars=150):
+        """
+        Build a result dict for a match at raw text[start:end]. The snippet is
+        sliced from the page's normalized text, so match offsets index into
+        the returned context. boxes are the match's rectangles on the page as
+        [x0, y0, x1, y1] fractions of its width and height.
+        """
+        doc_id, page_num = self.pages[page_id]
+        norm_start = normalized.to_normalized(start)
+        norm_end = normalized.to_normalized(end)
+        context, match_start, match_end = normalized.snippet(norm_start, norm_end, context_chars)
+        return {
+            'pdf_file': self.documents[doc_id],
+            'page_num': page_num,
+            'context': context,
+            'match_start': match_start,
+            'match_end': match_end,
+            'matched_text': normalized.text[norm_start:norm_end],
+            'boxes': self.corpus.word_boxes(page_id, start, end),
+        }
+
+    def _scan_page(self, page_id, spans):
+        """Read a page and list its (start, end) matches, counting the work done."""
+        with search_trace.span('scan'):
+            text = self.corpus.page_text(page_id)
+            found = list(spans(page_id, text))
+        search_trace.count('pages_scanned')
+        search_trace.count('bytes_scanned', self.corpus.page_bytes(page_id))
+        return found
+
+    def _hit(self, page_id, normalized, start, end, context_chars):
+        with search_trace.span('snippet'):
+            hit = self._make_hit(page_id, normalized, start, end, context_chars)
+        search_trace.count('hits')
+        return hit
+
+    def _iter_hits(self, counts, spans, context_chars=150, after=None):
+        """
+        Yield (key, hit) for every match, where key is (pdf_file, page_num,
+        match offset). Documents are sorted by name, so keys increase; only hits
+        with key > after are produced.
+        """
+        page_ids = sorted(counts) if counts is not None else range(len(self.pages))
+
+        last_doc = None
+        for page_id in page_ids:
+            doc_id, page_num = self.pages[page_id]
+            pdf_file = self.documents[doc_id]
+            skip_to = -1
+            if after is not None:
+                if (pdf_file, page_num) < after[:2]:
+                    continue
+                if (pdf_file, page_num) == after[:2]:
+                    skip_to = after[2]
+            if doc_id != last_doc:
+                search_trace.count('documents_scanned')
+                last_doc = doc_id
+            normalized = None
+            for start, end in self._scan_page(page_id, spans):
+                if start <= skip_to:
+                    continue
+                if normalized is None:
+                    normalized = self.corpus.normalized_text(page_id)
+                yield (pdf_file, page_num, start), self._hit(page_id, normalized, start, end,
+                                                             context_chars)
+
+    def document_boxes(self, query, pdf_file, mode='exact', max_distance=None, date_range=None):
+        """
+        Every page of one document with a match, in page order, with the
+        rectangles of all its matches: [{'page_num', 'count', 'boxes'}].
+        Lets the viewer step through hits without a search per page.
+        """
+        try:
+            doc_id = self.documents.index(pdf_file)
+        except ValueError:
+            return []
+        counts, spans = self._match_plan(query, mode, max_distance, date_range)
+        first = bisect.bisect_left(self.pages, (doc_id, -1))
+        last = bisect.bisect_left(self.pages, (doc_id + 1, -1))
+        if counts is not None:
+            page_ids = sorted(page_id for page_id in counts if first <= page_id < last)
+        else:
+            page_ids = range(first, last)
+        search_trace.count('documents_scanned')
+        pages = []
+        for page_id in page_ids:
+            found = self._scan_page(page_id, spans)
+            if not found:
+                continue
+            boxes = []
+            for start, end in found:
+                boxes.extend(self.corpus.word_boxes(page_id, start, end))
+            search_trace.count('hits', len(found))
+            pages.append({'page_num': self.pages[page_id][1], 'count': len(found), 'boxes': boxes})
+        return pages
+
+    def keyed_hits(self, query, context_chars=150, after=None, mode='exact', max_distance=None,
+                   date_range=None):
+        """
+        Yield (key, hit) for every match after the (pdf_file, page_num, offset)
+        key after, in key order. Lets search_shards merge hits from several
+        indexes.
+        """
+        counts, spans = self._match_plan(query, mode, max_distance, date_range)
+        return self._iter_hits(counts, spans, context_chars, after)
+
+    def iter_hits(self, query, context_chars=150, cursor=None, mode='exact', max_distance=None,
+                  date_range=None):
+        """Yield matches with context as they are found, resuming after cursor if given."""
+        after = decode_cursor(cursor) if cursor else None
+        for _, hit in self.keyed_hits(query, context_chars, after, mode, max_distance, date_range):
+            yield hit
+
+    def search(self, query, context_chars=150, mode='exact', max_distance=None, date_range=None):
+        """Find every occurrence of query (case-insensitive). Returns matches with context."""
+        return list(self.iter_hits(query, context_chars, mode=mode, max_distance=max_distance,
+                                   date_range=date_range))
+
+    def search_page(self, query, limit, cursor=None, context_chars=150, mode='exact',
+                    max_distance=None, date_range=None):
+        """
+        Return one page of matches: {'results', 'next_cursor', 'total_estimate'}.
+        Only the hits on this page (plus one lookahead) are materialized.
+        """
+        after = decode_cursor(cursor) if cursor else None
+        counts, spans = self._match_plan(query, mode, max_distance, date_range)
+        results = []
+        next_cursor = None
+        last_key = None
+        for key, hit in self._iter_hits(counts, spans, context_chars, after):
+            if len(results) == limit:
+                next_cursor = encode_cursor(last_key)
+                break
+            results.append(hit)
+            last_key = key
+        return {
+            'results': results,
+            'next_cursor': next_cursor,
+            'total_estimate': sum(counts.values()) if counts is not None else None,
+        }
+
+    # --- Ranking ---
+
+    def _scoring_groups(self, query, mode='exact', max_distance=None):
+        """
+        Index terms to score, one list per query word. Terms in a list are
+        treated as spellings of the same word.
+        """
+        if mode == 'query':
+            from search_query import parse_query, positive_term_groups
+            return positive_term_groups(parse_query(self, query))
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        if mode == 'fuzzy':
+            return [[term for term, _ in self.trigrams.similar(token, max_distance)]
+                    for token in tokens]
+        return self._exact_term_groups(tokens)
+
+    def _group_frequencies(self, terms):
+        """{page_id: occurrences} of any of a group's terms."""
+        frequencies = {}
+        for term in terms:
+            for page_id, positions in self.postings.get(term, ()):
+                frequencies[page_id] = frequencies.get(page_id, 0) + len(positions)
+        return frequencies
+
+    def ranking_stats(self, query, mode='exact', max_distance=None):
+        """
+        BM25 collection statistics of this index for query: {'pages',
+        'length', 'df'} with df the document frequency of each scoring group.
+        search_shards adds them up so every shard scores against the whole
+        archive.
+        """
+        groups = [] if mode in ('regex', 'entity') else self._scoring_groups(query, mode, max_distance)
+        return {
+            'pages': len(self.pages),
+            'length': sum(self.page_lengths),
+            'df': [len(self._group_frequencies(terms)) for terms in groups],
+        }
+
+    def rank(self, query, mode='exact', max_distance=None, date_range=None, stats=None):
+        """
+        BM25 scores for the pages that match query. Only pages on the posting
+        lists of query terms are touched; document frequencies come from the
+        posting lists and page lengths from the index build, or from stats
+        (see ranking_stats) when ranking across several indexes.
+        Returns (scores, spans) with scores as {page_id: score}.
+        """
+        counts, spans = self._match_plan(query, mode, max_distance, date_range)
+        with search_trace.span('rank'):
+            return self._score(query, mode, max_distance, counts, stats), spans
+
+    def _score(self, query, mode, max_distance, counts, stats=None):
+        n_pages = len(self.pages)
+        avg_page_length = self.avg_page_length
+        if stats is not None:
+            n_pages = stats['pages']
+            avg_page_length = (stats['length'] / stats['pages'] if stats['pages'] else 1.0) or 1.0
+        scores = {}
+        if mode in ('regex', 'entity'):
+            # No terms to weigh, so score pages on how often the pattern matches
+            for page_id, tf in counts.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.page_lengths[page_id] / avg_page_length)
+                scores[page_id] = tf * (BM25_K1 + 1) / (tf + norm)
+            return scores
+        for i, terms in enumerate(self._scoring_groups(query, mode, max_distance)):
+            frequencies = self._group_frequencies(terms)
+            if not frequencies:
+                continue
+            df = stats['df'][i] if stats is not None else len(frequencies)
+            idf = math.log(1 + (n_pages - df + 0.5) / (df + 0.5))
+            for page_id, tf in frequencies.items():
+                if counts is not None and page_id not in counts:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.page_lengths[page_id] / avg_page_length)
+                scores[page_id] = scores.get(page_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        # Pages matched only through filters still rank, just last; queries
+        # with nothing to look up fall back to checking every page
+        for page_id in counts if counts is not None else range(n_pages):
+            scores.setdefault(page_id, 0.0)
+        return scores
+
+    def search_ranked(self, query, limit=20, offset=0, context_chars=150, mode='exact',
+                      max_distance=None, date_range=None, stats=None):
+        """
+        Return the best matching pages, one hit per page with its BM25 score:
+        {'results', 'total_estimate'}. Pages come off a heap in score order
+        (ties in page order) and only those returned have their text read.
+        stats are collection statistics to score with, see rank.
+        """
+        scores, spans = self.rank(query, mode, max_distance, date_range, stats)
+        heap = [(-score, page_id) for page_id, score in scores.items()]
+        heapq.heapify(heap)
+        results = []
+        skipped = 0
+        doc_ids = set()
+        while heap and len(results) < limit:
+            neg_score, page_id = heapq.heappop(heap)
+            doc_ids.add(self.pages[page_id][0])
+            found = self._scan_page(page_id, spans)
+            if not found:
+                continue  # candidate page without a real match
+            if skipped < offset:
+                skipped += 1
+                continue
+            start, end = found[0]
+            hit = self._hit(page_id, self.corpus.normalized_text(page_id), start, end, context_chars)
+            hit['score'] = round(-neg_score, 4)
+            results.append(hit)
+        search_trace.count('documents_scanned', len(doc_ids))
+        return {'results': results, 'total_estimate': len(scores)}
+
+    def search_records(self, query, types=None, date_range=None, limit=20, offset=0,
+                       context_chars=150):
+        """
+        Contact and attack records matching query, which may include numeric
+        filters like target_tonnage>5000 (see search_records): {'results',
+        'total'}. Records with a report page link to it with pdf_file and
+        page_num. Raises RecordQueryError for unknown filters.
+        """
+        from search_records import parse_record_query
+        text, filters = parse_record_query(query)
+        with search_trace.span('records'):
+            matches = self.records.search(text, filters, types, date_range)
+        results = []
+        for record_id, field, start, end in matches[offset:offset + limit]:
+            hit = self.records.make_hit(record_id, field, start, end, context_chars)
+            page_num = hit['fields'].get('pdf_page')
+            report = [pdf_file for pdf_file, patrol in zip(self.documents, self.doc_patrols)
+                      if patrol == hit['patrol']]
+            if page_num and report:
+                hit['pdf_file'] = report[0]
+                hit['page_num'] = page_num
+            results.append(hit)
+        search_trace.count('records', len(matches))
+        return {'results': results, 'total': len(matches)}
+
+    # --- Concordance ---
+
+    def _concordance(self, query, sort, date_range):
+        """
+        (phrase length, [(key, page_id, start)] sorted by key) for every
+        occurrence of query; see search_concordance. Sort keys come from the
+        corpus's term ids, so no page text is read. Memoized, as paging asks
+        for the same query again.
+        """
+        from search_concordance import occurrence_key, term_groups
+        key = (query, sort, date_range)
+        if self._last_concordance is not None and self._last_concordance[0] == key:
+            return self._last_concordance[1]
+        groups = term_groups(self, query)
+        with search_trace.span('match'):
+            starts = self._phrase_starts(groups)
+        occurrences = []
+        with search_trace.span('keys'):
+            for page_id in sorted(starts):
+                if date_range is not None and not self._in_date_range(page_id, date_range):
+                    continue
+                doc_id, page_num = self.pages[page_id]
+                pdf_file = self.documents[doc_id]
+                terms = self.corpus.page_terms(page_id)
+                for start in starts[page_id]:
+                    occurrences.append((occurrence_key(self.vocab, terms, start, len(groups), sort,
+                                                       pdf_file, page_num), page_id, start))
+            occurrences.sort(key=lambda item: item[0])
+        result = (len(groups), occurrences)
+        self._last_concordance = (key, result)
+        return result
+
+    def concordance_keys(self, query, sort='right', after=None, limit=50, date_range=None):
+        """
+        ([(key, page_id, start)], total) for up to limit occurrences of query
+        with keys after after, in key order. Raises ConcordanceError for
+        queries with nothing to look up.
+        """
+        _, occurrences = self._concordance(query, sort, date_range)
+        first = bisect.bisect_right(occurrences, (after, math.inf)) if after is not None else 0
+        search_trace.count('occurrences', len(occurrences))
+        return occurrences[first:first + limit], len(occurrences)
+
+    def concordance_line(self, query, page_id, start, width, sort='right', date_range=None):
+        """A concordance line dict for the occurrence of query at word start of a page."""
+        from search_concordance import context_line
+        length, _ = self._concordance(query, sort, date_range)
+        text = self.corpus.page_text(page_id)
+        left, match, right = context_line(text, start, length, width)
+        doc_id, page_num = self.pages[page_id]
+        words = [m.span() for m in itertools.islice(TOKEN_PATTERN.finditer(text), start, start + length)]
+        search_trace.count('pages_scanned')
+        return {
+            'pdf_file': self.documents[doc_id],
+            'page_num': page_num,
+            'left': left,
+            'match': match,
+            'right': right,
+            'boxes': self.corpus.word_boxes(page_id, words[0][0], words[-1][1]),
+        }
+
+    def collocate_counts(self, query, window, sort='right', date_range=None):
+        """
+        (occurrences, {'left': {term: n}, 'right': {term: n}}) counting the
+        terms within window positions of every occurrence of query, read from
+        the corpus's term ids.
+        """
+        length, occurrences = self._concordance(query, sort, date_range)
+        left = {}
+        right = {}
+        with search_trace.span('collocations'):
+            for _, page_id, start in occurrences:
+                terms = self.corpus.page_terms(page_id)
+                for term_id in terms[max(0, start - window):start]:
+                    left[term_id] = left.get(term_id, 0) + 1
+                for term_id in terms[start + length:start + length + window]:
+                    right[term_id] = right.get(term_id, 0) + 1
+        return len(occurrences), {
+            'left': {self.vocab[term_id]: n for term_id, n in left.items()},
+            'right': {self.vocab[term_id]: n for term_id, n in right.items()},
+        }
+
+    def term_frequency(self, term):
+        """Occurrences of a term across all pages."""
+        return sum(len(positions) for _, positions in self.postings.get(term, ()))
+
+
+def encode_cursor(key):
+    """Encode a (pdf_file, page_num, offset) hit key as an opaque cursor string."""
+    raw = json.dumps(list(key), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor. Raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        pdf_file, page_num, offset = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    if not isinstance(pdf_file, str) or not isinstance(page_num, int) or not isinstance(offset, int):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return (pdf_file, page_num, offset)
+
+
+# One index per worker process, loaded on first use
+_index = None
+
+
+def get_index():
+    """Return this process's index, reloading or rebuilding it if the sources changed."""
+    global _index
+    if _index is None:
+        _index = SearchIndex()
+    return _index.ensure_current()
+
+
+def main():
+    index = SearchIndex()
+    print(f"Reports directory: {index.reports_dir}")
+    print(f"Building search index in: {index.index_dir}")
+    index.build()
+    print(f"  Generation {index.generation}: {len(index.documents)} documents, "
+          f"{len(index.pages)} pages, {index.corpus.text_bytes} bytes of text, {len(index.vocab)} terms")
+    print(f"  {sum(1 for dates in index.page_dates if dates)} pages dated from the narrative index")
+    print(f"  {len(index.entities.positions)} positions, {len(index.entities.dates)} dates and times, "
+          f"{sum(len(m) for m in index.entities.types.values())} ship and aircraft types mentioned")
+    print("Done!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Search latency histograms and slow-query log.
+
+Each request's trace (see search_trace.py) is folded into per-process
+histograms of total and per-phase time, which are flushed at most every few
+seconds into a small SQLite database next to the search index so the admin endpoint
+sees all gunicorn workers. Requests slower than SEARCH_SLOW_QUERY_MS
+(default 1000) are also appended, with their phases and counters, to a
+JSON-lines slow-query log. Once the log passes SLOW_LOG_MAX_BYTES it is
+moved to slow_queries.log.1 (replacing the previous one) and a new log is
+started, and the admin endpoint reads only its tail.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import search_trace
+from search_index import INDEX_DIR
+
+METRICS_PATH = os.path.join(INDEX_DIR, 'search_metrics.sqlite')
+SLOW_LOG_PATH = os.environ.get('SEARCH_SLOW_LOG', os.path.join(INDEX_DIR, 'slow_queries.log'))
+SLOW_QUERY_MS = float(os.environ.get('SEARCH_SLOW_QUERY_MS', 1000))
+SLOW_LOG_MAX_BYTES = int(os.environ.get('SEARCH_SLOW_LOG_BYTES', 10 * 1024 * 1024))
+
+# Bytes read at a time from the end of the slow-query log
+TAIL_BLOCK = 64 * 1024
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open-ended
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+FLUSH_INTERVAL = 5.0  # seconds between writes to the shared database
+
+
+def _bucket(ms):
+    for upper in BUCKETS_MS:
+        if ms <= upper:
+            return upper
+    return 'inf'
+
+
+class SearchMetrics:
+    """Collects finished traces and persists them as shared histograms."""
+
+    def __init__(self, path=METRICS_PATH, slow_log_path=SLOW_LOG_PATH, slow_query_ms=SLOW_QUERY_MS):
+        self.path = path
+        self.slow_log_path = slow_log_path
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self._pending_buckets = {}   # (label, metric, bucket) -> count
+        self._pending_totals = {}    # (label, metric) -> [count, sum]
+        self._last_flush = time.monotonic()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        # Connections must not be shared across a fork, so open one per process
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS buckets (
+                    label TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (label, metric, bucket)
+                )''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS totals (
+                    label TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    total REAL NOT NULL,
+                    PRIMARY KEY (label, metric)
+                )''')
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def record(self, trace):
+        """Fold a finished trace into the histograms and log it if slow."""
+        total_ms = trace.finish()
+        timings = dict(trace.phases, total=total_ms)
+        with self._lock:
+            for metric, ms in timings.items():
+                key = (trace.label, metric, str(_bucket(ms)))
+                self._pending_buckets[key] = self._pending_buckets.get(key, 0) + 1
+                self._add_total(trace.label, metric, ms)
+            for name, value in trace.counters.items():
+                self._add_total(trace.label, name, value)
+        if total_ms >= self.slow_query_ms:
+            self._log_slow(trace, total_ms)
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def _add_total(self, label, metric, value):
+        totals = self._pending_totals.setdefault((label, metric), [0, 0.0])
+        totals[0] += 1
+        totals[1] += value
+
+    def _log_slow(self, trace, total_ms):
+        entry = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'pid': os.getpid(),
+            'request': trace.name,
+            'label': trace.label,
+            'params': trace.params,
+            'total_ms': round(total_ms, 1),
+            'phases_ms': {phase: round(ms, 1) for phase, ms in trace.phases.items()},
+            'counters': trace.counters,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.slow_log_path), exist_ok=True)
+            with open(self.slow_log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                size = f.tell()
+            if size > SLOW_LOG_MAX_BYTES:
+                os.replace(self.slow_log_path, f"{self.slow_log_path}.1")
+        except OSError as e:
+            print(f"Slow query log write failed: {e}")
+
+    def flush(self):
+        """Write pending counts to the shared database."""
+        with self._lock:
+            buckets, self._pending_buckets = self._pending_buckets, {}
+            totals, self._pending_totals = self._pending_totals, {}
+            self._last_flush = time.monotonic()
+        if not buckets and not totals:
+            return
+        try:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    'INSERT INTO buckets (label, metric, bucket, count) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(label, metric, bucket) DO UPDATE SET count = count + excluded.count',
+                    [key + (n,) for key, n in buckets.items()])
+                conn.executemany(
+                    'INSERT INTO totals (label, metric, count, total) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(label, metric) DO UPDATE SET '
+                    'count = count + excluded.count, total = total + excluded.total',
+                    [key + tuple(value) for key, value in totals.items()])
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            print(f"Search metrics write failed: {e}")
+
+    def summary(self):
+        """
+        Histograms for every request label: {label: {'timings': {metric: {...}},
+        'counters': {name: {'total', 'mean'}}}}. Buckets are [upper bound in ms,
+        count] pairs and timing percentiles are bucket upper bounds.
+        """
+        self.flush()
+        conn = self._connect()
+        report = {}
+        order = {str(upper): i for i, upper in enumerate(BUCKETS_MS + ('inf',))}
+        histograms = {}
+        for label, metric, bucket, n in conn.execute('SELECT label, metric, bucket, count FROM buckets'):
+            histograms.setdefault((label, metric), {})[bucket] = n
+        for label, metric, n, total in conn.execute('SELECT label, metric, count, total FROM totals'):
+            entry = report.setdefault(label, {'timings': {}, 'counters': {}})
+            histogram = histograms.get((label, metric))
+            if histogram is None:
+                entry['counters'][metric] = {'total': total, 'mean': round(total / n, 1) if n else 0}
+                continue
+            buckets = sorted(histogram.items(), key=lambda item: order[item[0]])
+            entry['timings'][metric] = {
+                'count': n,
+                'mean_ms': round(total / n, 2) if n else 0,
+                'p50_ms': _histogram_percentile(buckets, n, 50),
+                'p95_ms': _histogram_percentile(buckets, n, 95),
+                'p99_ms': _histogram_percentile(buckets, n, 99),
+                'buckets': [[bucket if bucket == 'inf' else int(bucket), count]
+                            for bucket, count in buckets],
+            }
+        return report
+
+    def slow_queries(self, limit=20):
+        """The most recent slow-query log entries, newest first."""
+        try:
+            lines = _tail_lines(self.slow_log_path, limit)
+        except OSError:
+            return []
+        entries = []
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+
+def _tail_lines(path, limit):
+    """The last limit lines of a file, read backwards from the end in blocks."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= limit:
+            step = min(TAIL_BLOCK, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = data.decode('utf-8', errors='replace').splitlines()
+    # The first line may have been cut off by the block boundary
+    if position > 0:
+        lines = lines[1:]
+    return lines[-limit:]
+
+
+def _histogram_percentile(buckets, n, p):
+    """Upper bound of the bucket holding the p-th percentile."""
+    threshold = n * p / 100
+    seen = 0
+    for bucket, count in buckets:
+        seen += count
+        if seen >= threshold:
+            return bucket if bucket == 'inf' else int(bucket)
+    return None
+
+
+# One collector per worker process
+_metrics = None
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = SearchMetrics()
+    return _metrics
+
+
+def start(name, label, params=None):
+    """Begin tracing a request and make its trace current."""
+    trace = search_trace.Trace(name, label, params)
+    search_trace.activate(trace)
+    return trace
+
+
+def finish(trace):
+    """Stop tracing a request and record it."""
+    if search_trace.current() is trace:
+        search_trace.activate(None)
+    get_metrics().record(trace)
@@ -0,0 +1,378 @@
+"""
+Boolean, phrase and proximity queries over the positional search index.
+
+Syntax (operators are uppercase):
+    convoy tanker             both words on the page (implicit AND)
+    convoy AND tanker         same
+    convoy OR tanker          either word
+    convoy NOT escort         first without the second (also: convoy -escort)
+    "depth charge"            exact phrase
+    SJ NEAR/5 contact         within 5 words of each other, either order
+    torp*                     any word starting with "torp"
+    (tanker OR freighter) patrol:5
+                              grouping, restricted to the 5th patrol
+
+Field restrictions: patrol:5, patrol:4-6, patrol:1,3 and report:<name part>.
+
+Queries evaluate to page-level matches: a sorted list of
+(page_id, spans) where spans are (first, last) token positions to highlight.
+Intersections walk the posting lists with skip pointers.
+"""
+
+import re
+import math
+import bisect
+
+from search_index import patrol_number, tokenize
+
+DEFAULT_NEAR_DISTANCE = 10
+
+LEXER = re.compile(r'''
+    \s*(?:
+        (?P<phrase>"[^"]*")
+      | (?P<lparen>\()
+      | (?P<rparen>\))
+      | (?P<near>NEAR(?:/(?P<distance>\d+))?)(?=[\s("]|$)
+      | (?P<field>(?P<name>[A-Za-z]+):(?P<value>[^\s()"]+))
+      | (?P<minus>-)(?=[^\s-])
+      | (?P<word>[^\s()"]+)
+    )''', re.VERBOSE)
+
+FIELDS = ('patrol', 'report')
+
+
+class QuerySyntaxError(ValueError):
+    """Raised for queries that can't be parsed."""
+
+
+# --- Parsing ---
+#
+# Nodes are tuples:
+#   ('terms', [term, ...])               any of these index terms
+#   ('phrase', [[term, ...], ...])       consecutive positions, alternatives per slot
+#   ('near', left, right, distance)
+#   ('and', [node, ...]), ('or', [node, ...]), ('not', node)
+#   ('field', name, value)
+
+def _lex(text):
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        m = LEXER.match(text, pos)
+        if not m or m.end() == pos:
+            if text[pos:].lstrip().startswith('"'):
+                raise QuerySyntaxError("Unterminated quote")
+            raise QuerySyntaxError(f"Unexpected character at position {pos}")
+        pos = m.end()
+        if m.group('phrase') is not None:
+            tokens.append(('phrase', m.group('phrase')[1:-1]))
+        elif m.group('lparen'):
+            tokens.append(('(', None))
+        elif m.group('rparen'):
+            tokens.append((')', None))
+        elif m.group('near'):
+            distance = m.group('distance')
+            tokens.append(('near', int(distance) if distance else DEFAULT_NEAR_DISTANCE))
+        elif m.group('field') and m.group('name').lower() in FIELDS:
+            tokens.append(('field', (m.group('name').lower(), m.group('value'))))
+        elif m.group('minus'):
+            tokens.append(('not', None))
+        else:
+            word = m.group('field') or m.group('word')
+            if word in ('AND', 'OR', 'NOT'):
+                tokens.append((word.lower(), None))
+            else:
+                tokens.append(('word', word))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, index, tokens):
+        self.index = index
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QuerySyntaxError("Empty query")
+        node = self.or_expr()
+        if self.peek() is not None:
+            raise QuerySyntaxError("Unbalanced parentheses")
+        return node
+
+    def or_expr(self):
+        children = [self.and_expr()]
+        while self.peek() == 'or':
+            self.take()
+            children.append(self.and_expr())
+        return children[0] if len(children) == 1 else ('or', children)
+
+    def and_expr(self):
+        children = [self.unary()]
+        while self.peek() not in (None, ')', 'or'):
+            if self.peek() == 'and':
+                self.take()
+            children.append(self.unary())
+        children = [c for c in children if c is not None]
+        if not children:
+            raise QuerySyntaxError("Query has no searchable words")
+        return children[0] if len(children) == 1 else ('and', children)
+
+    def unary(self):
+        if self.peek() == 'not':
+            self.take()
+            operand = self.unary()
+            return ('not', operand) if operand is not None else None
+        return self.near()
+
+    def near(self):
+        left = self.primary()
+        while self.peek() == 'near':
+            _, distance = self.take()
+            right = self.primary()
+            if left is None or right is None:
+                raise QuerySyntaxError("NEAR needs a word or phrase on both sides")
+            left = ('near', left, right, distance)
+        return left
+
+    def primary(self):
+        kind = self.peek()
+        if kind is None:
+            raise QuerySyntaxError("Query ends unexpectedly")
+        kind, value = self.take()
+        if kind == '(':
+            node = self.or_expr()
+            if self.peek() != ')':
+                raise QuerySyntaxError("Unbalanced parentheses")
+            self.take()
+            return node
+        if kind == 'phrase':
+            return self.words(value)
+        if kind == 'word':
+            return self.words(value)
+        if kind == 'field':
+            return ('field',) + value
+        raise QuerySyntaxError(f"Unexpected {kind.upper()}")
+
+    def words(self, text):
+        """A bare word or quoted phrase. Returns None if it has nothing to search."""
+        prefix = text.endswith('*')
+        terms = tokenize(text)
+        if not terms:
+            return None
+        slots = [[term] for term in terms]
+        if prefix:
+            slots[-1] = self.index._terms_with_prefix(terms[-1])
+        if len(slots) == 1:
+            return ('terms', slots[0])
+        return ('phrase', slots)
+
+
+def parse_query(index, text):
+    """Parse query text into a node tree. Raises QuerySyntaxError."""
+    return _Parser(index, _lex(text)).parse()
+
+
+# --- Evaluation ---
+
+def _skip(length):
+    """Skip pointer interval for a posting list of this length."""
+    return max(1, int(math.sqrt(length)))
+
+
+def _intersect(a, b):
+    """Pages in both a and b, following skip pointers past runs that can't match."""
+    result = []
+    i = j = 0
+    skip_a, skip_b = _skip(len(a)), _skip(len(b))
+    while i < len(a) and j < len(b):
+        page_a, page_b = a[i][0], b[j][0]
+        if page_a == page_b:
+            result.append((page_a, sorted(set(a[i][1]) | set(b[j][1]))))
+            i += 1
+            j += 1
+        elif page_a < page_b:
+            if i % skip_a == 0 and i + skip_a < len(a) and a[i + skip_a][0] <= page_b:
+                while i % skip_a == 0 and i + skip_a < len(a) and a[i + skip_a][0] <= page_b:
+                    i += skip_a
+            else:
+                i += 1
+        else:
+            if j % skip_b == 0 and j + skip_b < len(b) and b[j + skip_b][0] <= page_a:
+                while j % skip_b == 0 and j + skip_b < len(b) and b[j + skip_b][0] <= page_a:
+                    j += skip_b
+            else:
+                j += 1
+    return result
+
+
+def _difference(a, b):
+    """Pages in a but not in b."""
+    result = []
+    j = 0
+    skip_b = _skip(len(b))
+    for page_id, spans in a:
+        while j < len(b) and b[j][0] < page_id:
+            if j % skip_b == 0 and j + skip_b < len(b) and b[j + skip_b][0] < page_id:
+                j += skip_b
+            else:
+                j += 1
+        if j < len(b) and b[j][0] == page_id:
+            continue
+        result.append((page_id, spans))
+    return result
+
+
+def _union(lists):
+    merged = {}
+    for matches in lists:
+        for page_id, spans in matches:
+            merged.setdefault(page_id, set()).update(spans)
+    return [(page_id, sorted(spans)) for page_id, spans in sorted(merged.items())]
+
+
+def _near(left, right, distance):
+    """Pages where a left span and a right span are within distance words."""
+    result = []
+    for page_id, spans in _intersect_pages(left, right):
+        left_spans, right_spans = spans
+        if not left_spans or not right_spans:
+            continue
+        right_firsts = [first for first, _ in right_spans]
+        longest = max(last - first for first, last in right_spans)
+        found = set()
+        for l_first, l_last in left_spans:
+            lo = bisect.bisect_left(right_firsts, l_first - distance - longest)
+            hi = bisect.bisect_right(right_firsts, l_last + distance)
+            for r_first, r_last in right_spans[lo:hi]:
+                if r_first > l_last:
+                    gap = r_first - l_last
+                elif l_first > r_last:
+                    gap = l_first - r_last
+                else:
+                    gap = 0
+                if gap <= distance:
+                    found.add((min(l_first, r_first), max(l_last, r_last)))
+        if found:
+            result.append((page_id, sorted(found)))
+    return result
+
+
+def _intersect_pages(a, b):
+    """Like _intersect, but keep both sides' spans separately."""
+    right = dict(b)
+    return [(page_id, (spans, right[page_id])) for page_id, spans in a if page_id in right]
+
+
+class _Evaluator:
+    def __init__(self, index):
+        self.index = index
+        self._all_pages = None
+
+    def all_pages(self):
+        if self._all_pages is None:
+            self._all_pages = [(page_id, []) for page_id in range(len(self.index.pages))]
+        return self._all_pages
+
+    def eval(self, node):
+        kind = node[0]
+        if kind == 'terms':
+            return self.terms(node[1])
+        if kind == 'phrase':
+            length = len(node[1])
+            starts = self.index._phrase_starts(node[1])
+            return [(page_id, [(s, s + length - 1) for s in starts[page_id]])
+                    for page_id in sorted(starts)]
+        if kind == 'near':
+            return _near(self.eval(node[1]), self.eval(node[2]), node[3])
+        if kind == 'or':
+            return _union([self.eval(child) for child in node[1]])
+        if kind == 'not':
+            return _difference(self.all_pages(), self.eval(node[1]))
+        if kind == 'field':
+            return self.field(node[1], node[2])
+        if kind == 'and':
+            return self.conjunction(node[1])
+        raise QuerySyntaxError(f"Unknown node {kind}")
+
+    def terms(self, terms):
+        if len(terms) == 1:
+            return [(page_id, [(p, p) for p in positions])
+                    for page_id, positions in self.index.postings.get(terms[0], ())]
+        merged = {}
+        for term in terms:
+            for page_id, positions in self.index.postings.get(term, ()):
+                merged.setdefault(page_id, []).extend((p, p) for p in positions)
+        return [(page_id, sorted(spans)) for page_id, spans in sorted(merged.items())]
+
+    def field(self, name, value):
+        if name == 'patrol':
+            # (lo, hi) intervals, so a range like 1-999999999 costs nothing
+            wanted = []
+            try:
+                for part in value.split(','):
+                    if '-' in part:
+                        lo, hi = part.split('-', 1)
+                        wanted.append((int(lo), int(hi)))
+                    else:
+                        wanted.append((int(part), int(part)))
+            except ValueError:
+                raise QuerySyntaxError(f"Invalid patrol number: {value}")
+            doc_ids = set()
+            for doc_id, pdf_file in enumerate(self.index.documents):
+                patrol = patrol_number(pdf_file)
+                if patrol is not None and any(lo <= patrol <= hi for lo, hi in wanted):
+                    doc_ids.add(doc_id)
+        else:
+            value = value.lower()
+            doc_ids = {doc_id for doc_id, pdf_file in enumerate(self.index.documents)
+                       if value in pdf_file.lower()}
+        return [(page_id, []) for page_id, (doc_id, _) in enumerate(self.index.pages)
+                if doc_id in doc_ids]
+
+    def conjunction(self, children):
+        positive = [c for c in children if c[0] != 'not']
+        negative = [c[1] for c in children if c[0] == 'not']
+        if positive:
+            # Intersect the shortest lists first so later steps skip the most
+            lists = sorted((self.eval(c) for c in positive), key=len)
+            result = lists[0]
+            for other in lists[1:]:
+                if not result:
+                    break
+                result = _intersect(result, other)
+        else:
+            result = self.all_pages()
+        for child in negative:
+            if not result:
+                break
+            result = _difference(result, self.eval(child))
+        return result
+
+
+def positive_term_groups(node):
+    """Term lists for the words a page is rewarded for matching (not under NOT)."""
+    kind = node[0]
+    if kind == 'terms':
+        return [node[1]]
+    if kind == 'phrase':
+        return list(node[1])
+    if kind == 'near':
+        return positive_term_groups(node[1]) + positive_term_groups(node[2])
+    if kind in ('and', 'or'):
+        return [group for child in node[1] for group in positive_term_groups(child)]
+    return []
+
+
+def execute(index, text):
+    """Run a query against an index. Returns a sorted list of (page_id, spans)."""
+    return _Evaluator(index).eval(parse_query(index, text))
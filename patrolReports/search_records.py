@@ -0,0 +1,255 @@
+"""
+Database records in search.
+
+Ship contact and aircraft contact remarks and the torpedo attack target and
+damage descriptions live in MySQL, not in the OCR text. They are read once
+when the search index is built (like the narrative dates) and kept in it,
+with their own small inverted index and sorted columns for numeric filters,
+so searching them never queries the database.
+
+Record searches take words plus optional filters on numeric columns:
+
+    maru target_tonnage>5000
+    destroyer range_yards<=3000 patrol=5
+"""
+
+import re
+import bisect
+import datetime
+from decimal import Decimal
+
+from search_index import tokenize
+
+# Per record type: the query, its searchable text columns and its numeric
+# columns. Every query selects id, patrol and a date as its first columns.
+RECORD_TYPES = {
+    'attack': {
+        'sql': """
+            SELECT id, patrol, attack_date, attack_time, attack_number, target_name, target_type,
+                   target_tonnage, target_range, target_speed, own_depth, result, pdf_page,
+                   target_description, damage_description, remarks
+            FROM torpedo_attacks
+        """,
+        'text': ('target_name', 'target_type', 'target_description', 'damage_description',
+                 'result', 'remarks'),
+        'numbers': ('attack_number', 'target_tonnage', 'target_range', 'target_speed',
+                    'own_depth', 'pdf_page'),
+    },
+    'ship_contact': {
+        'sql': """
+            SELECT id, patrol, observation_date, observation_time, contact_no, ship_type,
+                   range_yards, course, speed, method, latitude, longitude, remarks
+            FROM ship_contacts
+        """,
+        'text': ('ship_type', 'method', 'remarks'),
+        'numbers': ('range_yards', 'course', 'speed', 'latitude', 'longitude'),
+    },
+    'aircraft_contact': {
+        'sql': """
+            SELECT id, patrol, observation_date, observation_time, contact_no, aircraft_type,
+                   range_miles, course, speed, method, elevation_angle, latitude, longitude,
+                   probable_mission, remarks
+            FROM aircraft_contacts
+        """,
+        'text': ('aircraft_type', 'method', 'probable_mission', 'remarks'),
+        'numbers': ('range_miles', 'course', 'speed', 'elevation_angle', 'latitude', 'longitude'),
+    },
+}
+
+# Filterable numeric columns across all record types
+NUMBER_FIELDS = {'patrol'} | {field for spec in RECORD_TYPES.values() for field in spec['numbers']}
+
+# field op number, with or without spaces around the operator
+FILTER_PATTERN = re.compile(r'\b([a-z_]+)\s*(>=|<=|>|<|=)\s*(-?\d+(?:\.\d+)?)(?![\w.])', re.IGNORECASE)
+
+
+class RecordQueryError(ValueError):
+    """Raised for record searches with unknown or malformed filters."""
+
+
+def _plain(value):
+    """A database value as JSON-friendly text or number."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()[:10]
+    if isinstance(value, datetime.timedelta):  # MySQL TIME columns
+        minutes = int(value.total_seconds()) // 60
+        return f"{minutes // 60:02d}:{minutes % 60:02d}"
+    return value
+
+
+def load_database_records():
+    """
+    Contact and attack rows as record dicts {'type', 'id', 'patrol', 'date',
+    'time', 'fields', 'text'}. Returns [] if the database can't be reached,
+    so the index still builds without them.
+    """
+    try:
+        from db_config import get_db_connection
+        conn = get_db_connection()
+    except Exception as e:
+        print(f"Database unavailable, building without contact and attack records: {e}")
+        return []
+    records = []
+    try:
+        cursor = conn.cursor(dictionary=True)
+        for record_type, spec in RECORD_TYPES.items():
+            try:
+                cursor.execute(spec['sql'])
+                rows = cursor.fetchall()
+            except Exception as e:
+                print(f"Skipping {record_type} records: {e}")
+                continue
+            for row in rows:
+                row = {key: _plain(value) for key, value in row.items()}
+                date_key = 'attack_date' if record_type == 'attack' else 'observation_date'
+                time_key = 'attack_time' if record_type == 'attack' else 'observation_time'
+                records.append({
+                    'type': record_type,
+                    'id': row['id'],
+                    'patrol': row['patrol'],
+                    'date': row.get(date_key),
+                    'time': row.get(time_key),
+                    'fields': {key: value for key, value in row.items()
+                               if key not in spec['text'] and key not in ('id', 'patrol', date_key, time_key)
+                               and value is not None},
+                    'text': {field: str(row[field]) for field in spec['text'] if row.get(field)},
+                })
+        cursor.close()
+    finally:
+        conn.close()
+    return records
+
+
+def parse_record_query(query):
+    """
+    Split a record search into (text, [(field, operator, value)]): filters
+    are field, operator (>, >=, <, <=, =) and number, spaced or not, as in
+    target_tonnage>5000 or target_tonnage > 5000, and the rest is text.
+    Raises RecordQueryError for filters on columns that don't exist.
+    """
+    filters = []
+    for m in FILTER_PATTERN.finditer(query):
+        field, op, value = m.groups()
+        field = field.lower()
+        if field not in NUMBER_FIELDS:
+            raise RecordQueryError(f"Unknown field: {field} (use {', '.join(sorted(NUMBER_FIELDS))})")
+        filters.append((field, op, float(value)))
+    return ' '.join(FILTER_PATTERN.sub(' ', query).split()), filters
+
+
+class RecordIndex:
+    """Term and numeric lookups over the database records kept with a search index."""
+
+    def __init__(self, records):
+        self.records = records
+        self.postings = {}  # term -> sorted record ids
+        columns = {}
+        for record_id, record in enumerate(records):
+            terms = set()
+            for text in record['text'].values():
+                terms.update(tokenize(text))
+            for term in terms:
+                self.postings.setdefault(term, []).append(record_id)
+            numbers = dict(record['fields'], patrol=record['patrol'])
+            for field, value in numbers.items():
+                if field in NUMBER_FIELDS and isinstance(value, (int, float)):
+                    columns.setdefault(field, []).append((value, record_id))
+        self.columns = {}  # numeric field -> (sorted values, record ids in the same order)
+        for field, column in columns.items():
+            column.sort()
+            self.columns[field] = ([v for v, _ in column], [record_id for _, record_id in column])
+
+    def _filtered(self, field, op, value):
+        """Record ids whose field meets a filter, found by bisection."""
+        values, record_ids = self.columns.get(field, ([], []))
+        if op == '>':
+            selected = record_ids[bisect.bisect_right(values, value):]
+        elif op == '>=':
+            selected = record_ids[bisect.bisect_left(values, value):]
+        elif op == '<':
+            selected = record_ids[:bisect.bisect_left(values, value)]
+        elif op == '<=':
+            selected = record_ids[:bisect.bisect_right(values, value)]
+        else:
+            selected = record_ids[bisect.bisect_left(values, value):bisect.bisect_right(values, value)]
+        return set(selected)
+
+    def search(self, text, filters=(), types=None, date_range=None):
+        """
+        (record_id, field, start, end) of every record matching text (a
+        case-insensitive phrase, as in exact page search) and all filters,
+        in record order. With no text, every filtered record matches with
+        field None.
+        """
+        candidates = None
+        tokens = tokenize(text)
+        for token in tokens:
+            found = set(self.postings.get(token, ()))
+            candidates = found if candidates is None else candidates & found
+        for field, op, value in filters:
+            found = self._filtered(field, op, value)
+            candidates = found if candidates is None else candidates & found
+        if candidates is None:
+            if text.strip():
+                return []  # nothing searchable in the text
+            candidates = range(len(self.records))
+
+        pattern = re.compile(re.escape(text.strip()), re.IGNORECASE) if tokens else None
+        matches = []
+        for record_id in sorted(candidates):
+            record = self.records[record_id]
+            if types is not None and record['type'] not in types:
+                continue
+            if date_range is not None:
+                lo, hi = date_range
+                if record['date'] is None or (lo and record['date'] < lo) or (hi and record['date'] > hi):
+                    continue
+            if pattern is None:
+                matches.append((record_id, None, 0, 0))
+                continue
+            for field, value in record['text'].items():
+                m = pattern.search(value)
+                if m:
+                    matches.append((record_id, field, m.start(), m.end()))
+                    break
+        return matches
+
+    def make_hit(self, record_id, field, start, end, context_chars=150):
+        """A typed result dict for a record match."""
+        record = self.records[record_id]
+        hit = {
+            'type': record['type'],
+            'id': record['id'],
+            'patrol': record['patrol'],
+            'date': record['date'],
+            'time': record['time'],
+            'fields': record['fields'],
+            'field': field,
+        }
+        if field is not None:
+            value = record['text'][field]
+            context_start = max(0, start - context_chars)
+            hit['context'] = value[context_start:end + context_chars]
+            hit['match_start'] = start - context_start
+            hit['match_end'] = end - context_start
+            hit['matched_text'] = value[start:end]
+        hit['text'] = record['text']
+        return hit
+
+
+def parse_types(value):
+    """Record types from a comma-separated list; contact covers both contact types."""
+    types = set()
+    for name in (v.strip() for v in (value or '').split(',')):
+        if not name:
+            continue
+        if name == 'contact':
+            types.update(('ship_contact', 'aircraft_contact'))
+        elif name in RECORD_TYPES:
+            types.add(name)
+        else:
+            raise RecordQueryError(f"Unknown record type: {name}")
+    return types or None
+
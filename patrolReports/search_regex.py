@@ -0,0 +1,249 @@
+"""
+Regular expression search, run outside the web worker.
+
+Patterns are checked before use: bounded length, no backreferences, no nested
+unbounded quantifiers and no alternatives that can match the same text
+inside an unbounded repeat, like (a|a)*, (\w|\d)+ or (e|ee)+ (the usual
+catastrophic backtracking shapes), no huge counted repeats and nothing that
+can match empty text. Alternatives under a repeat must each start with a
+different literal character. Accepted patterns
+are run over the corpus by a small pool of processes kept per web worker,
+each mapping the corpus file once and replaced after REGEX_TASKS_PER_CHILD
+scans. Scans stop at the time limit or hit cap and whatever they found is
+returned as a partial result; a scan stuck past the limit gets its pool
+killed, so no pattern can hold a gunicorn worker anywhere near its timeout.
+"""
+
+import os
+import re
+import time
+import threading
+import multiprocessing
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+MAX_PATTERN_LENGTH = 200
+MAX_REPEAT_COUNT = 100
+REGEX_TIMEOUT = 10.0  # seconds per query, far below the gunicorn timeout
+REGEX_PROCESSES = 2
+REGEX_MAX_HITS = 5000
+REGEX_TASKS_PER_CHILD = 100  # scans before a pool process is replaced
+STUCK_GRACE = 1.0  # seconds past the time limit before a scan counts as stuck
+
+_regex_pool = None
+_regex_pool_pid = None
+_pool_lock = threading.Lock()
+_corpora = {}  # corpus path -> Corpus, in pool processes
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, 'POSSESSIVE_REPEAT'):
+    _REPEATS.add(sre_constants.POSSESSIVE_REPEAT)
+
+
+class RegexError(ValueError):
+    """Raised for patterns that are invalid or too expensive to run."""
+
+
+# Characters tried when checking whether two class members overlap, on top
+# of the members' own literals and range ends
+_SAMPLE_CHARS = range(0x300)
+
+_CATEGORY_PATTERNS = {
+    sre_constants.CATEGORY_DIGIT: r'\d', sre_constants.CATEGORY_NOT_DIGIT: r'\D',
+    sre_constants.CATEGORY_SPACE: r'\s', sre_constants.CATEGORY_NOT_SPACE: r'\S',
+    sre_constants.CATEGORY_WORD: r'\w', sre_constants.CATEGORY_NOT_WORD: r'\W',
+}
+
+
+def _member_test(op, av):
+    """Predicate on code points for one member of a character class, or None."""
+    if op == sre_constants.LITERAL:
+        return lambda c: c == av
+    if op == sre_constants.RANGE:
+        return lambda c: av[0] <= c <= av[1]
+    if op == sre_constants.CATEGORY and av in _CATEGORY_PATTERNS:
+        category = re.compile(_CATEGORY_PATTERNS[av])
+        return lambda c: category.match(chr(c)) is not None
+    return None
+
+
+def _overlapping_members(items):
+    """True if two members of a character class match a common character."""
+    if any(op == sre_constants.NEGATE for op, _ in items):
+        return False
+    tests = [_member_test(op, av) for op, av in items]
+    if any(test is None for test in tests):
+        return True  # unknown member: assume the worst
+    candidates = set(_SAMPLE_CHARS)
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            candidates.add(av)
+        elif op == sre_constants.RANGE:
+            candidates.update(av)
+    for i in range(len(tests)):
+        for j in range(i + 1, len(tests)):
+            if any(tests[i](c) and tests[j](c) for c in candidates):
+                return True
+    return False
+
+
+def _check_branch(branches):
+    """
+    Alternatives under an unbounded repeat must each start with a different
+    literal, so at most one of them can match at any point.
+    """
+    firsts = set()
+    for branch in branches:
+        if not branch or branch[0][0] != sre_constants.LITERAL:
+            raise RegexError("Alternatives inside a repeat must each start with a different "
+                             "letter, like (cat|dog)+ but not (e|ee)+")
+        first = chr(branch[0][1]).lower()
+        if first in firsts:
+            raise RegexError("Alternatives inside a repeat must each start with a different "
+                             "letter, like (cat|dog)+ but not (e|ee)+")
+        firsts.add(first)
+
+
+def _check(parsed, inside_repeat=False, inside_unbounded=False):
+    """Walk a parsed pattern, raising RegexError for risky constructs."""
+    for op, av in parsed:
+        if op == sre_constants.GROUPREF or op == sre_constants.GROUPREF_EXISTS:
+            raise RegexError("Backreferences are not supported")
+        if op in _REPEATS:
+            low, high, sub = av
+            unbounded = high == sre_constants.MAXREPEAT
+            if not unbounded and high > MAX_REPEAT_COUNT:
+                raise RegexError(f"Repeat counts are limited to {MAX_REPEAT_COUNT}")
+            if inside_repeat and (unbounded or high > 1):
+                raise RegexError("Nested repeats like (a+)+ are not allowed")
+            _check(sub, inside_repeat or unbounded or high > 1, inside_unbounded or unbounded)
+        elif op == sre_constants.SUBPATTERN:
+            _check(av[-1], inside_repeat, inside_unbounded)
+        elif op == sre_constants.BRANCH:
+            if inside_unbounded:
+                _check_branch(av[1])
+            for branch in av[1]:
+                _check(branch, inside_repeat, inside_unbounded)
+        elif op == sre_constants.IN:
+            # (\w|\d) is parsed into a class; its overlapping members are
+            # as ambiguous as the alternation was
+            if inside_unbounded and _overlapping_members(av):
+                raise RegexError("Overlapping alternatives like (\\w|\\d) inside a repeat "
+                                 "are not allowed")
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            _check(av[1], inside_repeat, inside_unbounded)
+        elif op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+            _check(av, inside_repeat, inside_unbounded)
+
+
+def compile_pattern(pattern):
+    """Compile a user pattern (case-insensitive) after checking its complexity."""
+    if not pattern:
+        raise RegexError("Empty pattern")
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        raise RegexError(f"Patterns are limited to {MAX_PATTERN_LENGTH} characters")
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except (re.error, OverflowError, RecursionError) as e:
+        raise RegexError(f"Invalid pattern: {e}")
+    _check(parsed)
+    if parsed.getwidth()[0] == 0:
+        raise RegexError("Pattern can match empty text")
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def _pool():
+    """This process's pool of regex processes, started on first use."""
+    global _regex_pool, _regex_pool_pid
+    with _pool_lock:
+        if _regex_pool is None or _regex_pool_pid != os.getpid():
+            # Pool processes come from a forkserver, a clean single-threaded
+            # process, never forked from a web worker running shard threads
+            ctx = multiprocessing.get_context('forkserver')
+            ctx.set_forkserver_preload(['search_regex', 'search_corpus'])
+            _regex_pool = ctx.Pool(REGEX_PROCESSES, maxtasksperchild=REGEX_TASKS_PER_CHILD)
+            _regex_pool_pid = os.getpid()
+        return _regex_pool
+
+
+def _discard_pool(pool):
+    """Kill a pool with a runaway scan; the next query starts a new one."""
+    global _regex_pool
+    with _pool_lock:
+        if _regex_pool is pool:
+            _regex_pool = None
+    pool.terminate()
+
+
+def _open_corpus(path, file_id):
+    """Pool process: the corpus at path, mapped once per process. None if it was replaced."""
+    from search_corpus import Corpus
+    corpus = _corpora.get(path)
+    if corpus is None or corpus.file_id != file_id:
+        if corpus is not None:
+            corpus.close()
+        corpus = _corpora[path] = Corpus(path)
+    return corpus if corpus.file_id == file_id else None
+
+
+def _scan(corpus_path, file_id, pattern, page_ids, max_hits, deadline):
+    """
+    Pool process: ({page_id: [(start, end), ...]}, partial) for the pages
+    with matches, stopping at the deadline or the hit cap.
+    """
+    corpus = _open_corpus(corpus_path, file_id)
+    if corpus is None:  # the index was rebuilt since the query started
+        return {}, True
+    matches = {}
+    hits = 0
+    for page_id in page_ids:
+        if time.time() >= deadline:
+            return matches, True
+        spans = [m.span() for m in pattern.finditer(corpus.page_text(page_id))]
+        if spans:
+            matches[page_id] = spans
+            hits += len(spans)
+            if hits >= max_hits:
+                return matches, True
+    return matches, False
+
+
+def find_matches(corpus, pattern, page_ids, timeout=REGEX_TIMEOUT,
+                 processes=REGEX_PROCESSES, max_hits=REGEX_MAX_HITS):
+    """
+    Run a compiled pattern over the given pages of a corpus in the regex
+    process pool. Returns ({page_id: [(start, end), ...]}, partial) where
+    partial is True if the time limit or hit cap cut the search short.
+    """
+    page_ids = list(page_ids)
+    processes = max(1, min(processes, len(page_ids)))
+    if not page_ids:
+        return {}, False
+
+    pool = _pool()
+    deadline = time.time() + timeout
+    chunk = -(-len(page_ids) // processes)
+    results = [pool.apply_async(_scan, (corpus.path, corpus.file_id, pattern,
+                                        page_ids[i * chunk:(i + 1) * chunk], max_hits, deadline))
+               for i in range(processes)]
+
+    matches = {}
+    partial = False
+    for result in results:
+        # Scans check the deadline between pages; one stuck on a single
+        # page past it is killed with the pool
+        try:
+            found, cut = result.get(timeout=max(0, deadline - time.time()) + STUCK_GRACE)
+        except multiprocessing.TimeoutError:
+            _discard_pool(pool)
+            partial = True
+            continue
+        matches.update(found)
+        partial = partial or cut
+    if sum(len(spans) for spans in matches.values()) >= max_hits:
+        partial = True
+    return matches, partial
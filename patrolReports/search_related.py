@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+"More like this" for report pages.
+
+Every page is a TF-IDF vector over the index vocabulary, built straight from
+the posting lists of all boat shards. Its nearest neighbours by cosine
+similarity, leaving out pages of the same report, are worked out offline and
+saved to related.json, so a request is just a lookup. With --svd the vectors
+are first reduced by truncated SVD, which also matches pages that describe
+the same thing in different words.
+
+Building needs NumPy and SciPy; serving the results does not. The neighbours
+are tied to the shard generations they were built from, and lookups after a
+rebuild are flagged as stale until this is run again.
+
+Usage:
+    python search_related.py              # 10 neighbours per page
+    python search_related.py --k 20 --svd 150
+"""
+
+import os
+import json
+import bisect
+import argparse
+
+import search_shards
+from search_index import INDEX_DIR
+
+RELATED_PATH = os.path.join(INDEX_DIR, 'related.json')
+RELATED_VERSION = 1
+
+# Neighbours kept per page
+TOP_K = 10
+
+# Terms on more than this share of pages say nothing about what a page is about
+MAX_DF_FRACTION = 0.3
+
+# Terms on fewer pages than this can't link two pages together
+MIN_DF = 2
+
+# Similarities below this aren't worth showing
+MIN_SCORE = 0.05
+
+# Pages compared against the whole corpus at a time; bounds the dense
+# similarity block to BLOCK_ROWS x pages float32s
+BLOCK_ROWS = 256
+
+
+def _is_content_term(term):
+    # Times, positions and serial numbers are digits, and shared numbers are
+    # mostly coincidence
+    return len(term) > 2 and term.isalpha()
+
+
+def page_term_matrix(shard_set):
+    """
+    The TF-IDF page-term matrix of every page in the shard set, rows L2
+    normalized. Returns (matrix, pages, doc_ids) where pages[row] is
+    [pdf_file, page_num] and doc_ids[row] numbers the row's report.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    pages = []
+    doc_ids = []
+    rows = []
+    cols = []
+    tfs = []
+    term_ids = {}
+    doc_base = 0
+    for _, shard in shard_set.shards:
+        page_base = len(pages)
+        for doc_id, page_num in shard.pages:
+            pages.append([shard.documents[doc_id], page_num])
+            doc_ids.append(doc_base + doc_id)
+        doc_base += len(shard.documents)
+        for term, entries in shard.postings.items():
+            if not _is_content_term(term):
+                continue
+            col = term_ids.setdefault(term, len(term_ids))
+            for page_id, positions in entries:
+                rows.append(page_base + page_id)
+                cols.append(col)
+                tfs.append(len(positions))
+
+    n_pages = len(pages)
+    matrix = sparse.csr_matrix(
+        (np.array(tfs, dtype=np.float32), (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))),
+        shape=(n_pages, len(term_ids)))
+    df = np.diff(matrix.tocsc().indptr)
+    keep = np.flatnonzero((df >= MIN_DF) & (df <= max(MIN_DF, MAX_DF_FRACTION * n_pages)))
+    matrix = matrix[:, keep].tocsr()
+    idf = np.log((1 + n_pages) / (1 + df[keep])).astype(np.float32) + 1
+    # Sublinear term frequency, so a word repeated down a page doesn't swamp it
+    matrix.data = 1 + np.log(matrix.data)
+    matrix = matrix @ sparse.diags(idf)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix = sparse.diags(1 / norms) @ matrix
+    return matrix.tocsr().astype(np.float32), pages, np.array(doc_ids)
+
+
+def reduce_dimensions(matrix, dims):
+    """Dense, row-normalized truncated SVD vectors of a page-term matrix."""
+    import numpy as np
+    from scipy.sparse.linalg import svds
+
+    dims = min(dims, min(matrix.shape) - 1)
+    u, s, _ = svds(matrix.astype(np.float64), k=dims)
+    vectors = (u * s).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = 1
+    return vectors / norms[:, None]
+
+
+def top_neighbours(vectors, doc_ids, k=TOP_K, min_score=MIN_SCORE):
+    """
+    [[row, score], ...] of each row's k most similar rows in other reports,
+    best first. vectors are row-normalized, sparse or dense.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    n_rows = vectors.shape[0]
+    transposed = vectors.T.tocsc() if sparse.issparse(vectors) else vectors.T
+    neighbours = []
+    for start in range(0, n_rows, BLOCK_ROWS):
+        end = min(start + BLOCK_ROWS, n_rows)
+        block = vectors[start:end] @ transposed
+        block = block.toarray() if sparse.issparse(block) else np.asarray(block)
+        block[doc_ids[start:end, None] == doc_ids[None, :]] = -1
+        count = min(k, n_rows - 1)
+        if count <= 0:
+            neighbours.extend([] for _ in range(start, end))
+            continue
+        best = np.argpartition(-block, count - 1, axis=1)[:, :count]
+        for i, candidates in enumerate(best):
+            scores = block[i, candidates]
+            order = np.argsort(-scores, kind='stable')
+            neighbours.append([[int(candidates[j]), round(float(scores[j]), 4)]
+                               for j in order if scores[j] >= min_score])
+    return neighbours
+
+
+def build(shard_set, path=RELATED_PATH, k=TOP_K, svd_dims=None):
+    """Compute every page's neighbours and save them. Returns the saved data."""
+    matrix, pages, doc_ids = page_term_matrix(shard_set)
+    vectors = reduce_dimensions(matrix, svd_dims) if svd_dims else matrix
+    data = {
+        'version': RELATED_VERSION,
+        'generations': {boat: shard.generation for boat, shard in shard_set.shards},
+        'k': k,
+        'svd_dims': svd_dims,
+        'terms': matrix.shape[1],
+        'pages': pages,
+        'neighbours': top_neighbours(vectors, doc_ids, k),
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return data
+
+
+class RelatedPages:
+    """The saved neighbour lists, reloaded whenever the file is replaced."""
+
+    def __init__(self, path=RELATED_PATH):
+        self.path = path
+        self.data = None
+        self._rows = {}
+        self._file_id = None
+
+    def ensure_current(self):
+        """Load the file if it changed. Returns False if there isn't one."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self.data = None
+            self._rows = {}
+            self._file_id = None
+            return False
+        if self._file_id == (st.st_ino, st.st_mtime_ns):
+            return True
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading {self.path}: {e}")
+            return False
+        if data.get('version') != RELATED_VERSION:
+            return False
+        self.data = data
+        self._rows = {(pdf_file, page_num): row for row, (pdf_file, page_num) in enumerate(data['pages'])}
+        self._file_id = (st.st_ino, st.st_mtime_ns)
+        return True
+
+    def is_stale(self, shard_set):
+        """True if any shard was rebuilt since the neighbours were computed."""
+        generations = self.data['generations']
+        return any(generations.get(boat) != shard.generation for boat, shard in shard_set.shards)
+
+    def lookup(self, pdf_file, page_num, limit=TOP_K):
+        """[{'pdf_file', 'page_num', 'score'}] most similar first, or None for an unknown page."""
+        row = self._rows.get((pdf_file, page_num))
+        if row is None:
+            return None
+        pages = self.data['pages']
+        return [{'pdf_file': pages[other][0], 'page_num': pages[other][1], 'score': score}
+                for other, score in self.data['neighbours'][row][:limit]]
+
+
+def page_preview(shard_set, pdf_file, page_num, chars=200):
+    """The start of a page's normalized text, or '' if no shard has it."""
+    for _, shard in shard_set.shards:
+        try:
+            doc_id = shard.documents.index(pdf_file)
+        except ValueError:
+            continue
+        page_id = bisect.bisect_left(shard.pages, (doc_id, page_num))
+        if page_id == len(shard.pages) or shard.pages[page_id] != (doc_id, page_num):
+            return ''
+        text = ' '.join(shard.corpus.normalized_text(page_id).text.split())
+        return text if len(text) <= chars else text[:chars].rsplit(' ', 1)[0] + '...'
+    return ''
+
+
+# One copy per worker process
+_related = None
+
+
+def get_related():
+    global _related
+    if _related is None:
+        _related = RelatedPages()
+    return _related
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute related pages for every report page.')
+    parser.add_argument('--k', type=int, default=TOP_K, help='neighbours kept per page')
+    parser.add_argument('--svd', type=int, default=None, metavar='DIMS',
+                        help='compare truncated SVD vectors of this many dimensions')
+    args = parser.parse_args()
+
+    shard_set = search_shards.get_shards()
+    print(f"Building related pages for {len(shard_set.pages)} pages "
+          f"({', '.join(boat for boat, _ in shard_set.shards)})")
+    data = build(shard_set, k=args.k, svd_dims=args.svd)
+    linked = sum(1 for neighbours in data['neighbours'] if neighbours)
+    mean = sum(len(n) for n in data['neighbours']) / len(data['neighbours']) if data['neighbours'] else 0
+    print(f"  {data['terms']} terms, {linked} pages with neighbours, "
+          f"{mean:.1f} neighbours per page on average")
+    print(f"  Saved to {RELATED_PATH}")
+    print("Done!")
+
+
+if __name__ == '__main__':
+    main()
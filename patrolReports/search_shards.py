@@ -0,0 +1,365 @@
+"""
+Per-boat search shards.
+
+The archive holds USS Cod's patrol reports, but reports for other boats can
+be added as partitions under boats/:
+
+    boats/<boat>/reports/       OCR JSON and PDFs, named like static/reports
+                                (USS_Cobia_1st_Patrol_Report.pdf, ...)
+    boats/<boat>/corrections/   page corrections
+
+Each boat gets its own corpus and index under search_index/<boat>/, built and
+kept current on its own, so a correction to one boat's report rebuilds only
+that shard. Cod keeps its original locations (static/reports, corrections/
+and search_index/).
+
+A ShardSet answers the same calls as a SearchIndex. Shards are searched one
+after another in the request's thread, or at once in a thread pool if
+SEARCH_SHARD_THREADS asks for one; hits in report order are merged by their
+(report, page, offset) keys, so cursors look the same as for one index, and
+ranked hits are merged by score. Report names must be unique across boats,
+which the boat name in them takes care of.
+"""
+
+import os
+import heapq
+import itertools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import search_trace
+from search_index import (BASE_DIR, CORRECTIONS_DIR, INDEX_DIR, REPORTS_DIR,
+                          SearchIndex, decode_cursor, encode_cursor)
+
+BOATS_DIR = os.environ.get('SEARCH_BOATS_DIR', os.path.join(BASE_DIR, 'boats'))
+DEFAULT_BOAT = 'cod'
+
+# Threads for fanning a query out over shards; 1 searches them in turn in
+# the request's thread. Shard work is mostly Python and shares the GIL: on
+# an 8-boat generated archive (benchmark_search.py --archive) four threads
+# were slower than searching the shards in turn in every mode, so a pool is
+# only worth trying where regex scans (run in their own processes) or cold
+# corpus reads dominate
+SHARD_THREADS = int(os.environ.get('SEARCH_SHARD_THREADS', 1))
+
+
+def list_boats(boats_dir=BOATS_DIR):
+    """Boat names with a search partition: Cod, then boats/<boat>/reports in name order."""
+    boats = [DEFAULT_BOAT]
+    try:
+        names = sorted(os.listdir(boats_dir))
+    except OSError:
+        names = []
+    for name in names:
+        if name != DEFAULT_BOAT and os.path.isdir(os.path.join(boats_dir, name, 'reports')):
+            boats.append(name)
+    return boats
+
+
+def boat_dirs(boat, boats_dir=BOATS_DIR):
+    """(reports_dir, corrections_dir, index_dir) of a boat's partition."""
+    if boat == DEFAULT_BOAT:
+        return REPORTS_DIR, CORRECTIONS_DIR, INDEX_DIR
+    return (os.path.join(boats_dir, boat, 'reports'),
+            os.path.join(boats_dir, boat, 'corrections'),
+            os.path.join(INDEX_DIR, boat))
+
+
+def report_boat(pdf_file):
+    """The boat whose partition holds a report, or None."""
+    for boat in list_boats():
+        if os.path.exists(os.path.join(boat_dirs(boat)[0], pdf_file)):
+            return boat
+    return None
+
+
+def _merge_counts(lists):
+    """Sum [{'value', 'count'}] facet lists by value."""
+    totals = {}
+    for entries in lists:
+        for entry in entries:
+            totals[entry['value']] = totals.get(entry['value'], 0) + entry['count']
+    return [{'value': value, 'count': n} for value, n in sorted(totals.items())]
+
+
+def _label_hits(boat, keyed_hits):
+    for key, hit in keyed_hits:
+        hit['boat'] = boat
+        yield key, hit
+
+
+class ShardSet:
+    """A group of per-boat SearchIndex shards searched as one."""
+
+    def __init__(self, shards, pool=None):
+        self.shards = shards  # [(boat, SearchIndex)] in boat order
+        self._pool = pool     # ThreadPoolExecutor, or None to search shards in turn
+
+    @property
+    def generation(self):
+        # Each shard's generation only grows, so their sum changes whenever
+        # any shard is rebuilt or a boat is added
+        return sum(shard.generation for _, shard in self.shards)
+
+    @property
+    def generations(self):
+        """{boat: generation} of every shard, e.g. for keying cached results."""
+        return {boat: shard.generation for boat, shard in self.shards}
+
+    @property
+    def documents(self):
+        return [pdf_file for _, shard in self.shards for pdf_file in shard.documents]
+
+    @property
+    def pages(self):
+        return [page for _, shard in self.shards for page in shard.pages]
+
+    def _each(self, call):
+        """Run call(shard) on every shard, concurrently if there is a pool."""
+        if self._pool is None or len(self.shards) == 1:
+            return [call(shard) for _, shard in self.shards]
+        trace = search_trace.current()
+        if trace is None:
+            futures = [self._pool.submit(contextvars.copy_context().run, call, shard)
+                       for _, shard in self.shards]
+            return [future.result() for future in futures]
+        # Each shard thread times into its own child of the request's trace,
+        # folded back as the slowest shard per phase once all are done
+        children = [trace.fork() for _ in self.shards]
+
+        def run(child, shard):
+            search_trace.activate(child)
+            return call(shard)
+
+        futures = [self._pool.submit(contextvars.copy_context().run, run, child, shard)
+                   for child, (_, shard) in zip(children, self.shards)]
+        wait(futures)
+        trace.join(children)
+        return [future.result() for future in futures]
+
+    def _plan(self, query, mode, max_distance, date_range):
+        """Build every shard's match plan; later calls reuse them."""
+        return self._each(lambda shard: shard.estimate_hits(query, mode, max_distance, date_range))
+
+    def estimate_hits(self, query, mode='exact', max_distance=None, date_range=None):
+        estimates = self._plan(query, mode, max_distance, date_range)
+        if any(n is None for n in estimates):
+            return None
+        return sum(estimates)
+
+    def is_partial(self, query, mode='exact', max_distance=None, date_range=None):
+        return any(shard.is_partial(query, mode, max_distance, date_range) for _, shard in self.shards)
+
+    def facets(self, query, mode='exact', max_distance=None, date_range=None):
+        """Shard facets added together, plus estimated hits per boat."""
+        estimates = self._plan(query, mode, max_distance, date_range)
+        shard_facets = [shard.facets(query, mode, max_distance, date_range) for _, shard in self.shards]
+        if any(f is None for f in shard_facets):
+            return None
+        return {
+            'boat': [{'value': boat, 'count': n} for (boat, _), n in zip(self.shards, estimates) if n],
+            'patrol': _merge_counts(f['patrol'] for f in shard_facets),
+            'report': sorted((entry for f in shard_facets for entry in f['report']),
+                             key=lambda entry: entry['value']),
+            'month': _merge_counts(f['month'] for f in shard_facets),
+        }
+
+    def _keyed_hits(self, query, context_chars, after, mode, max_distance, date_range):
+        self._plan(query, mode, max_distance, date_range)
+        streams = [_label_hits(boat, shard.keyed_hits(query, context_chars, after, mode,
+                                                      max_distance, date_range))
+                   for boat, shard in self.shards]
+        return heapq.merge(*streams, key=lambda item: item[0])
+
+    def keyed_hits(self, query, context_chars=150, after=None, mode='exact', max_distance=None,
+                   date_range=None):
+        """(key, hit) for every match after the key after, merged in key order."""
+        return self._keyed_hits(query, context_chars, after, mode, max_distance, date_range)
+
+    def iter_hits(self, query, context_chars=150, cursor=None, mode='exact', max_distance=None,
+                  date_range=None):
+        after = decode_cursor(cursor) if cursor else None
+        for _, hit in self._keyed_hits(query, context_chars, after, mode, max_distance, date_range):
+            yield hit
+
+    def search(self, query, context_chars=150, mode='exact', max_distance=None, date_range=None):
+        return list(self.iter_hits(query, context_chars, mode=mode, max_distance=max_distance,
+                                   date_range=date_range))
+
+    def search_page(self, query, limit, cursor=None, context_chars=150, mode='exact',
+                    max_distance=None, date_range=None):
+        """One page of merged matches, as SearchIndex.search_page."""
+        after = decode_cursor(cursor) if cursor else None
+        hits = self._keyed_hits(query, context_chars, after, mode, max_distance, date_range)
+        page = list(itertools.islice(hits, limit + 1))
+        return {
+            'results': [hit for _, hit in page[:limit]],
+            'next_cursor': encode_cursor(page[limit - 1][0]) if len(page) > limit else None,
+            'total_estimate': self.estimate_hits(query, mode, max_distance, date_range),
+        }
+
+    def search_ranked(self, query, limit=20, offset=0, context_chars=150, mode='exact',
+                      max_distance=None, date_range=None):
+        """
+        Best pages across all shards. BM25 statistics (pages, total length
+        and document frequencies) are first added up over all shards, so
+        scores are comparable; each shard then ranks its own top
+        offset + limit pages with them and the lists are merged by score,
+        ties in report and page order.
+        """
+        shard_stats = self._each(lambda shard: shard.ranking_stats(query, mode, max_distance))
+        stats = {
+            'pages': sum(s['pages'] for s in shard_stats),
+            'length': sum(s['length'] for s in shard_stats),
+            'df': [sum(dfs) for dfs in itertools.zip_longest(*(s['df'] for s in shard_stats),
+                                                             fillvalue=0)],
+        }
+        ranked = self._each(lambda shard: shard.search_ranked(
+            query, offset + limit, 0, context_chars, mode, max_distance, date_range, stats))
+        merged = []
+        for (boat, _), result in zip(self.shards, ranked):
+            merged.extend(dict(hit, boat=boat) for hit in result['results'])
+        merged.sort(key=lambda hit: (-hit['score'], hit['pdf_file'], hit['page_num']))
+        return {
+            'results': merged[offset:offset + limit],
+            'total_estimate': sum(result['total_estimate'] for result in ranked),
+        }
+
+    def search_records(self, query, types=None, date_range=None, limit=20, offset=0,
+                       context_chars=150):
+        """Database records from every shard, in boat order."""
+        found = self._each(lambda shard: shard.search_records(
+            query, types, date_range, offset + limit, 0, context_chars))
+        merged = []
+        for (boat, _), result in zip(self.shards, found):
+            merged.extend(dict(hit, boat=boat) for hit in result['results'])
+        return {
+            'results': merged[offset:offset + limit],
+            'total': sum(result['total'] for result in found),
+        }
+
+    def concordance(self, query, sort='right', limit=50, cursor=None, width=8, date_range=None):
+        """
+        One page of concordance lines from every shard, merged by sort key:
+        {'lines', 'total', 'next_cursor'}. Raises ConcordanceError for bad
+        queries or cursors.
+        """
+        from search_concordance import decode_key, encode_key
+        after = decode_key(cursor, sort) if cursor else None
+        found = self._each(lambda shard: shard.concordance_keys(query, sort, after, limit + 1, date_range))
+        streams = [[(key, boat, shard, page_id, start) for key, page_id, start in keys]
+                   for (boat, shard), (keys, _) in zip(self.shards, found)]
+        page = list(itertools.islice(heapq.merge(*streams, key=lambda item: item[0]), limit + 1))
+        lines = []
+        for _, boat, shard, page_id, start in page[:limit]:
+            line = shard.concordance_line(query, page_id, start, width, sort, date_range)
+            line['boat'] = boat
+            lines.append(line)
+        return {
+            'lines': lines,
+            'total': sum(total for _, total in found),
+            'next_cursor': encode_key(page[limit - 1][0]) if len(page) > limit else None,
+        }
+
+    def collocations(self, query, window=3, sort='right', date_range=None):
+        """
+        Words most often found within window positions left and right of
+        query in every shard, with mutual information (see
+        search_concordance.rank_collocates).
+        """
+        from search_concordance import rank_collocates
+        found = self._each(lambda shard: shard.collocate_counts(query, window, sort, date_range))
+        occurrences = sum(n for n, _ in found)
+        token_count = sum(sum(shard.page_lengths) for _, shard in self.shards)
+        result = {}
+        for side in ('left', 'right'):
+            counts = {}
+            for _, side_counts in found:
+                for term, n in side_counts[side].items():
+                    counts[term] = counts.get(term, 0) + n
+            result[side] = rank_collocates(
+                counts, occurrences, lambda term: sum(shard.term_frequency(term) for _, shard in self.shards),
+                token_count, window)
+        return result
+
+    def document_boxes(self, query, pdf_file, mode='exact', max_distance=None, date_range=None):
+        for _, shard in self.shards:
+            if pdf_file in shard.documents:
+                return shard.document_boxes(query, pdf_file, mode, max_distance, date_range)
+        return []
+
+    def suggest(self, query):
+        """The first shard's "did you mean", in boat order."""
+        for _, shard in self.shards:
+            suggestion = shard.suggest(query)
+            if suggestion is not None:
+                return suggestion
+        return None
+
+    def complete(self, prefix, limit=10):
+        """Autocomplete suggestions from every shard, counts added together."""
+        merged = {}
+        for _, shard in self.shards:
+            for suggestion in shard.complete(prefix, limit):
+                entry = merged.setdefault(suggestion['text'], dict(suggestion, count=0))
+                entry['count'] += suggestion['count']
+        return sorted(merged.values(), key=lambda s: (-s['count'], s['text']))[:limit]
+
+
+# Shards and the fan-out pool, per worker process
+_shards = {}
+_pool = None
+
+
+def get_shard(boat):
+    """This process's index for one boat, kept current like search_index.get_index."""
+    if boat not in _shards:
+        reports_dir, corrections_dir, index_dir = boat_dirs(boat)
+        _shards[boat] = SearchIndex(reports_dir, corrections_dir, index_dir,
+                                    use_database=(boat == DEFAULT_BOAT))
+    return _shards[boat]
+
+
+def get_shards(boats=None):
+    """
+    A ShardSet over the given boats (default all), each shard checked and
+    reloaded or rebuilt as needed. Raises ValueError for an unknown boat.
+    """
+    global _pool
+    available = list_boats()
+    if boats is None:
+        boats = available
+    for boat in boats:
+        if boat not in available:
+            raise ValueError(f"Unknown boat: {boat}")
+    if _pool is None and SHARD_THREADS > 1:
+        _pool = ThreadPoolExecutor(max_workers=SHARD_THREADS, thread_name_prefix='shard')
+    shards = [(boat, get_shard(boat)) for boat in boats]
+    shard_set = ShardSet(shards, _pool)
+    shard_set._each(lambda shard: shard.ensure_current())
+    return shard_set
+
+
+def prebuild():
+    """
+    Bring every shard's corpus and index on disk up to date without keeping
+    them loaded, so workers forked afterwards only have to map the files.
+    """
+    for boat in list_boats():
+        reports_dir, corrections_dir, index_dir = boat_dirs(boat)
+        SearchIndex(reports_dir, corrections_dir, index_dir,
+                    use_database=(boat == DEFAULT_BOAT)).ensure_current()
+
+
+def main():
+    for boat in list_boats():
+        shard = get_shard(boat)
+        print(f"{boat}: building {shard.index_dir} from {shard.reports_dir}")
+        shard.build()
+        print(f"  Generation {shard.generation}: {len(shard.documents)} documents, "
+              f"{len(shard.pages)} pages, {len(shard.vocab)} terms")
+    print("Done!")
+
+
+if __name__ == '__main__':
+    main()
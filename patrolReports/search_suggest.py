@@ -0,0 +1,96 @@
+"""
+Prefix completion for the search box.
+
+Suggestions are the corpus vocabulary plus the glossary terms, weighted by how
+often they occur. They are kept as one sorted array of keys so a prefix
+is a contiguous range found by bisection. Short prefixes cover thousands of
+entries, so their best completions are worked out once at index build time
+and a request only ever ranks a small range.
+"""
+
+import bisect
+import heapq
+import itertools
+
+# Completions returned at most per request
+TOP_K = 20
+
+# Prefix ranges larger than this get their top completions precomputed
+SCAN_LIMIT = 64
+
+# Corpus terms seen fewer times than this are mostly OCR noise
+MIN_TERM_COUNT = 2
+
+# Glossary terms rank as though they occurred this many times as often
+GLOSSARY_WEIGHT = 2
+
+
+def suggestion_key(text):
+    """Lowercased text with whitespace collapsed, as matched against prefixes."""
+    return ' '.join(text.lower().split())
+
+
+def build_entries(vocab, frequencies, glossary_counts):
+    """
+    Suggestion entries [key, text, weight, category] sorted by key.
+    glossary_counts is [(term, category, count)]; a glossary term replaces the
+    plain vocabulary entry with the same key.
+    """
+    entries = {}
+    for term, count in zip(vocab, frequencies):
+        if count >= MIN_TERM_COUNT and len(term) > 1:
+            entries[term] = [term, term, count, None]
+    for term, category, count in glossary_counts:
+        if count:
+            key = suggestion_key(term)
+            entries[key] = [key, term, count * GLOSSARY_WEIGHT, category]
+    return [entries[key] for key in sorted(entries)]
+
+
+def precompute_top(entries, top_k=TOP_K, scan_limit=SCAN_LIMIT):
+    """
+    {prefix: [entry ids]} of the top_k completions for every prefix matching
+    more than scan_limit entries.
+    """
+    top = {}
+    length = 1
+    while True:
+        found = False
+        groups = itertools.groupby(range(len(entries)), key=lambda i: entries[i][0][:length])
+        for prefix, ids in groups:
+            ids = list(ids)
+            if len(prefix) == length and len(ids) > scan_limit:
+                top[prefix] = heapq.nsmallest(top_k, ids,
+                                              key=lambda i: (-entries[i][2], entries[i][0]))
+                found = True
+        if not found:
+            return top
+        length += 1
+
+
+class Completer:
+    """Sorted suggestion entries plus precomputed completions for busy prefixes."""
+
+    def __init__(self, entries, top):
+        self.entries = entries
+        self.keys = [entry[0] for entry in entries]
+        self.top = top
+
+    def complete(self, prefix, limit=10):
+        """Best completions of prefix: [{'text', 'count', 'category'}], most frequent first."""
+        prefix = suggestion_key(prefix)
+        limit = max(1, min(limit, TOP_K))
+        if not prefix:
+            return []
+        ids = self.top.get(prefix)
+        if ids is None:
+            lo = bisect.bisect_left(self.keys, prefix)
+            hi = bisect.bisect_left(self.keys, prefix + '\uffff')
+            ids = heapq.nsmallest(limit, range(lo, hi),
+                                  key=lambda i: (-self.entries[i][2], self.keys[i]))
+        results = []
+        for i in ids[:limit]:
+            _, text, weight, category = self.entries[i]
+            count = weight // GLOSSARY_WEIGHT if category else weight
+            results.append({'text': text, 'count': count, 'category': category})
+        return results
@@ -0,0 +1,86 @@
+"""
+Normalized text layer for search snippets.
+
+OCR text is full of line breaks, runs of spaces and words hyphenated across
+lines. Each page is normalized once at index build time: words split as
+"tor-\\npedo" are joined and every run of whitespace becomes a single space.
+An offset map records where the normalized text drifts from the raw OCR, so
+match offsets found in the raw text can be carried over to the normalized
+text (and back) without rescanning the page.
+"""
+
+import re
+import bisect
+from array import array
+
+# A hyphen at a line end between letters, continuing in lowercase, or any
+# run of whitespace
+NORMALIZE_PATTERN = re.compile(r'(?<=[^\W\d_])-[ \t]*\r?\n\s*(?=[a-z])|\s+')
+
+
+def normalize_text(text):
+    """
+    Normalize raw page text. Returns (normalized, norm_starts, raw_starts):
+    the offset map is a list of anchors where normalized[norm_starts[i]:]
+    lines up with text[raw_starts[i]:] until the next anchor.
+    """
+    parts = []
+    norm_starts = array('I', [0])
+    raw_starts = array('I', [0])
+    norm_length = 0
+    raw_pos = 0
+    for m in NORMALIZE_PATTERN.finditer(text):
+        segment = text[raw_pos:m.start()]
+        parts.append(segment)
+        norm_length += len(segment)
+        # Whitespace becomes one space, except at either end of the page;
+        # a line-break hyphen disappears
+        if m.group()[0] == '-' or m.start() == 0 or m.end() == len(text):
+            replacement = ''
+        else:
+            replacement = ' '
+        parts.append(replacement)
+        norm_length += len(replacement)
+        raw_pos = m.end()
+        if m.end() - m.start() != len(replacement):
+            norm_starts.append(norm_length)
+            raw_starts.append(raw_pos)
+    parts.append(text[raw_pos:])
+    return ''.join(parts), norm_starts, raw_starts
+
+
+class NormalizedText:
+    """A page's normalized text with its offset map back to the raw text."""
+
+    def __init__(self, text, norm_starts, raw_starts):
+        self.text = text
+        self.norm_starts = norm_starts
+        self.raw_starts = raw_starts
+
+    def to_normalized(self, raw_offset):
+        """Normalized offset for a raw offset; removed characters map to what follows them."""
+        i = bisect.bisect_right(self.raw_starts, raw_offset) - 1
+        offset = self.norm_starts[i] + raw_offset - self.raw_starts[i]
+        if i + 1 < len(self.norm_starts):
+            offset = min(offset, self.norm_starts[i + 1])
+        return min(offset, len(self.text))
+
+    def to_raw(self, norm_offset):
+        """Raw offset for a normalized offset."""
+        i = bisect.bisect_right(self.norm_starts, norm_offset) - 1
+        return self.raw_starts[i] + norm_offset - self.norm_starts[i]
+
+    def snippet(self, start, end, context_chars=150):
+        """
+        Context around normalized text[start:end], widened to whole words.
+        Returns (context, match_start, match_end) with offsets into context.
+        """
+        text = self.text
+        context_start = max(0, start - context_chars)
+        context_end = min(len(text), end + context_chars)
+        if context_start > 0:
+            context_start = text.rfind(' ', 0, context_start) + 1
+        if context_end < len(text):
+            space = text.find(' ', context_end)
+            context_end = space if space != -1 else len(text)
+        return text[context_start:context_end], start - context_start, end - context_start
@@ -0,0 +1,100 @@
+"""
+Per-query timing spans and counters for the search path.
+
+A Trace is made current for the duration of a request; code on the search
+path records phases and counts against whatever trace is current, and does
+nothing when there is none, so the index works the same from scripts.
+Work fanned out over threads records into a child trace per thread (see
+fork/join), so a phase that ran on several shards at once counts the
+slowest of them rather than their sum and stays within the wall time.
+Aggregation and reporting live in search_metrics.py.
+"""
+
+import time
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+
+_current = contextvars.ContextVar('search_trace', default=None)
+_NO_SPAN = nullcontext()
+
+
+class Trace:
+    """Time spent per phase and counters for one request."""
+
+    def __init__(self, name, label, params=None):
+        self.name = name
+        self.label = label
+        self.params = params or {}
+        self.phases = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.total_ms = None
+        self.root = self  # the request's own trace, also for forked children
+        self._lock = threading.Lock()
+
+    def add_time(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds * 1000
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def fork(self):
+        """A child trace for one of several threads working in parallel."""
+        child = Trace(self.name, self.label)
+        child.root = self.root
+        return child
+
+    def join(self, children):
+        """Fold in the children of a parallel fan-out: each phase adds the
+        longest time any child spent in it, counters add up."""
+        with self._lock:
+            for phase in {phase for child in children for phase in child.phases}:
+                longest = max(child.phases.get(phase, 0.0) for child in children)
+                self.phases[phase] = self.phases.get(phase, 0.0) + longest
+            for child in children:
+                for name, n in child.counters.items():
+                    self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def span(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def finish(self):
+        if self.total_ms is None:
+            self.total_ms = (time.perf_counter() - self.started) * 1000
+        return self.total_ms
+
+
+def activate(trace):
+    """Make trace the current one (None to clear)."""
+    _current.set(trace)
+
+
+def current():
+    return _current.get()
+
+
+def request():
+    """The current request's trace, also from its shard threads, or None."""
+    trace = _current.get()
+    return trace.root if trace is not None else None
+
+
+def span(phase):
+    """Context manager timing a phase of the current trace, if any."""
+    trace = _current.get()
+    return trace.span(phase) if trace is not None else _NO_SPAN
+
+
+def count(name, n=1):
+    """Add to a counter of the current trace, if any."""
+    trace = _current.get()
+    if trace is not None:
+        trace.count(name, n)